@@ -0,0 +1,140 @@
+#!/usr/bin/env python2
+from __future__ import print_function
+
+# snapshotting many timelines in one run
+#
+# every timeline is snapshotted in a worker process of its own. timelines on different file systems
+# run in parallel, the number of concurrent snapshots on the same device is limited, so the run
+# takes about as long as the busiest file system instead of the sum of all of them. a worker which
+# dies without a result (killed, out of memory, ...) counts as a failed snapshot.
+
+import os
+import time
+import logging
+import traceback
+import multiprocessing
+from collections import namedtuple
+
+import timeline
+import locking
+
+Result = namedtuple('Result', ['name', 'device', 'snapshot', 'elapsed', 'files', 'bytes', 'error'])
+
+
+def _snapshot_worker(path, incremental, lock_paths):
+    """ runs in a worker process: snapshots one timeline while holding shared locks on <lock_paths>,
+        returns a Result
+    """
+
+    started = time.time()
+    name = os.path.basename(path)
+    device = os.stat(path).st_dev
+    try:
+        t = timeline.Timeline.load(path)
+        with locking.hold(lock_paths, shared=True):
+            snapshot = t.create_snapshot(incremental=incremental)
+        stats = t.get_snapshot(snapshot).get('clone_stats', {})
+        return Result(name, device, snapshot, time.time() - started, stats.get('files'), stats.get('bytes'), None)
+    except Exception as e:
+        logging.getLogger('repoman.batch').debug(traceback.format_exc())
+        return Result(name, device, None, time.time() - started, None, None, str(e) or e.__class__.__name__)
+
+
+def _worker_main(conn, path, incremental, lock_paths):
+    """ the worker process: sends the Result of snapshotting <path> through the pipe <conn> """
+
+    conn.send(_snapshot_worker(path, incremental, lock_paths))
+    conn.close()
+
+
+def snapshot_timelines(paths, jobs_per_device=1, incremental=None, lock_paths=None, logger=None):
+    """ creates a new (rotating) snapshot in each of the timelines at <paths>
+
+            at most <jobs_per_device> snapshots run at the same time on each device. <lock_paths>
+            maps timeline paths to the repo locks to hold (shared) while snapshotting it.
+            returns a list of Result tuples, in the order of <paths>
+    """
+
+    logger = logger or logging.getLogger('repoman.batch')
+    jobs_per_device = max(1, jobs_per_device)
+
+    # timeline paths per device, the source and snapshots of a timeline are on the same device
+    pending = {}
+    for path in paths:
+        pending.setdefault(os.stat(path).st_dev, []).append(path)
+
+    slots = sum(min(jobs_per_device, len(p)) for p in pending.values())
+    logger.info('snapshotting [{0}] timelines on [{1}] devices with [{2}] concurrent jobs'.format(
+        len(paths), len(pending), slots))
+
+    # path -> (device, process, pipe, start time) of the running snapshots
+    running = {}
+    results = {}
+
+    def submit(dev):
+        path = pending[dev].pop(0)
+        logger.info('starting snapshot of [{0}]'.format(path))
+        # every timeline gets a fresh process, nothing is shared between snapshots
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        proc = multiprocessing.Process(target=_worker_main,
+                                       args=(sender, path, incremental, (lock_paths or {}).get(path, [])))
+        proc.start()
+        sender.close()
+        running[path] = (dev, proc, receiver, time.time())
+
+    def collect(path):
+        """ returns the Result of a running snapshot, or None if it is still running """
+
+        dev, proc, receiver, started = running[path]
+        if receiver.poll():
+            try:
+                return receiver.recv()
+            except EOFError:
+                pass
+        elif proc.is_alive():
+            return None
+        proc.join()
+        return Result(os.path.basename(path), dev, None, time.time() - started, None, None,
+                      'worker process died (exit code {0})'.format(proc.exitcode))
+
+    try:
+        for dev in pending:
+            while pending[dev] and sum(1 for r in running.values() if r[0] == dev) < jobs_per_device:
+                submit(dev)
+
+        while running:
+            done = [(path, collect(path)) for path in list(running)]
+            done = [(path, result) for path, result in done if result is not None]
+            if not done:
+                time.sleep(0.2)
+                continue
+            for path, result in done:
+                dev, proc, receiver, started = running.pop(path)
+                proc.join()
+                receiver.close()
+                results[path] = result
+                if result.error:
+                    logger.error('snapshot of [{0}] failed: {1}'.format(path, result.error))
+                else:
+                    logger.info('snapshot [{0}] of [{1}] done in {2:.1f}s'.format(
+                        result.snapshot, path, result.elapsed))
+                if pending[dev]:
+                    submit(dev)
+    finally:
+        for dev, proc, receiver, started in running.values():
+            proc.terminate()
+            proc.join()
+
+    return [results[p] for p in paths]
+
+
+def print_results(results, elapsed):
+    print("{0:<20} {1:<8} {2:<20} {3:>9} {4:>10} {5:>14}  {6}".format(
+        'TIMELINE', 'DEVICE', 'SNAPSHOT', 'TIME', 'FILES', 'NEW_BYTES', 'STATUS'))
+    for r in results:
+        print("{0:<20} {1:<8} {2:<20} {3:>8.1f}s {4:>10} {5:>14}  {6}".format(
+            r.name, '{0}:{1}'.format(os.major(r.device), os.minor(r.device)), r.snapshot or '-', r.elapsed,
+            r.files if r.files is not None else '-', r.bytes if r.bytes is not None else '-',
+            'failed: {0}'.format(r.error) if r.error else 'ok'))
+    print("{0} timelines in {1:.1f}s (sum of snapshot times {2:.1f}s)".format(
+        len(results), elapsed, sum(r.elapsed for r in results)))
@@ -0,0 +1,324 @@
+#!/usr/bin/env python2
+from __future__ import print_function
+
+# in-process hard-link tree cloner used for creating timeline snapshots
+
+import os
+import stat
+import time
+import fnmatch
+import logging
+import threading
+
+import fsutil
+import manifest
+
+
+def _match(name, patterns):
+    """ checks the name against a list of glob patterns, like 'find -name' does """
+
+    for pattern in patterns:
+        if fnmatch.fnmatchcase(name, pattern):
+            return True
+    return False
+
+
+class CloneStats(object):
+    """ counters collected while cloning a tree """
+
+    def __init__(self):
+        self.dirs = 0
+        self.files = 0
+        self.reused = 0
+        self.symlinks = 0
+        self.copied = 0
+        self.bytes = 0
+        self.started = time.time()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def files_per_sec(self):
+        if self.elapsed <= 0:
+            return float(self.files)
+        return self.files / self.elapsed
+
+    def add(self, dirs=0, files=0, reused=0, symlinks=0, copied=0, nbytes=0):
+        self.dirs += dirs
+        self.files += files
+        self.reused += reused
+        self.symlinks += symlinks
+        self.copied += copied
+        self.bytes += nbytes
+
+    def __str__(self):
+        return '{0} files ({1} unchanged, {2} copied), {3} directories, {4} symlinks, {5} new bytes in {6:.1f}s ({7:.0f} files/s)'.format(
+            self.files, self.reused, self.copied, self.dirs, self.symlinks, self.bytes, self.elapsed,
+            self.files_per_sec)
+
+
+class TreeCloner(object):
+    """ clones a directory tree by hard-linking every file into a new tree
+
+            directories are walked with scandir, and the work (creating directories, linking files)
+            is spread over a bounded pool of worker threads. large directories are split into chunks
+            so a single directory with hundreds of thousands of files does not end up on one worker.
+
+            the resulting layout is the same as 'cp -al': directories are recreated with their mode
+            and timestamps, files are hard-linked and symbolic links are recreated.
+
+            a snapshot is a tree of its own, so every directory is created and every file linked
+            whether or not a reference tree (the previous snapshot) is given, and an incremental clone
+            costs about as much as a full one. the reference changes two things: copies (see below)
+            which are unchanged since the reference are linked instead of copied again, and the stats
+            only account what is new. a directory whose mtime still matches its counterpart in the
+            reference has an unchanged listing and all its entries count as unchanged; the entries
+            of other directories are compared with the reference by (inode, size, mtime), and only
+            those which differ are accounted as new content. deleted entries are simply not carried
+            over.
+
+            directories matching one of the copy_dirs patterns and files matching one of the
+            copy_files patterns are copied instead of hard-linked, so that later in-place changes in
+            the source do not leak into the snapshot. in an incremental clone, a copy whose size and
+            mtime match the copy in the reference is linked to that (private) copy instead.
+
+            if requested, a manifest entry (path, inode, size, mtime, type) is collected for every
+            object of the new tree while it is built, see the manifest module.
+    """
+
+    def __init__(self, workers=0, chunk_size=512, logger=None):
+        self.workers = workers or fsutil.default_workers()
+        self.chunk_size = chunk_size
+        self.logger = logger or logging.getLogger('timeline.clone')
+
+    def clone(self, source_path, snapshot_path, excludes=(), reference_path=None, copy_dirs=(), copy_files=(),
+              collect_manifest=False):
+        """ clones source_path into the (not yet existing) snapshot_path
+
+                excludes is a list of paths relative to source_path which are skipped
+
+                copy_dirs and copy_files are lists of name patterns of directories and files to be copied
+
+                reference_path is an earlier clone of source_path used for an incremental clone
+
+                if collect_manifest is set, the manifest entries of the new tree are left in self.entries
+
+                returns a CloneStats instance
+        """
+
+        self._source = os.path.normpath(source_path)
+        self._destination = os.path.normpath(snapshot_path)
+        self._reference = reference_path and os.path.normpath(reference_path)
+        self._excludes = set(os.path.normpath(e) for e in excludes)
+        self._copy_dirs = list(copy_dirs)
+        self._copy_files = list(copy_files)
+        self._excluded = set()
+        self._created_dirs = []
+        self.entries = [] if collect_manifest else None
+        self._lock = threading.Lock()
+        self._pool = fsutil.WorkerPool(self.workers, name='clone')
+        self.stats = CloneStats()
+
+        os.makedirs(self._destination)
+
+        self._pool.run(self._clone_dir, '', os.lstat(self._source), False)
+
+        self._finalize_dirs()
+
+        for e in self._excludes - self._excluded:
+            if '/' in e:
+                self.logger.warning(
+                    'trying to exclude unexisting object [{0}]'.format(os.path.join(self._destination, e)))
+
+        self.stats.finished = time.time()
+        return self.stats
+
+    def _count(self, **kwargs):
+        with self._lock:
+            self.stats.add(**kwargs)
+
+    def _reference_entries(self, rel_path, source_st):
+        """ returns the name -> (inode, size, mtime) map of a directory in the reference tree
+
+                returns None if the listing is known to be unchanged (matching directory mtime),
+                and an empty map if the reference has no such directory
+        """
+
+        if not self._reference:
+            return {}
+
+        reference_dir = os.path.join(self._reference, rel_path)
+        try:
+            reference_st = os.lstat(reference_dir)
+        except OSError:
+            return {}
+
+        if not stat.S_ISDIR(reference_st.st_mode):
+            return {}
+
+        # the cloner copies directory timestamps, so an equal mtime means no entry was added,
+        # removed or renamed in the source since the reference was taken. rel_path == '' is the
+        # snapshot root, whose timestamps are not copied
+        if rel_path and abs(reference_st.st_mtime - source_st.st_mtime) < 1e-5:
+            return None
+
+        reference = {}
+        for entry in fsutil.iter_dir(reference_dir):
+            st = entry.stat(follow_symlinks=False)
+            reference[entry.name] = (st.st_ino, st.st_size, st.st_mtime)
+        return reference
+
+    def _clone_dir(self, rel_path, source_st, copy):
+        """ creates the sub-directories of a single directory and queues its contents
+
+                if <copy> is set, the directory lies within a directory which is copied
+        """
+
+        source_dir = os.path.join(self._source, rel_path)
+        if copy:
+            # copies are compared against the reference file by file in _copy_entry()
+            reference = {}
+        else:
+            reference = self._reference_entries(rel_path, source_st)
+        created = []
+        entries = []
+        chunk = []
+
+        for entry in fsutil.iter_dir(source_dir):
+            entry_rel = os.path.join(rel_path, entry.name)
+
+            if entry_rel in self._excludes:
+                self.logger.debug('excluding (skipping) object [{0}]'.format(entry.path))
+                with self._lock:
+                    self._excluded.add(entry_rel)
+                continue
+
+            if entry.is_dir(follow_symlinks=False):
+                target = os.path.join(self._destination, entry_rel)
+                st = entry.stat(follow_symlinks=False)
+                os.mkdir(target)
+                created.append((target, st))
+                if self.entries is not None:
+                    entries.append(manifest.Entry(entry_rel, os.lstat(target).st_ino, 0, st.st_mtime,
+                                                  manifest.DIRECTORY, None))
+                copy_dir = copy or _match(entry.name, self._copy_dirs)
+                if copy_dir and not copy:
+                    self.logger.debug('copying directory [{0}] to [{1}]'.format(entry.path, target))
+                self._pool.put(self._clone_dir, entry_rel, st, copy_dir)
+            else:
+                chunk.append(entry)
+                if len(chunk) >= self.chunk_size:
+                    self._pool.put(self._link_entries, rel_path, chunk, reference, copy)
+                    chunk = []
+
+        with self._lock:
+            self._created_dirs.extend(created)
+            self.stats.add(dirs=len(created))
+            if self.entries is not None:
+                self.entries.extend(entries)
+
+        # the remainder is small enough to be handled right away
+        if chunk:
+            self._link_entries(rel_path, chunk, reference, copy)
+
+    def _link_entries(self, rel_path, entries, reference, copy):
+        """ hard-links (or recreates, for symbolic links) a batch of entries of one directory
+
+                reference is the result of _reference_entries() for the directory
+
+                if <copy> is set, regular files are copied instead of hard-linked
+        """
+
+        target_dir = os.path.join(self._destination, rel_path)
+        files = reused = symlinks = copied = nbytes = 0
+        collect = self.entries is not None
+        collected = []
+
+        for entry in entries:
+            target = os.path.join(target_dir, entry.name)
+            if entry.is_symlink():
+                os.symlink(os.readlink(entry.path), target)
+                symlinks += 1
+                if collect:
+                    st = os.lstat(target)
+                    collected.append(manifest.Entry(os.path.join(rel_path, entry.name), st.st_ino, st.st_size,
+                                                    st.st_mtime, manifest.SYMLINK, None))
+                continue
+
+            if entry.is_file(follow_symlinks=False) and (copy or _match(entry.name, self._copy_files)):
+                files += 1
+                is_reused, inode = self._copy_entry(rel_path, entry, target)
+                if is_reused:
+                    reused += 1
+                else:
+                    copied += 1
+                    nbytes += entry.stat(follow_symlinks=False).st_size
+            else:
+                os.link(entry.path, target)
+                files += 1
+                inode = entry.inode()
+                if reference is None:
+                    reused += 1
+                else:
+                    st = entry.stat(follow_symlinks=False)
+                    # an inode number alone may have been recycled for another file
+                    if reference.get(entry.name) == (inode, st.st_size, st.st_mtime):
+                        reused += 1
+                    else:
+                        nbytes += st.st_size
+
+            if collect:
+                # the lstat is cached by the directory entry, so this costs at most one syscall
+                st = entry.stat(follow_symlinks=False)
+                entry_type = manifest.FILE if stat.S_ISREG(st.st_mode) else manifest.OTHER
+                collected.append(manifest.Entry(os.path.join(rel_path, entry.name), inode, st.st_size,
+                                                st.st_mtime, entry_type, None))
+
+        self._count(files=files, reused=reused, symlinks=symlinks, copied=copied, nbytes=nbytes)
+        if collected:
+            with self._lock:
+                self.entries.extend(collected)
+
+    def _copy_entry(self, rel_path, entry, target):
+        """ copies a single file, or links the equal copy from the reference tree
+
+                returns a tuple (reference copy reused, inode of the new file)
+        """
+
+        st = entry.stat(follow_symlinks=False)
+
+        if self._reference:
+            reference_file = os.path.join(self._reference, rel_path, entry.name)
+            try:
+                reference_st = os.lstat(reference_file)
+            except OSError:
+                reference_st = None
+
+            # the reference must hold a copy of its own, never a link to the (mutable) source file
+            if (reference_st is not None and stat.S_ISREG(reference_st.st_mode)
+                    and reference_st.st_ino != st.st_ino
+                    and reference_st.st_size == st.st_size
+                    and abs(reference_st.st_mtime - st.st_mtime) < 1e-5):
+                os.link(reference_file, target)
+                return True, reference_st.st_ino
+
+        fsutil.copy_file(entry.path, target, st)
+        return False, os.lstat(target).st_ino
+
+    def _finalize_dirs(self):
+        """ copies mode, ownership and timestamps to the created directories
+
+                done deepest first once everything is linked, since adding entries changes the mtime
+                of a directory and a read-only mode would prevent adding them at all
+        """
+
+        is_root = os.geteuid() == 0
+        self._created_dirs.sort(key=lambda d: d[0].count(os.sep), reverse=True)
+        for path, st in self._created_dirs:
+            if is_root:
+                os.lchown(path, st.st_uid, st.st_gid)
+            os.chmod(path, stat.S_IMODE(st.st_mode))
+            os.utime(path, (st.st_atime, st.st_mtime))
@@ -0,0 +1,241 @@
+#!/usr/bin/env python2
+from __future__ import print_function
+
+# content-addressed deduplication of the mirrored repositories
+#
+# overlapping repositories (variants, EUS streams, ...) download the same packages into separate
+# files. identical packages are found by size first and checksum second, and are then collapsed onto
+# a single inode with hard links. only packages are deduplicated: metadata and the like are small,
+# rewritten by every sync and would be published with the mtime of another repo's copy.
+
+import os
+import stat
+import time
+import errno
+import logging
+import threading
+
+import fsutil
+import hashcache
+import mkrepodata
+
+# directories which are never looked into (createrepo caches, metadata and its staging directories)
+SKIP_DIRS = mkrepodata.SKIP_DIRS
+
+# the files which are deduplicated
+SUFFIXES = ('.rpm', '.drpm')
+
+
+class DedupStats(object):
+    """ counters collected during a deduplication run """
+
+    def __init__(self):
+        self.files = 0
+        self.candidates = 0
+        self.hashed = 0
+        self.cached = 0
+        self.linked = 0
+        self.inodes = 0
+        self.freed = 0
+        self.pending = 0
+        self.skipped = 0
+        self.started = time.time()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    def __str__(self):
+        return ('{0} files scanned, {1} candidates ({2} hashed, {3} cached), {4} paths linked onto existing '
+                'copies, {5} duplicate inodes: {6} bytes freed, {7} bytes still held by snapshots, '
+                '{8} skipped in {9:.1f}s').format(
+            self.files, self.candidates, self.hashed, self.cached, self.linked, self.inodes, self.freed,
+            self.pending, self.skipped, self.elapsed)
+
+
+def _nested(path, others):
+    for other in others:
+        if path != other and path.startswith(other.rstrip(os.sep) + os.sep):
+            return True
+    return False
+
+
+class Deduplicator(object):
+    """ collapses identical packages below a set of directories onto one inode each
+
+            files are only merged when they are on the same device and have the same size, mode and
+            ownership, so replacing one with a hard link to the other changes nothing but the inode
+            (and the mtime, which is taken from the copy that is kept). of a set of identical files,
+            the inode with the most links is kept, which is usually the one snapshots already link to.
+
+            every path is replaced atomically (link to a temporary name, then rename over it), and
+            is checked to still be the inode that was hashed right before, so a sync running at the
+            same time at worst makes a file be skipped.
+
+            checksums are taken from (and added to) the given HashCache, so a rerun only reads new
+            or changed files.
+    """
+
+    _tmp_suffix = '.repoman-dedup'
+
+    def __init__(self, paths, cache, workers=0, min_size=1, dry_run=False, logger=None):
+        paths = sorted(set(os.path.realpath(p) for p in paths if os.path.isdir(p)))
+        self.paths = [p for p in paths if not _nested(p, paths)]
+        self.cache = cache
+        self.workers = workers or fsutil.default_workers()
+        self.min_size = min_size
+        self.dry_run = dry_run
+        self.logger = logger or logging.getLogger('repoman.dedup')
+
+    def run(self):
+        """ deduplicates all files below the configured paths, returns a DedupStats instance """
+
+        self.stats = DedupStats()
+        self._lock = threading.Lock()
+        # (dev, size, mode, uid, gid) -> {inode: [stat, path, path, ...]}
+        self._files = {}
+
+        self._pool = fsutil.WorkerPool(self.workers, name='dedup')
+        for path in self.paths:
+            self.logger.info('scanning [{0}]'.format(path))
+            self._pool.run(self._scan_dir, path)
+
+        # only sizes with more than one inode can have duplicates
+        candidates = []
+        for key, inodes in self._files.items():
+            if len(inodes) > 1:
+                candidates.extend(inodes.values())
+        self._files = None
+        self.stats.candidates = len(candidates)
+
+        self._groups = {}
+        hits, misses = self.cache.hits, self.cache.misses
+        self._pool.run(self._queue_hashes, candidates)
+        self.cache.commit()
+        self.stats.cached = self.cache.hits - hits
+        self.stats.hashed = self.cache.misses - misses
+
+        for files in self._groups.values():
+            if len(files) > 1:
+                self._merge(files)
+
+        self.stats.finished = time.time()
+        return self.stats
+
+    def _scan_dir(self, path):
+        found = []
+        for entry in fsutil.iter_dir(path):
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in SKIP_DIRS:
+                    self._pool.put(self._scan_dir, entry.path)
+                continue
+            if not entry.is_file(follow_symlinks=False) or not entry.name.endswith(SUFFIXES):
+                continue
+            st = entry.stat(follow_symlinks=False)
+            if st.st_size >= self.min_size:
+                found.append((entry.path, st))
+
+        with self._lock:
+            self.stats.files += len(found)
+            for p, st in found:
+                inodes = self._files.setdefault(
+                    (st.st_dev, st.st_size, stat.S_IMODE(st.st_mode), st.st_uid, st.st_gid), {})
+                inodes.setdefault(st.st_ino, [st]).append(p)
+
+    def _queue_hashes(self, candidates):
+        for i in range(0, len(candidates), 64):
+            self._pool.put(self._hash, candidates[i:i + 64])
+
+    def _hash(self, candidates):
+        for files in candidates:
+            st, path = files[0], files[1]
+            try:
+                digest = self.cache.digest(path, st)
+            except (IOError, OSError) as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                with self._lock:
+                    self.stats.skipped += 1
+                continue
+            with self._lock:
+                self._groups.setdefault((st.st_dev, st.st_size, stat.S_IMODE(st.st_mode), st.st_uid, st.st_gid,
+                                         digest), []).append(files)
+
+    def _unchanged(self, path, st):
+        try:
+            current = os.lstat(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+        return (current.st_ino == st.st_ino and current.st_size == st.st_size
+                and current.st_mtime == st.st_mtime)
+
+    def _merge(self, files):
+        # keep the inode with the most links, the others become links to it
+        files.sort(key=lambda f: (-f[0].st_nlink, f[0].st_ino))
+        keep_st, keep_path = files[0][0], files[0][1]
+        if not self._unchanged(keep_path, keep_st):
+            self.logger.warning('[{0}] changed during deduplication, skipping'.format(keep_path))
+            self.stats.skipped += sum(len(f) - 1 for f in files[1:])
+            return
+
+        for f in files[1:]:
+            st, paths = f[0], f[1:]
+            linked = 0
+            for p in paths:
+                if not self._unchanged(p, st):
+                    self.logger.warning('[{0}] changed during deduplication, skipping'.format(p))
+                    self.stats.skipped += 1
+                    continue
+                if self.dry_run:
+                    self.logger.info('would link [{0}] to [{1}]'.format(p, keep_path))
+                    linked += 1
+                    continue
+                try:
+                    self._replace(keep_path, p)
+                except OSError as e:
+                    if e.errno != errno.EMLINK:
+                        raise
+                    # the kept inode is out of links, keep this one for the remaining files
+                    self.logger.info('[{0}] reached the link limit, keeping [{1}]'.format(keep_path, p))
+                    keep_st, keep_path = st, p
+                    continue
+                self.logger.debug('linked [{0}] to [{1}]'.format(p, keep_path))
+                linked += 1
+
+            if linked:
+                self.stats.linked += linked
+                self.stats.inodes += 1
+                # the data is only released once no snapshot links to the old inode either
+                if linked == st.st_nlink:
+                    self.stats.freed += st.st_size
+                else:
+                    self.stats.pending += st.st_size
+
+    def _replace(self, source, target):
+        tmp = target + self._tmp_suffix
+        try:
+            os.unlink(tmp)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        os.link(source, tmp)
+        try:
+            os.rename(tmp, target)
+        except OSError:
+            os.unlink(tmp)
+            raise
+
+
+def dedup_repos(config, repos, workers=0, min_size=1, dry_run=False, logger=None):
+    """ deduplicates the files of the given repositories, using the configured hash cache """
+
+    cache = hashcache.HashCache(config.get('repoman', 'hash_cache'))
+    try:
+        d = Deduplicator([repo['path'] for repo in repos], cache, workers=workers, min_size=min_size,
+                         dry_run=dry_run, logger=logger)
+        return d.run()
+    finally:
+        cache.close()
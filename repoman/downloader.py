@@ -0,0 +1,502 @@
+#!/usr/bin/env python2
+from __future__ import print_function
+
+# built-in sync backend for yum repositories served over http(s)
+#
+# the upstream repomd.xml and primary package list are fetched and compared with the packages on
+# disk; only missing or changed packages are downloaded, by a few threads sharing a pool of
+# keep-alive connections. packages no longer listed upstream are deleted from the same comparison.
+
+import os
+import re
+import glob
+import time
+import ssl
+import errno
+import shutil
+import socket
+import hashlib
+import httplib
+import fnmatch
+import logging
+import urlparse
+import threading
+import contextlib
+from collections import namedtuple
+
+import repodata
+import scheduler
+
+# http status codes followed to another location
+REDIRECTS = (301, 302, 303, 307, 308)
+
+# partial downloads which were not resumed for this long are removed
+PARTIAL_MAX_AGE = 7 * 24 * 3600
+
+SyncStats = namedtuple('SyncStats', ['packages', 'downloaded', 'bytes', 'deleted', 'failed'])
+
+
+class DownloadError(Exception):
+    pass
+
+
+class RangeNotSupported(DownloadError):
+    """ the server answered a range request with the whole file """
+    pass
+
+
+class UpstreamChanged(DownloadError):
+    """ the file changed upstream while it was downloaded, the partial download is useless """
+    pass
+
+
+class ConnectionPool(object):
+    """ idle keep-alive connections per (scheme, host, port), shared by the download threads
+
+            a connection is handed to one thread at a time and goes back to the pool after its
+            response was read completely; connections which failed are closed instead
+    """
+
+    def __init__(self, ssl_context=None, timeout=60):
+        self.ssl_context = ssl_context
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    def _open(self, scheme, host, port):
+        self.opened += 1
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host, port, timeout=self.timeout, context=self.ssl_context)
+        return httplib.HTTPConnection(host, port, timeout=self.timeout)
+
+    @contextlib.contextmanager
+    def connection(self, scheme, host, port):
+        key = (scheme, host, port)
+        with self._lock:
+            idle = self._idle.get(key)
+            conn = idle.pop() if idle else None
+        if conn is None:
+            conn = self._open(scheme, host, port)
+        try:
+            yield conn
+        except BaseException:
+            conn.close()
+            raise
+        with self._lock:
+            self._idle.setdefault(key, []).append(conn)
+
+    def close(self):
+        with self._lock:
+            for conns in self._idle.values():
+                for conn in conns:
+                    conn.close()
+            self._idle = {}
+
+
+def _validator(response):
+    """ returns what identifies the version of a file in an http response (for If-Range), or None """
+
+    etag = response.getheader('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.getheader('last-modified')
+
+
+def prune_partials(directory, max_age):
+    """ removes partial downloads in <directory> which were not resumed for <max_age> seconds """
+
+    if not os.path.isdir(directory):
+        return
+    limit = time.time() - max_age
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) < limit:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+class Downloader(object):
+    """ downloads files over http(s) with keep-alive connections and client certificates
+
+            interrupted downloads are resumed with range requests. with <partial_dir>, partial
+            downloads are kept there when all retries failed, and resumed by a later fetch of the
+            same url to the same destination. files larger than <chunk_size> (0: never) are
+            downloaded as ranges of that size by <chunk_workers> threads.
+    """
+
+    def __init__(self, sslcacert=None, sslcert=None, sslkey=None, timeout=60, retries=3, logger=None,
+                 partial_dir=None, chunk_size=0, chunk_workers=4):
+        context = None
+        if sslcacert or sslcert:
+            context = ssl.create_default_context(cafile=sslcacert)
+            if sslcert:
+                context.load_cert_chain(sslcert, sslkey)
+        self.pool = ConnectionPool(context, timeout)
+        self.retries = max(1, retries)
+        self.logger = logger or logging.getLogger('repoman.downloader')
+        self.partial_dir = partial_dir
+        self.chunk_size = chunk_size
+        self.chunk_workers = max(1, chunk_workers)
+
+    def close(self):
+        self.pool.close()
+
+    def _request(self, url, fh, offset=0, end=None, validator=None, require_range=False, started=None):
+        """ gets <url> into the file object <fh> on a pooled connection
+
+                with <offset> (and <end>, inclusive) only that range is requested, and appended to
+                <fh>. <validator> makes the range conditional on the file being the same version
+                (If-Range). a server which answers with the whole file has it written from the start
+                of <fh>, or raises RangeNotSupported (UpstreamChanged if the version differs) with
+                <require_range>. started(validator) is called before the body is read.
+
+                returns the bytes written
+        """
+
+        ranged = offset > 0 or end is not None
+        headers = {}
+        if ranged:
+            headers['Range'] = 'bytes={0}-{1}'.format(offset, '' if end is None else end)
+            if validator:
+                headers['If-Range'] = validator
+
+        for _ in range(len(REDIRECTS) + 1):
+            parts = urlparse.urlsplit(url)
+            if parts.scheme not in ('http', 'https'):
+                raise DownloadError('unsupported url [{0}]'.format(url))
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+
+            with self.pool.connection(parts.scheme, parts.hostname, parts.port) as conn:
+                try:
+                    conn.request('GET', path, headers=headers)
+                    response = conn.getresponse()
+                except (httplib.BadStatusLine, httplib.CannotSendRequest, socket.error):
+                    # the server closed an idle keep-alive connection, retry once on a new one
+                    conn.close()
+                    conn.request('GET', path, headers=headers)
+                    response = conn.getresponse()
+
+                if response.status in REDIRECTS:
+                    response.read()
+                    url = urlparse.urljoin(url, response.getheader('location'))
+                    continue
+                if response.status == 416 and ranged and end is None:
+                    # nothing left after <offset>, the partial download is complete
+                    response.read()
+                    return 0
+                if response.status == 206 and ranged:
+                    served = re.match(r'bytes (\d+)-', response.getheader('content-range') or '')
+                    if not served or int(served.group(1)) != offset:
+                        raise DownloadError('unexpected content range [{0}]'.format(url))
+                elif response.status == 200:
+                    if ranged and require_range:
+                        if validator and _validator(response) != validator:
+                            raise UpstreamChanged('changed upstream [{0}]'.format(url))
+                        raise RangeNotSupported('ranges not supported [{0}]'.format(url))
+                    if ranged:
+                        self.logger.debug('restarting download of [{0}]'.format(url))
+                        fh.truncate(0)
+                else:
+                    response.read()
+                    raise DownloadError('{0} {1} [{2}]'.format(response.status, response.reason, url))
+
+                if started is not None:
+                    started(_validator(response))
+                written = 0
+                while True:
+                    data = response.read(1024 * 1024)
+                    if not data:
+                        break
+                    fh.write(data)
+                    written += len(data)
+                # a dropped connection ends the body early without an error
+                length = response.getheader('content-length')
+                if length is not None and written != int(length):
+                    raise DownloadError('connection closed after {0} of {1} bytes [{2}]'.format(written, length, url))
+                return written
+        raise DownloadError('too many redirects [{0}]'.format(url))
+
+    def _partial_path(self, url, dest):
+        if not self.partial_dir:
+            return dest + '.repoman-part'
+        key = hashlib.sha1('{0}\n{1}'.format(url, os.path.abspath(dest))).hexdigest()
+        return os.path.join(self.partial_dir, key + '.part')
+
+    def _read_validator(self, tmp):
+        try:
+            with open(tmp + '.validator', 'r') as fh:
+                return fh.read().strip() or None
+        except IOError:
+            return None
+
+    def _save_validator(self, tmp, validator):
+        with open(tmp + '.validator', 'w') as fh:
+            fh.write(validator or '')
+
+    def _discard(self, tmp):
+        """ removes a partial download with its validator and chunks """
+
+        pattern = re.sub(r'([*?[])', r'[\1]', tmp) + '.*'
+        for path in [tmp] + glob.glob(pattern):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _fetch_resumed(self, url, tmp):
+        """ downloads <url> into <tmp>, resuming a partial download of the same version """
+
+        validator = self._read_validator(tmp)
+        # without a validator, the partial download may be of another version
+        offset = os.path.getsize(tmp) if validator and os.path.exists(tmp) else 0
+        if offset:
+            self.logger.debug('resuming download of [{0}] at {1} bytes'.format(url, offset))
+        with open(tmp, 'ab' if offset else 'wb') as fh:
+            return self._request(url, fh, offset, validator=validator,
+                                 started=lambda v: self._save_validator(tmp, v))
+
+    def _fetch_chunked(self, url, tmp, size):
+        """ downloads the <size> bytes of <url> into <tmp> as ranges of chunk_size, in parallel
+
+                the ranges are kept as <tmp>.<n> until all are complete, so they are resumed one by
+                one. raises RangeNotSupported if the server doesn't serve ranges
+        """
+
+        chunks = [(start, min(start + self.chunk_size, size) - 1) for start in xrange(0, size, self.chunk_size)]
+        validator = [self._read_validator(tmp)]
+        changed = []
+
+        def fetch_chunk(n):
+            start, end = chunks[n]
+            path = '{0}.{1}'.format(tmp, n)
+            done = os.path.getsize(path) if validator[0] and os.path.exists(path) else 0
+            if done == end - start + 1:
+                return 0
+            if done > end - start + 1:
+                done = 0
+            with open(path, 'ab' if done else 'wb') as fh:
+                try:
+                    written = self._request(url, fh, start + done, end, validator[0], require_range=True,
+                                            started=lambda v: self._save_validator(tmp, v))
+                except UpstreamChanged:
+                    changed.append(n)
+                    raise
+            if os.path.getsize(path) != end - start + 1:
+                raise DownloadError('incomplete range {0}-{1} [{2}]'.format(start, end, url))
+            return written
+
+        # the first range tells whether ranges are served, and which version of the file is fetched
+        written = fetch_chunk(0)
+        validator[0] = self._read_validator(tmp)
+        results = scheduler.run_jobs(range(1, len(chunks)), fetch_chunk, workers=self.chunk_workers)
+        if changed:
+            raise UpstreamChanged('changed upstream [{0}]'.format(url))
+        failed = [r for r in results if isinstance(r, scheduler.JobFailed)]
+        if failed:
+            raise DownloadError(str(failed[0]))
+        written += sum(results)
+
+        with open(tmp, 'wb') as out:
+            for n in range(len(chunks)):
+                path = '{0}.{1}'.format(tmp, n)
+                with open(path, 'rb') as fh:
+                    shutil.copyfileobj(fh, out, 1024 * 1024)
+        for n in range(len(chunks)):
+            os.remove('{0}.{1}'.format(tmp, n))
+        return written
+
+    def fetch(self, url, dest, checksum_type=None, checksum=None, size=None):
+        """ downloads <url> into <dest>, verifying its size and checksum if given
+
+                the file is written to a partial download and renamed when complete, so <dest> is
+                never partial. returns the bytes downloaded
+        """
+
+        for directory in (os.path.dirname(dest), self.partial_dir):
+            if directory and not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+
+        tmp = self._partial_path(url, dest)
+        written = 0
+        error = None
+        for attempt in range(self.retries):
+            try:
+                if self.chunk_size and size is not None and size > self.chunk_size:
+                    try:
+                        written += self._fetch_chunked(url, tmp, size)
+                    except RangeNotSupported:
+                        self.logger.debug('[{0}] is not served in ranges, downloading it whole'.format(url))
+                        self._discard(tmp)
+                        written += self._fetch_resumed(url, tmp)
+                else:
+                    written += self._fetch_resumed(url, tmp)
+
+                length = os.path.getsize(tmp)
+                if size is not None and length != size:
+                    raise UpstreamChanged('size mismatch, expected {0} bytes, got {1} [{2}]'.format(size, length, url))
+                if checksum:
+                    algorithm = repodata.CHECKSUM_TYPES.get(checksum_type, checksum_type)
+                    h = hashlib.new(algorithm)
+                    with open(tmp, 'rb') as fh:
+                        for data in iter(lambda: fh.read(1024 * 1024), b''):
+                            h.update(data)
+                    if h.hexdigest() != checksum:
+                        raise UpstreamChanged('checksum mismatch [{0}]'.format(url))
+                os.rename(tmp, dest)
+                self._discard(tmp)
+                return written
+            except UpstreamChanged as e:
+                # the partial download can't be completed, start over
+                error = e
+                self._discard(tmp)
+                self.logger.debug('download of [{0}] failed (attempt {1}): {2}'.format(url, attempt + 1, e))
+            except (DownloadError, httplib.HTTPException, socket.error, IOError) as e:
+                error = e
+                self.logger.debug('download of [{0}] failed (attempt {1}): {2}'.format(url, attempt + 1, e))
+        if not self.partial_dir:
+            self._discard(tmp)
+        raise error
+
+
+def _vercmp(a, b):
+    """ compares two version or release strings like rpm does """
+
+    segments = re.compile(r'(\d+|[a-zA-Z]+|~)')
+    sa = segments.findall(a or '')
+    sb = segments.findall(b or '')
+    while sa or sb:
+        if sa and sa[0] == '~' or sb and sb[0] == '~':
+            if not (sa and sa[0] == '~'):
+                return 1
+            if not (sb and sb[0] == '~'):
+                return -1
+        elif not sa or not sb:
+            return 1 if sa else -1
+        else:
+            x, y = sa[0], sb[0]
+            if x.isdigit() != y.isdigit():
+                return 1 if x.isdigit() else -1
+            if x.isdigit():
+                x, y = int(x), int(y)
+            if x != y:
+                return 1 if x > y else -1
+        sa, sb = sa[1:], sb[1:]
+    return 0
+
+
+def _evrcmp(a, b):
+    """ compares the epoch, version and release of two packages """
+
+    return (cmp(int(a.epoch or 0), int(b.epoch or 0)) or _vercmp(a.version, b.version)
+            or _vercmp(a.release, b.release))
+
+
+def newest_packages(packages):
+    """ returns the newest version of each package name and architecture """
+
+    newest = {}
+    for p in packages:
+        key = (p.name, p.arch)
+        if key not in newest or _evrcmp(p, newest[key]) > 0:
+            newest[key] = p
+    return newest.values()
+
+
+def sync_repo(url, path, work_dir, sslcacert=None, sslcert=None, sslkey=None, workers=4, delete=True,
+              newest_only=False, exclude=(), includepkgs=(), partial_dir=None, chunk_size=0, chunk_workers=4,
+              log=None):
+    """ syncs the packages of the yum repository at <url> into <path>
+
+            the upstream metadata is downloaded into <work_dir>. packages are selected by the
+            <includepkgs> and <exclude> name globs and, with <newest_only>, only the newest version
+            of each package is kept. a group file (comps) is stored as comps.xml, as reposync
+            --downloadcomps does. with <delete>, packages which are not selected are removed.
+
+            downloads which fail are kept in <partial_dir> and resumed by the next sync, packages
+            larger than <chunk_size> are downloaded in ranges (see Downloader).
+
+            progress is written to the file object <log>. returns SyncStats
+    """
+
+    def note(message):
+        if log is not None:
+            log.write(message + '\n')
+            log.flush()
+
+    url = url.rstrip('/') + '/'
+    if os.path.isdir(work_dir):
+        shutil.rmtree(work_dir)
+    os.makedirs(work_dir)
+
+    if partial_dir:
+        prune_partials(partial_dir, PARTIAL_MAX_AGE)
+    downloader = Downloader(sslcacert, sslcert, sslkey, partial_dir=partial_dir, chunk_size=chunk_size,
+                            chunk_workers=chunk_workers)
+    try:
+        downloader.fetch(urlparse.urljoin(url, repodata.REPOMD), os.path.join(work_dir, repodata.REPOMD))
+        metadata = repodata.read_repomd(work_dir)
+        if 'primary' not in metadata:
+            raise DownloadError('no primary metadata in [{0}]'.format(urlparse.urljoin(url, repodata.REPOMD)))
+        for kind in ('primary', 'group'):
+            if kind in metadata:
+                href = os.path.relpath(metadata[kind], work_dir)
+                downloader.fetch(urlparse.urljoin(url, href), metadata[kind])
+        if 'group' in metadata:
+            shutil.copyfile(metadata['group'], os.path.join(path, 'comps.xml'))
+
+        packages = [p for p in repodata.iter_packages(work_dir)
+                    if (not includepkgs or any(fnmatch.fnmatch(p.name, g) for g in includepkgs))
+                    and not any(fnmatch.fnmatch(p.name, g) for g in exclude)]
+        if newest_only:
+            packages = newest_packages(packages)
+        wanted = set(os.path.normpath(p.location) for p in packages)
+
+        missing = []
+        for p in packages:
+            try:
+                st = os.stat(os.path.join(path, p.location))
+            except OSError:
+                missing.append(p)
+                continue
+            if p.size is not None and st.st_size != p.size:
+                missing.append(p)
+        note('{0} packages upstream, {1} to download'.format(len(packages), len(missing)))
+
+        def download(p):
+            n = downloader.fetch(urlparse.urljoin(url, p.location), os.path.join(path, p.location),
+                                 p.checksum_type, p.checksum, p.size)
+            note('downloaded {0}'.format(p.location))
+            return n
+
+        results = scheduler.run_jobs(missing, download, workers=workers)
+        failed = 0
+        for p, result in zip(missing, results):
+            if isinstance(result, scheduler.JobFailed):
+                note('failed {0}: {1}'.format(p.location, result))
+                failed += 1
+        downloaded = sum(r for r in results if not isinstance(r, scheduler.JobFailed))
+
+        deleted = 0
+        if delete:
+            for root, dirs, files in os.walk(path):
+                dirs[:] = [d for d in dirs if d not in ('repodata', '.cache')]
+                for f in files:
+                    if not f.endswith('.rpm'):
+                        continue
+                    rel = os.path.relpath(os.path.join(root, f), path)
+                    if rel not in wanted:
+                        os.remove(os.path.join(root, f))
+                        note('deleted {0}'.format(rel))
+                        deleted += 1
+
+        note('{0} connections opened'.format(downloader.pool.opened))
+        return SyncStats(len(packages), len(missing) - failed, downloaded, deleted, failed)
+    finally:
+        downloader.close()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python2
+from __future__ import print_function
+
+# small file system helpers shared by the timeline and sync code
+
+import os
+import stat
+import errno
+import fcntl
+import ctypes
+import Queue
+import shutil
+import threading
+import multiprocessing
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+# ioctl request for cloning a whole file (linux/fs.h)
+FICLONE = 0x40049409
+
+# errors which mean that a copy method is not supported for the given pair of files
+_UNSUPPORTED = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EBADF)
+
+_libc = ctypes.CDLL(None, use_errno=True)
+_copy_file_range = getattr(_libc, 'copy_file_range', None)
+if _copy_file_range is not None:
+    _copy_file_range.restype = ctypes.c_ssize_t
+    _copy_file_range.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p,
+                                 ctypes.c_size_t, ctypes.c_uint]
+
+# copy methods found not to work per device, so they are not retried for every file
+_unsupported_lock = threading.Lock()
+_unsupported = set()
+
+
+def default_workers():
+    """ default size of worker pools doing metadata operations (linking, unlinking, ...)
+
+            these are syscall-bound rather than cpu-bound, so use a few threads per core
+    """
+
+    try:
+        cpus = multiprocessing.cpu_count()
+    except NotImplementedError:
+        cpus = 1
+    return min(32, max(4, cpus * 2))
+
+
+class WorkerPool(object):
+    """ runs tasks on a fixed number of threads, where a task may queue further tasks
+
+            the first exception raised by a task stops processing and is re-raised by run()
+    """
+
+    def __init__(self, workers=0, name='worker'):
+        self.workers = workers or default_workers()
+        self.name = name
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._error = None
+
+    def put(self, func, *args):
+        """ queues a task """
+
+        self._queue.put((func, args))
+
+    def run(self, func, *args):
+        """ runs the given task and everything it queues, and waits until all of it is done """
+
+        self._error = None
+        threads = []
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name='{0}-{1}'.format(self.name, i))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        self.put(func, *args)
+        self._queue.join()
+
+        for t in threads:
+            self._queue.put(None)
+        for t in threads:
+            t.join()
+
+        if self._error is not None:
+            raise self._error
+
+    def _worker(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                if self._error is None:
+                    func, args = task
+                    func(*args)
+            except Exception as e:
+                with self._lock:
+                    if self._error is None:
+                        self._error = e
+            finally:
+                self._queue.task_done()
+
+
+class _DirEntry(object):
+    """ minimal stand-in for os.DirEntry, used when no scandir implementation is available """
+
+    __slots__ = ('name', 'path', '_lstat')
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self._lstat = None
+
+    def stat(self, follow_symlinks=True):
+        if follow_symlinks:
+            return os.stat(self.path)
+        if self._lstat is None:
+            self._lstat = os.lstat(self.path)
+        return self._lstat
+
+    def inode(self):
+        return self.stat(follow_symlinks=False).st_ino
+
+    def is_dir(self, follow_symlinks=True):
+        try:
+            return stat.S_ISDIR(self.stat(follow_symlinks).st_mode)
+        except OSError:
+            return False
+
+    def is_file(self, follow_symlinks=True):
+        try:
+            return stat.S_ISREG(self.stat(follow_symlinks).st_mode)
+        except OSError:
+            return False
+
+    def is_symlink(self):
+        return stat.S_ISLNK(self.stat(follow_symlinks=False).st_mode)
+
+
+def iter_dir(path):
+    """ yields the entries of the given directory, like os.scandir() does """
+
+    if scandir is not None:
+        for entry in scandir(path):
+            yield entry
+    else:
+        for name in os.listdir(path):
+            yield _DirEntry(path, name)
+
+
+def _supported(method, dev):
+    return (method, dev) not in _unsupported
+
+
+def _mark_unsupported(method, dev):
+    with _unsupported_lock:
+        _unsupported.add((method, dev))
+
+
+def _reflink(src_fd, dst_fd):
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
+def _copy_range(src_fd, dst_fd, size):
+    remaining = size
+    while remaining > 0:
+        n = _copy_file_range(src_fd, None, dst_fd, None, min(remaining, 1 << 30), 0)
+        if n < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        if n == 0:
+            break
+        remaining -= n
+
+
+def copy_file(src, dst, st=None):
+    """ copies a regular file including its mode, ownership (when running as root) and timestamps
+
+            the data is shared with a FICLONE reflink where the file system supports it, copied
+            in the kernel with copy_file_range otherwise, and with a buffered copy as a last resort
+
+            returns the method used: 'reflink', 'copy_file_range' or 'buffered'
+    """
+
+    if st is None:
+        st = os.lstat(src)
+
+    method = 'buffered'
+    with open(src, 'rb') as fsrc:
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, stat.S_IMODE(st.st_mode) | stat.S_IWUSR)
+        with os.fdopen(fd, 'wb') as fdst:
+            for name, func, args in (('reflink', _reflink, ()),
+                                     ('copy_file_range', _copy_range, (st.st_size,))):
+                if (name == 'copy_file_range' and _copy_file_range is None) or not _supported(name, st.st_dev):
+                    continue
+                try:
+                    func(fsrc.fileno(), fdst.fileno(), *args)
+                    method = name
+                    break
+                except (IOError, OSError) as e:
+                    if e.errno not in _UNSUPPORTED:
+                        raise
+                    _mark_unsupported(name, st.st_dev)
+                    # a failed attempt may have left partial data behind
+                    fsrc.seek(0)
+                    fdst.seek(0)
+                    fdst.truncate()
+            else:
+                shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+
+    if os.geteuid() == 0:
+        os.lchown(dst, st.st_uid, st.st_gid)
+    os.chmod(dst, stat.S_IMODE(st.st_mode))
+    os.utime(dst, (st.st_atime, st.st_mtime))
+
+    return method
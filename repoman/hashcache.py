@@ -0,0 +1,156 @@
+#!/usr/bin/env python2
+from __future__ import print_function
+
+# persistent cache of file checksums
+#
+# checksums are keyed by (device, inode) and only valid as long as mtime and size of the file are
+# unchanged, so files which were not touched since they were last hashed are never read again.
+#
+# several processes (syncs of different repos, dedup, snapshot-verify) use the cache at the same
+# time. new checksums are collected in memory and written in one short transaction about once a
+# second, so no write lock is held while files are hashed, and a writer waits for another one
+# instead of failing.
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+# seconds a writer waits for the database to be unlocked by another process
+BUSY_TIMEOUT = 300
+
+# seconds new checksums are kept in memory before they are written
+COMMIT_INTERVAL = 1.0
+
+
+def hash_file(path, algorithm='sha256', bufsize=1024 * 1024):
+    """ returns the hex digest of the given file """
+
+    h = hashlib.new(algorithm)
+    with open(path, 'rb') as fh:
+        while True:
+            data = fh.read(bufsize)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+
+class HashCache(object):
+    """ sqlite backed checksum cache, safe to share between threads
+
+            stored checksums are written in batches, call commit() (or close()) when done
+    """
+
+    def __init__(self, path, algorithm='sha256'):
+        self.path = path
+        self.algorithm = algorithm
+        self.hits = 0
+        self.misses = 0
+        # (dev, ino, algorithm) -> (mtime, size, digest) of the checksums not written yet
+        self._pending = {}
+        self._written = time.time()
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        # readers and the writer don't block each other
+        self._db.execute('PRAGMA journal_mode = WAL')
+        self._db.execute('PRAGMA synchronous = NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS hashes (dev INTEGER NOT NULL, ino INTEGER NOT NULL, '
+                         'algorithm TEXT NOT NULL, mtime REAL NOT NULL, size INTEGER NOT NULL, '
+                         'digest TEXT NOT NULL, PRIMARY KEY (dev, ino, algorithm))')
+        self._db.commit()
+
+    def close(self):
+        self.commit()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def commit(self):
+        with self._lock:
+            self._write()
+
+    def _write(self):
+        """ writes the pending checksums, the caller holds the lock """
+
+        if self._pending:
+            self._db.executemany('INSERT OR REPLACE INTO hashes (dev, ino, algorithm, mtime, size, digest) '
+                                 'VALUES (?, ?, ?, ?, ?, ?)',
+                                 [key + value for key, value in self._pending.items()])
+            self._pending = {}
+        self._db.commit()
+        self._written = time.time()
+
+    def lookup(self, st, algorithm=None):
+        """ returns the cached digest of the file with the given stat result, or None """
+
+        with self._lock:
+            row = self._pending.get((st.st_dev, st.st_ino, algorithm or self.algorithm))
+            if row is None:
+                row = self._db.execute('SELECT mtime, size, digest FROM hashes WHERE dev = ? AND ino = ? AND algorithm = ?',
+                                       (st.st_dev, st.st_ino, algorithm or self.algorithm)).fetchone()
+        if row is None or row[0] != st.st_mtime or row[1] != st.st_size:
+            return None
+        return str(row[2])
+
+    def store(self, st, digest, algorithm=None):
+        """ remembers the digest of the file with the given stat result """
+
+        with self._lock:
+            self._pending[(st.st_dev, st.st_ino, algorithm or self.algorithm)] = (st.st_mtime, st.st_size, digest)
+            if time.time() - self._written >= COMMIT_INTERVAL:
+                self._write()
+
+    def digest(self, path, st=None, algorithm=None):
+        """ returns the digest of the given file, from the cache if it is still valid """
+
+        if st is None:
+            st = os.stat(path)
+        digest = self.lookup(st, algorithm)
+        with self._lock:
+            if digest is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if digest is not None:
+            return digest
+
+        digest = hash_file(path, algorithm or self.algorithm)
+        self.store(st, digest, algorithm)
+        return digest
+
+    def prune(self, roots):
+        """ removes the entries of files which no longer exist below any of the directories <roots>
+
+                returns the number of files whose entries were removed
+        """
+
+        with self._lock:
+            self._write()
+            dead = set(self._db.execute('SELECT DISTINCT dev, ino FROM hashes').fetchall())
+
+        for root in roots:
+            for dirpath, dirs, files in os.walk(root):
+                for f in files:
+                    try:
+                        st = os.lstat(os.path.join(dirpath, f))
+                    except OSError:
+                        continue
+                    dead.discard((st.st_dev, st.st_ino))
+                if not dead:
+                    break
+
+        with self._lock:
+            self._db.executemany('DELETE FROM hashes WHERE dev = ? AND ino = ?', dead)
+            self._db.commit()
+        return len(dead)
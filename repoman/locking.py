@@ -0,0 +1,109 @@
+#!/usr/bin/env python2
+from __future__ import print_function
+
+# advisory file locks (flock) coordinating concurrent repoman runs
+#
+#   timelines: commands that change a timeline hold an exclusive lock on it from loading its state
+#              until they are done. read-only commands take no lock at all, the state file is
+#              always consistent on disk.
+#   repos:     a sync holds an exclusive lock on each repo while writing into it, a snapshot holds
+#              shared locks on the repos in its source while cloning, so it never captures a
+#              half-synced repo.
+
+import os
+import errno
+import fcntl
+import logging
+import contextlib
+
+
+class FileLock(object):
+    """ an flock on a lock file, exclusive or shared
+
+            the lock is released by release(), when the object is garbage collected, or when the
+            process exits
+    """
+
+    def __init__(self, path, shared=False, logger=None):
+        self.path = path
+        self.shared = shared
+        self.logger = logger or logging.getLogger('repoman.locking')
+        self._fh = None
+
+    @property
+    def locked(self):
+        return self._fh is not None
+
+    def acquire(self, blocking=True):
+        """ takes the lock, waiting for it if <blocking> is set; returns whether the lock was taken """
+
+        if self._fh is not None:
+            return True
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        mode = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        fh = open(self.path, 'a')
+        try:
+            try:
+                fcntl.flock(fh.fileno(), mode | fcntl.LOCK_NB)
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                if not blocking:
+                    fh.close()
+                    return False
+                self.logger.info('waiting for {0} lock [{1}]'.format('shared' if self.shared else 'exclusive', self.path))
+                fcntl.flock(fh.fileno(), mode)
+        except BaseException:
+            fh.close()
+            raise
+
+        self._fh = fh
+        return True
+
+    def release(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+@contextlib.contextmanager
+def hold(paths, shared=False, logger=None):
+    """ holds locks on all the given lock files, taken in a fixed (sorted) order to avoid deadlocks """
+
+    locks = [FileLock(p, shared=shared, logger=logger) for p in sorted(set(paths))]
+    try:
+        for lock in locks:
+            lock.acquire()
+        yield locks
+    finally:
+        for lock in reversed(locks):
+            lock.release()
+
+
+def repo_lock_path(lock_dir, repo_name):
+    """ returns the lock file of a repository """
+
+    return os.path.join(lock_dir, 'repo-{0}.lock'.format(repo_name.replace(os.sep, '_')))
+
+
+def overlaps(path_a, path_b):
+    """ checks whether one of the two directories contains the other """
+
+    a = os.path.realpath(path_a).rstrip(os.sep) + os.sep
+    b = os.path.realpath(path_b).rstrip(os.sep) + os.sep
+    return a.startswith(b) or b.startswith(a)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python2
+from __future__ import print_function
+
+# compact, memory-mappable index of the contents of a snapshot
+#
+# file layout (all integers little-endian):
+#
+#   header    magic 'RPMF', format version, checksum length, record count, offset of the path
+#             strings and the checksum type (e.g. 'sha256', empty if there are no checksums)
+#   records   one fixed-size record per entry, sorted by path: offset and length of the path in
+#             the string area, inode, size, mtime, type ('f', 'd', 'l' or 'o') and the checksum
+#   strings   the concatenated relative paths
+
+import os
+import mmap
+import struct
+from collections import namedtuple
+
+MAGIC = b'RPMF'
+VERSION = 1
+
+FILE = 'f'
+DIRECTORY = 'd'
+SYMLINK = 'l'
+OTHER = 'o'
+
+HEADER = struct.Struct('<4sHHQQ16s')
+RECORD = struct.Struct('<QIQQdc')
+
+Entry = namedtuple('Entry', ['path', 'inode', 'size', 'mtime', 'type', 'checksum'])
+
+
+def write_manifest(path, entries, checksum_type=''):
+    """ writes a manifest file from an iterable of Entry tuples (or plain tuples in the same order)
+
+            checksums, where present, must all be raw digests of the same length. the file is written
+            under a temporary name and renamed into place.
+    """
+
+    entries = sorted(entries, key=lambda e: e[0])
+    checksum_len = 0
+    for e in entries:
+        if e[5]:
+            checksum_len = len(e[5])
+            break
+    empty_checksum = b'\0' * checksum_len
+
+    strings_offset = HEADER.size + len(entries) * (RECORD.size + checksum_len)
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as fh:
+        fh.write(HEADER.pack(MAGIC, VERSION, checksum_len, len(entries), strings_offset, checksum_type))
+        offset = 0
+        for e in entries:
+            fh.write(RECORD.pack(offset, len(e[0]), e[1], e[2], e[3], e[4]))
+            if checksum_len:
+                fh.write(e[5] or empty_checksum)
+            offset += len(e[0])
+        for e in entries:
+            fh.write(e[0])
+    os.rename(tmp_path, path)
+
+
+class Manifest(object):
+    """ read access to a manifest file through mmap
+
+            lookups are binary searches on the sorted records, nothing is read into memory up front
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fh = open(path, 'rb')
+        self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.checksum_len, self.count, self._strings, checksum_type = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise Exception('[{0}] is not a manifest file (version {1})'.format(path, VERSION))
+        self.checksum_type = checksum_type.rstrip(b'\0')
+        self._record_size = RECORD.size + self.checksum_len
+
+    def close(self):
+        self._mm.close()
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def _path(self, i):
+        offset, length = struct.unpack_from('<QI', self._mm, HEADER.size + i * self._record_size)
+        start = self._strings + offset
+        return self._mm[start:start + length]
+
+    def _entry(self, i):
+        pos = HEADER.size + i * self._record_size
+        offset, length, inode, size, mtime, entry_type = RECORD.unpack_from(self._mm, pos)
+        checksum = None
+        if self.checksum_len:
+            checksum = self._mm[pos + RECORD.size:pos + self._record_size]
+            if checksum == b'\0' * self.checksum_len:
+                checksum = None
+        start = self._strings + offset
+        return Entry(self._mm[start:start + length], inode, size, mtime, entry_type, checksum)
+
+    def _bisect(self, path):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._path(mid) < path:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self._entry(i)
+
+    def get(self, path):
+        """ returns the entry of the given relative path, or None """
+
+        i = self._bisect(path)
+        if i < self.count and self._path(i) == path:
+            return self._entry(i)
+        return None
+
+    def __contains__(self, path):
+        return self.get(path) is not None
+
+    def iter_prefix(self, prefix):
+        """ yields the entries whose path starts with the given prefix, in path order
+
+                use a trailing slash to list the contents of a directory
+        """
+
+        i = self._bisect(prefix)
+        while i < self.count:
+            entry = self._entry(i)
+            if not entry.path.startswith(prefix):
+                break
+            yield entry
+            i += 1
+
+    def total_size(self, prefix=''):
+        """ returns the sum of the sizes of the files below the given prefix """
+
+        return sum(e.size for e in self.iter_prefix(prefix) if e.type == FILE)
@@ -0,0 +1,718 @@
+#!/usr/bin/env python2
+from __future__ import print_function
+
+# generating yum repository metadata without createrepo
+#
+# the rpm headers are read directly (see the rpmheader module) and new packages are read by a pool of
+# worker processes. what was read from a package is kept in a record cache keyed by (device, inode)
+# together with its mtime and size, so a package is only read again when it changed; a package
+# hard linked into several repos is read once for all of them. the checksums of the packages come
+# from the shared hashcache, a package is only hashed when the hashcache has no current checksum.
+#
+# the metadata is written in a second pass over the records: primary, filelists and other xml and
+# their sqlite databases (the schema of createrepo --database) are streamed out side by side, then
+# repomd.xml lists them and the new repodata/ replaces the published one.
+
+import os
+import re
+import bz2
+import json
+import stat
+import time
+import gzip
+import shutil
+import sqlite3
+import hashlib
+import logging
+import multiprocessing
+
+import rpmheader
+import hashcache
+import upstream_repodata
+
+CACHE_NAME = 'repoman-metadata.sqlite'
+STAGING_DIR_NAME = '.repodata.generated'
+
+CHECKSUM_TYPE = 'sha256'
+DB_VERSION = 10
+CHANGELOG_LIMIT = 10
+
+# directories which are never looked into for packages
+SKIP_DIRS = ('repodata', '.cache', STAGING_DIR_NAME, upstream_repodata.STAGING_DIR_NAME)
+
+# characters which are not allowed in xml 1.0
+_INVALID_XML = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# files which are listed in primary as well as in filelists, like createrepo does
+_PRIMARY_FILE = re.compile(r'^(/etc/.*|.*bin/.*|/usr/lib/sendmail)$')
+
+# dependency flags -> comparison of the metadata
+_FLAGS = {
+    rpmheader.SENSE_EQUAL: 'EQ',
+    rpmheader.SENSE_LESS: 'LT',
+    rpmheader.SENSE_GREATER: 'GT',
+    rpmheader.SENSE_LESS | rpmheader.SENSE_EQUAL: 'LE',
+    rpmheader.SENSE_GREATER | rpmheader.SENSE_EQUAL: 'GE',
+}
+_PRE = rpmheader.SENSE_PREREQ | rpmheader.SENSE_SCRIPT_PRE | rpmheader.SENSE_SCRIPT_POST
+
+# the dependency kinds, in the order the metadata lists them
+_DEPENDENCIES = ('provides', 'requires', 'conflicts', 'obsoletes',
+                 'suggests', 'enhances', 'recommends', 'supplements')
+
+
+def _text(value):
+    """ returns a header string as unicode which can be written to xml """
+
+    if value is None:
+        return None
+    try:
+        value = value.decode('utf-8')
+    except UnicodeError:
+        value = value.decode('latin-1')
+    return _INVALID_XML.sub(u'', value)
+
+
+def _evr(version):
+    """ splits a dependency version [epoch:]version[-release] into (epoch, version, release) """
+
+    if not version:
+        return None, None, None
+    epoch, sep, rest = version.partition(':')
+    if not sep:
+        epoch, rest = '0', version
+    ver, sep, rel = rest.rpartition('-')
+    if not sep:
+        ver, rel = rest, None
+    return epoch, ver, rel
+
+
+def _dependencies(header, kind):
+    """ returns the dependencies of a kind as [name, flags, epoch, version, release, pre] lists """
+
+    name_tag, flags_tag, version_tag = rpmheader.DEPENDENCIES[kind]
+    names = header.get(name_tag, [])
+    flags = header.get(flags_tag, [0] * len(names))
+    versions = header.get(version_tag, [''] * len(names))
+    deps = []
+    seen = set()
+    for name, flag, version in zip(names, flags, versions):
+        # rpmlib features are checked by rpm itself, not by the depsolver
+        if kind == 'requires' and name.startswith('rpmlib('):
+            continue
+        pre = bool(kind == 'requires' and flag & _PRE)
+        dep = [_text(name), _FLAGS.get(flag & 0xe)] + list(_evr(version)) + [pre]
+        if tuple(dep) not in seen:
+            seen.add(tuple(dep))
+            deps.append(dep)
+    return deps
+
+
+def _files(header):
+    """ returns the files of a package as [path, type] lists, the type being '', 'dir' or 'ghost' """
+
+    if rpmheader.BASENAMES in header:
+        dirnames = header.get(rpmheader.DIRNAMES)
+        paths = [dirnames[i] + b for i, b in zip(header.get(rpmheader.DIRINDEXES), header.get(rpmheader.BASENAMES))]
+    else:
+        paths = header.get(rpmheader.OLDFILENAMES, [])
+    modes = header.get(rpmheader.FILEMODES, [0] * len(paths))
+    flags = header.get(rpmheader.FILEFLAGS, [0] * len(paths))
+
+    files = []
+    for path, mode, flag in zip(paths, modes, flags):
+        if stat.S_ISDIR(mode & 0xffff):
+            kind = 'dir'
+        elif flag & rpmheader.FILE_GHOST:
+            kind = 'ghost'
+        else:
+            kind = ''
+        files.append([_text(path), kind])
+    return files
+
+
+def _first(header, tag, default=None):
+    value = header.get(tag)
+    return value[0] if value else default
+
+
+def package_record(header, changelog_limit=CHANGELOG_LIMIT):
+    """ returns what the metadata lists of a package, from its rpmheader.Header, as a dict which
+        can be stored as json
+    """
+
+    get = lambda tag: _text(header.get(tag))
+    record = {
+        'name': get(rpmheader.NAME),
+        'arch': u'src' if header.source else get(rpmheader.ARCH),
+        'epoch': unicode(_first(header, rpmheader.EPOCH, 0)),
+        'version': get(rpmheader.VERSION),
+        'release': get(rpmheader.RELEASE),
+        'summary': get(rpmheader.SUMMARY),
+        'description': get(rpmheader.DESCRIPTION),
+        'packager': get(rpmheader.PACKAGER),
+        'url': get(rpmheader.URL),
+        'buildtime': _first(header, rpmheader.BUILDTIME, 0),
+        'license': get(rpmheader.LICENSE),
+        'vendor': get(rpmheader.VENDOR),
+        'group': get(rpmheader.GROUP),
+        'buildhost': get(rpmheader.BUILDHOST),
+        'sourcerpm': None if header.source else get(rpmheader.SOURCERPM),
+        'header_start': header.start,
+        'header_end': header.end,
+        'size_installed': _first(header, rpmheader.LONGSIZE) or _first(header, rpmheader.SIZE, 0),
+        'size_archive': (_first(header.signature, rpmheader.SIG_LONGARCHIVESIZE)
+                         or _first(header.signature, rpmheader.SIG_PAYLOADSIZE, 0)),
+        'files': _files(header),
+    }
+    for kind in _DEPENDENCIES:
+        record[kind] = _dependencies(header, kind)
+
+    # rpm keeps the newest entries first, the metadata lists the kept ones oldest first
+    changelogs = zip(header.get(rpmheader.CHANGELOGNAME, []), header.get(rpmheader.CHANGELOGTIME, []),
+                     header.get(rpmheader.CHANGELOGTEXT, []))[:changelog_limit]
+    record['changelogs'] = [[_text(author), date, _text(text)] for author, date, text in reversed(changelogs)]
+    return record
+
+
+def _read_package(task):
+    """ runs in a worker process: reads the header of a package and, with <checksum> set, hashes
+        it, returns (index, checksum, record, error)
+    """
+
+    index, path, changelog_limit, checksum = task
+    try:
+        record = package_record(rpmheader.read_header(path), changelog_limit)
+        checksum = hashcache.hash_file(path, CHECKSUM_TYPE, bufsize=8 * 1024 * 1024) if checksum else None
+        return index, checksum, record, None
+    except (rpmheader.InvalidPackage, IOError, OSError) as e:
+        return index, None, None, str(e)
+
+
+class RecordCache(object):
+    """ sqlite backed cache of package records, keyed by (device, inode) and only valid as long as
+        mtime and size of the package are unchanged (like the hashcache module, which holds the
+        checksums of the packages)
+
+            several generators may share the file, each with a connection of its own
+    """
+
+    _commit_every = 500
+
+    def __init__(self, path, changelog_limit=CHANGELOG_LIMIT):
+        self.path = path
+        self.changelog_limit = changelog_limit
+        self._pending = 0
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._db = sqlite3.connect(path, timeout=hashcache.BUSY_TIMEOUT)
+        self._db.execute('PRAGMA journal_mode = WAL')
+        # the records table of older versions held the checksums as well
+        self._db.execute('DROP TABLE IF EXISTS records')
+        self._db.execute('CREATE TABLE IF NOT EXISTS headers (dev INTEGER NOT NULL, ino INTEGER NOT NULL, '
+                         'mtime REAL NOT NULL, size INTEGER NOT NULL, changelog_limit INTEGER NOT NULL, '
+                         'record TEXT NOT NULL, PRIMARY KEY (dev, ino))')
+        self._db.commit()
+
+    def close(self):
+        self.commit()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def commit(self):
+        self._db.commit()
+        self._pending = 0
+
+    def lookup(self, st):
+        """ returns the record of the package with the given stat result, or None """
+
+        row = self._db.execute('SELECT mtime, size, changelog_limit, record FROM headers '
+                               'WHERE dev = ? AND ino = ?', (st.st_dev, st.st_ino)).fetchone()
+        if row is None or tuple(row[:3]) != (st.st_mtime, st.st_size, self.changelog_limit):
+            return None
+        return json.loads(row[3])
+
+    def valid(self, st):
+        """ returns True if the cache holds a current record of the package with the given stat result """
+
+        row = self._db.execute('SELECT mtime, size, changelog_limit FROM headers '
+                               'WHERE dev = ? AND ino = ?', (st.st_dev, st.st_ino)).fetchone()
+        return row is not None and tuple(row) == (st.st_mtime, st.st_size, self.changelog_limit)
+
+    def store(self, st, record):
+        self._db.execute('INSERT OR REPLACE INTO headers (dev, ino, mtime, size, changelog_limit, record) '
+                         'VALUES (?, ?, ?, ?, ?, ?)',
+                         (st.st_dev, st.st_ino, st.st_mtime, st.st_size, self.changelog_limit, json.dumps(record)))
+        self._pending += 1
+        if self._pending >= self._commit_every:
+            self.commit()
+
+    def prune(self, roots):
+        """ removes the records of packages which no longer exist below any of the directories <roots>
+
+                returns the number of records removed
+        """
+
+        self.commit()
+        dead = set(self._db.execute('SELECT dev, ino FROM headers').fetchall())
+        for root in roots:
+            for dirpath, dirs, files in os.walk(root):
+                for f in files:
+                    if not f.endswith('.rpm'):
+                        continue
+                    try:
+                        st = os.lstat(os.path.join(dirpath, f))
+                    except OSError:
+                        continue
+                    dead.discard((st.st_dev, st.st_ino))
+                if not dead:
+                    break
+
+        self._db.executemany('DELETE FROM headers WHERE dev = ? AND ino = ?', dead)
+        self.commit()
+        return len(dead)
+
+
+def _escape(text):
+    """ escapes text for xml content and double quoted attributes """
+
+    return text.replace(u'&', u'&amp;').replace(u'<', u'&lt;').replace(u'>', u'&gt;').replace(u'"', u'&quot;')
+
+
+def _attrs(*pairs):
+    """ returns xml attributes of the (name, value) pairs whose value is not None """
+
+    return u''.join(u' {0}="{1}"'.format(n, _escape(unicode(v))) for n, v in pairs if v is not None)
+
+
+def _element(tag, text, indent):
+    if text is None:
+        return u'{0}<{1}/>\n'.format(indent, tag)
+    return u'{0}<{1}>{2}</{1}>\n'.format(indent, tag, _escape(text))
+
+
+def _version(p):
+    return u'<version{0}/>'.format(_attrs(('epoch', p['epoch']), ('ver', p['version']), ('rel', p['release'])))
+
+
+def _primary_xml(p):
+    lines = [
+        u'<package type="rpm">\n',
+        _element('name', p['name'], '  '),
+        _element('arch', p['arch'], '  '),
+        u'  {0}\n'.format(_version(p)),
+        u'  <checksum type="{0}" pkgid="YES">{1}</checksum>\n'.format(p['checksum_type'], p['checksum']),
+        _element('summary', p['summary'], '  '),
+        _element('description', p['description'], '  '),
+        _element('packager', p['packager'], '  '),
+        _element('url', p['url'], '  '),
+        u'  <time{0}/>\n'.format(_attrs(('file', p['time_file']), ('build', p['buildtime']))),
+        u'  <size{0}/>\n'.format(_attrs(('package', p['size_package']), ('installed', p['size_installed']),
+                                        ('archive', p['size_archive']))),
+        u'  <location{0}/>\n'.format(_attrs(('href', p['location']))),
+        u'  <format>\n',
+    ]
+    for tag in ('license', 'vendor', 'group', 'buildhost', 'sourcerpm'):
+        lines.append(_element('rpm:' + tag, p[tag], '    '))
+    lines.append(u'    <rpm:header-range{0}/>\n'.format(_attrs(('start', p['header_start']), ('end', p['header_end']))))
+    for kind in _DEPENDENCIES:
+        if not p[kind]:
+            continue
+        lines.append(u'    <rpm:{0}>\n'.format(kind))
+        for name, flags, epoch, ver, rel, pre in p[kind]:
+            lines.append(u'      <rpm:entry{0}/>\n'.format(_attrs(
+                ('name', name), ('flags', flags), ('epoch', epoch), ('ver', ver), ('rel', rel),
+                ('pre', '1' if pre else None))))
+        lines.append(u'    </rpm:{0}>\n'.format(kind))
+    for path, kind in p['files']:
+        if kind != 'ghost' and _PRIMARY_FILE.match(path):
+            lines.append(u'    <file{0}>{1}</file>\n'.format(_attrs(('type', kind or None)), _escape(path)))
+    lines.append(u'  </format>\n</package>\n')
+    return u''.join(lines)
+
+
+def _filelists_xml(p):
+    lines = [u'<package{0}>\n'.format(_attrs(('pkgid', p['checksum']), ('name', p['name']), ('arch', p['arch']))),
+             u'  {0}\n'.format(_version(p))]
+    for path, kind in p['files']:
+        lines.append(u'  <file{0}>{1}</file>\n'.format(_attrs(('type', kind or None)), _escape(path)))
+    lines.append(u'</package>\n')
+    return u''.join(lines)
+
+
+def _other_xml(p):
+    lines = [u'<package{0}>\n'.format(_attrs(('pkgid', p['checksum']), ('name', p['name']), ('arch', p['arch']))),
+             u'  {0}\n'.format(_version(p))]
+    for author, date, text in p['changelogs']:
+        lines.append(u'  <changelog{0}>{1}</changelog>\n'.format(_attrs(('author', author), ('date', date)),
+                                                                 _escape(text or u'')))
+    lines.append(u'</package>\n')
+    return u''.join(lines)
+
+
+# the schema of the sqlite databases, as createrepo writes them
+_DEPENDENCY_COLUMNS = 'name TEXT, flags TEXT, epoch TEXT, version TEXT, release TEXT, pkgKey INTEGER'
+_SCHEMAS = {
+    'primary': [
+        'CREATE TABLE packages (pkgKey INTEGER PRIMARY KEY, pkgId TEXT, name TEXT, arch TEXT, version TEXT, '
+        'epoch TEXT, release TEXT, summary TEXT, description TEXT, url TEXT, time_file INTEGER, '
+        'time_build INTEGER, rpm_license TEXT, rpm_vendor TEXT, rpm_group TEXT, rpm_buildhost TEXT, '
+        'rpm_sourcerpm TEXT, rpm_header_start INTEGER, rpm_header_end INTEGER, rpm_packager TEXT, '
+        'size_package INTEGER, size_installed INTEGER, size_archive INTEGER, location_href TEXT, '
+        'location_base TEXT, checksum_type TEXT)',
+        'CREATE TABLE files (name TEXT, type TEXT, pkgKey INTEGER)',
+        'CREATE TABLE requires ({0}, pre BOOLEAN DEFAULT FALSE)'.format(_DEPENDENCY_COLUMNS),
+    ] + ['CREATE TABLE {0} ({1})'.format(kind, _DEPENDENCY_COLUMNS) for kind in _DEPENDENCIES if kind != 'requires'] + [
+        'CREATE INDEX packagename ON packages (name)',
+        'CREATE INDEX packageId ON packages (pkgId)',
+        'CREATE INDEX filenames ON files (name)',
+        'CREATE INDEX pkgfiles ON files (pkgKey)',
+    ] + ['CREATE INDEX pkg{0} ON {0} (pkgKey)'.format(kind) for kind in _DEPENDENCIES] + [
+        'CREATE INDEX {0}name ON {0} (name)'.format(kind) for kind in ('provides', 'requires')],
+    'filelists': [
+        'CREATE TABLE packages (pkgKey INTEGER PRIMARY KEY, pkgId TEXT)',
+        'CREATE TABLE filelist (pkgKey INTEGER, dirname TEXT, filenames TEXT, filetypes TEXT)',
+        'CREATE INDEX keyfile ON filelist (pkgKey)',
+        'CREATE INDEX pkgId ON packages (pkgId)',
+        'CREATE INDEX dirnames ON filelist (dirname)',
+    ],
+    'other': [
+        'CREATE TABLE packages (pkgKey INTEGER PRIMARY KEY, pkgId TEXT)',
+        'CREATE TABLE changelog (pkgKey INTEGER, author TEXT, date INTEGER, changelog TEXT)',
+        'CREATE INDEX keychange ON changelog (pkgKey)',
+        'CREATE INDEX pkgId ON packages (pkgId)',
+    ],
+}
+
+_FILE_TYPES = {'': 'f', 'dir': 'd', 'ghost': 'g'}
+
+
+def _insert_primary(db, key, p):
+    db.execute('INSERT INTO packages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+               (key, p['checksum'], p['name'], p['arch'], p['version'], p['epoch'], p['release'], p['summary'],
+                p['description'], p['url'], p['time_file'], p['buildtime'], p['license'], p['vendor'], p['group'],
+                p['buildhost'], p['sourcerpm'], p['header_start'], p['header_end'], p['packager'],
+                p['size_package'], p['size_installed'], p['size_archive'], p['location'], None,
+                p['checksum_type']))
+    db.executemany('INSERT INTO files VALUES (?, ?, ?)',
+                   [(path, kind or 'file', key) for path, kind in p['files']
+                    if kind != 'ghost' and _PRIMARY_FILE.match(path)])
+    db.executemany('INSERT INTO requires VALUES (?, ?, ?, ?, ?, ?, ?)',
+                   [tuple(dep[:5]) + (key, 'TRUE' if dep[5] else 'FALSE') for dep in p['requires']])
+    for kind in _DEPENDENCIES:
+        if kind != 'requires':
+            db.executemany('INSERT INTO {0} VALUES (?, ?, ?, ?, ?, ?)'.format(kind),
+                           [tuple(dep[:5]) + (key,) for dep in p[kind]])
+
+
+def _insert_filelists(db, key, p):
+    db.execute('INSERT INTO packages VALUES (?, ?)', (key, p['checksum']))
+    directories = {}
+    order = []
+    for path, kind in p['files']:
+        dirname, basename = path.rsplit(u'/', 1) if u'/' in path else (u'', path)
+        if dirname not in directories:
+            directories[dirname] = ([], [])
+            order.append(dirname)
+        directories[dirname][0].append(basename)
+        directories[dirname][1].append(_FILE_TYPES[kind])
+    db.executemany('INSERT INTO filelist VALUES (?, ?, ?, ?)',
+                   [(key, d, u'/'.join(directories[d][0]), ''.join(directories[d][1])) for d in order])
+
+
+def _insert_other(db, key, p):
+    db.execute('INSERT INTO packages VALUES (?, ?)', (key, p['checksum']))
+    db.executemany('INSERT INTO changelog VALUES (?, ?, ?, ?)',
+                   [(key, author, date, text) for author, date, text in p['changelogs']])
+
+
+class _MetadataFile(object):
+    """ a compressed metadata file being written, which keeps the checksum and size of what was written """
+
+    def __init__(self, path):
+        self.path = path
+        self.open_checksum = hashlib.new(CHECKSUM_TYPE)
+        self.open_size = 0
+        self._fh = gzip.GzipFile(path, 'wb', mtime=0)
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        self.open_checksum.update(data)
+        self.open_size += len(data)
+        self._fh.write(data)
+
+    def close(self):
+        self._fh.close()
+
+
+def _finish_file(path, kind, open_checksum, open_size, extra=None):
+    """ renames a written metadata file to its checksum-prefixed name, returns its repomd entry """
+
+    checksum = hashcache.hash_file(path, CHECKSUM_TYPE)
+    directory, name = os.path.split(path)
+    final = os.path.join(directory, '{0}-{1}'.format(checksum, name))
+    os.rename(path, final)
+    return {'type': kind, 'checksum': checksum, 'open_checksum': open_checksum, 'open_size': open_size,
+            'location': 'repodata/' + os.path.basename(final), 'size': os.path.getsize(final),
+            'timestamp': int(os.path.getmtime(final)), 'extra': extra or []}
+
+
+def _compress_file(path, target, kind, extra=None):
+    """ compresses the file at <path> into <target> (gzip or bz2, by its extension), returns the
+        repomd entry of the compressed file
+    """
+
+    out = gzip.GzipFile(target, 'wb', mtime=0) if target.endswith('.gz') else bz2.BZ2File(target, 'wb')
+    with open(path, 'rb') as fh:
+        try:
+            shutil.copyfileobj(fh, out, 1024 * 1024)
+        finally:
+            out.close()
+    return _finish_file(target, kind, hashcache.hash_file(path, CHECKSUM_TYPE), os.path.getsize(path), extra)
+
+
+def _write_repomd(path, entries):
+    lines = [u'<?xml version="1.0" encoding="UTF-8"?>\n',
+             u'<repomd xmlns="http://linux.duke.edu/metadata/repo" xmlns:rpm="http://linux.duke.edu/metadata/rpm">\n',
+             u'  <revision>{0}</revision>\n'.format(int(time.time()))]
+    for e in entries:
+        lines.append(u'  <data type="{0}">\n'.format(e['type']))
+        lines.append(u'    <checksum type="{0}">{1}</checksum>\n'.format(CHECKSUM_TYPE, e['checksum']))
+        if e['open_checksum']:
+            lines.append(u'    <open-checksum type="{0}">{1}</open-checksum>\n'.format(CHECKSUM_TYPE, e['open_checksum']))
+        lines.append(u'    <location href="{0}"/>\n'.format(e['location']))
+        lines.append(u'    <timestamp>{0}</timestamp>\n'.format(e['timestamp']))
+        lines.append(u'    <size>{0}</size>\n'.format(e['size']))
+        if e['open_size'] is not None:
+            lines.append(u'    <open-size>{0}</open-size>\n'.format(e['open_size']))
+        for tag, value in e['extra']:
+            lines.append(u'    <{0}>{1}</{0}>\n'.format(tag, value))
+        lines.append(u'  </data>\n')
+    lines.append(u'</repomd>\n')
+    with open(path, 'wb') as fh:
+        fh.write(u''.join(lines).encode('utf-8'))
+
+
+def find_packages(path):
+    """ returns the relative paths of the packages below <path>, sorted """
+
+    found = []
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for f in files:
+            if f.endswith('.rpm'):
+                found.append(os.path.relpath(os.path.join(root, f), path))
+    return sorted(found)
+
+
+class MetadataStats(object):
+    """ counters of a metadata generation """
+
+    def __init__(self):
+        self.packages = 0
+        self.read = 0
+        self.reused = 0
+        self.failed = []
+
+    def __str__(self):
+        return '{0} packages ({1} read, {2} reused), {3} failed'.format(
+            self.packages, self.read, self.reused, len(self.failed))
+
+
+class MetadataGenerator(object):
+    """ generates the repodata/ of a directory of packages, see the module comment
+
+            <cache_path> is the record cache (RecordCache), <hash_cache_path> the checksum cache
+            (hashcache.HashCache), <workers> the number of processes which read new packages (0: one
+            per cpu). with <database>, the sqlite databases are written as well.
+    """
+
+    def __init__(self, cache_path, hash_cache_path, workers=0, database=True, changelog_limit=CHANGELOG_LIMIT,
+                 logger=None):
+        self.cache_path = cache_path
+        self.hash_cache_path = hash_cache_path
+        self.workers = workers or multiprocessing.cpu_count()
+        self.database = database
+        self.changelog_limit = changelog_limit
+        self.logger = logger or logging.getLogger('repoman.mkrepodata')
+
+    def generate(self, path, packages=None, groupfile=None, log=None, hash_cache=None):
+        """ generates the metadata of the repository at <path> and publishes it, returns MetadataStats
+
+                <packages> lists the packages (paths relative to <path>) to include, by default all
+                packages below <path>; <groupfile> is a comps.xml to include. packages which can't be
+                read are left out. progress is written to the file object <log>. <hash_cache> is an
+                open HashCache to use instead of opening the one at hash_cache_path
+        """
+
+        def note(message):
+            self.logger.debug(message)
+            if log is not None:
+                log.write(message + '\n')
+                log.flush()
+
+        path = os.path.abspath(path)
+        if packages is None:
+            packages = find_packages(path)
+
+        stats = MetadataStats()
+        cache = RecordCache(self.cache_path, self.changelog_limit)
+        hashes = hash_cache or hashcache.HashCache(self.hash_cache_path)
+        staging = os.path.join(path, STAGING_DIR_NAME)
+        try:
+            listed = self._read_packages(path, packages, cache, hashes, stats, note)
+            stats.packages = len(listed)
+
+            if os.path.isdir(staging):
+                shutil.rmtree(staging)
+            os.makedirs(os.path.join(staging, 'repodata'))
+            entries = self._write_metadata(os.path.join(staging, 'repodata'), listed, cache, hashes)
+            if groupfile:
+                entries.extend(self._write_groupfile(os.path.join(staging, 'repodata'), groupfile))
+            _write_repomd(os.path.join(staging, 'repodata', 'repomd.xml'), entries)
+            upstream_repodata.publish(staging, path)
+        except BaseException:
+            if os.path.isdir(staging):
+                shutil.rmtree(staging)
+            raise
+        finally:
+            cache.close()
+            if hash_cache is None:
+                hashes.close()
+
+        note(str(stats))
+        return stats
+
+    def _read_packages(self, path, packages, cache, hashes, stats, note):
+        """ brings the records of all <packages> into the cache and their checksums into <hashes>,
+            returns (relative path, stat result) of the packages which can be listed
+        """
+
+        listed = []
+        # packages whose record or checksum is missing or outdated: (relative path, stat result, hash it)
+        todo = []
+        seen = set()
+        for rel in packages:
+            try:
+                st = os.stat(os.path.join(path, rel))
+            except OSError as e:
+                note('skipping {0}: {1}'.format(rel, e))
+                stats.failed.append(rel)
+                continue
+            listed.append((rel, st))
+            checksum = hashes.lookup(st, CHECKSUM_TYPE)
+            if checksum is not None and cache.valid(st):
+                stats.reused += 1
+            elif (st.st_dev, st.st_ino) not in seen:
+                seen.add((st.st_dev, st.st_ino))
+                todo.append((rel, st, checksum is None))
+
+        if not todo:
+            return listed
+
+        note('reading {0} packages with {1} processes'.format(len(todo), min(self.workers, len(todo))))
+        tasks = [(i, os.path.join(path, rel), self.changelog_limit, checksum)
+                 for i, (rel, st, checksum) in enumerate(todo)]
+        failed = set()
+        pool = multiprocessing.Pool(min(self.workers, len(todo)))
+        committed = time.time()
+        try:
+            for i, checksum, record, error in pool.imap_unordered(_read_package, tasks, chunksize=4):
+                # the caches are shared with other syncs, which must not wait for the whole run
+                if time.time() - committed >= hashcache.COMMIT_INTERVAL:
+                    cache.commit()
+                    hashes.commit()
+                    committed = time.time()
+                rel, st, _ = todo[i]
+                if error is not None:
+                    note('skipping {0}: {1}'.format(rel, error))
+                    failed.add((st.st_dev, st.st_ino))
+                    continue
+                stats.read += 1
+                cache.store(st, record)
+                if checksum is not None:
+                    hashes.store(st, checksum, CHECKSUM_TYPE)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+            cache.commit()
+            hashes.commit()
+
+        if failed:
+            stats.failed.extend(rel for rel, st in listed if (st.st_dev, st.st_ino) in failed)
+            listed = [(rel, st) for rel, st in listed if (st.st_dev, st.st_ino) not in failed]
+        return listed
+
+    def _write_metadata(self, repodata_dir, listed, cache, hashes):
+        """ writes the xml files and databases of the <listed> packages, returns their repomd entries """
+
+        names = {'primary': 'metadata', 'filelists': 'filelists', 'other': 'otherdata'}
+        namespaces = {
+            'primary': ' xmlns="http://linux.duke.edu/metadata/common" xmlns:rpm="http://linux.duke.edu/metadata/rpm"',
+            'filelists': ' xmlns="http://linux.duke.edu/metadata/filelists"',
+            'other': ' xmlns="http://linux.duke.edu/metadata/other"',
+        }
+        writers = {'primary': _primary_xml, 'filelists': _filelists_xml, 'other': _other_xml}
+        inserts = {'primary': _insert_primary, 'filelists': _insert_filelists, 'other': _insert_other}
+        kinds = ('primary', 'filelists', 'other')
+
+        files = {}
+        databases = {}
+        for kind in kinds:
+            files[kind] = _MetadataFile(os.path.join(repodata_dir, kind + '.xml.gz'))
+            files[kind].write(u'<?xml version="1.0" encoding="UTF-8"?>\n<{0}{1} packages="{2}">\n'.format(
+                names[kind], namespaces[kind], len(listed)))
+            if self.database:
+                db = databases[kind] = sqlite3.connect(os.path.join(repodata_dir, kind + '.sqlite'))
+                db.execute('PRAGMA synchronous = OFF')
+                db.execute('CREATE TABLE db_info (dbversion INTEGER, checksum TEXT)')
+                for statement in _SCHEMAS[kind]:
+                    db.execute(statement)
+
+        for key, (rel, st) in enumerate(listed, 1):
+            p = cache.lookup(st)
+            checksum = hashes.lookup(st, CHECKSUM_TYPE)
+            if p is None or checksum is None:
+                raise Exception('package changed while generating metadata [{0}]'.format(rel))
+            p.update({'checksum': checksum, 'checksum_type': CHECKSUM_TYPE, 'location': rel.decode('utf-8'),
+                      'size_package': st.st_size, 'time_file': int(st.st_mtime)})
+            for kind in kinds:
+                files[kind].write(writers[kind](p))
+                if self.database:
+                    inserts[kind](databases[kind], key, p)
+
+        entries = []
+        for kind in kinds:
+            files[kind].write(u'</{0}>\n'.format(names[kind]))
+            files[kind].close()
+            entry = _finish_file(files[kind].path, kind, files[kind].open_checksum.hexdigest(), files[kind].open_size)
+            entries.append(entry)
+            if self.database:
+                # the database records which xml it was generated from
+                db = databases[kind]
+                db.execute('INSERT INTO db_info VALUES (?, ?)', (DB_VERSION, entry['checksum']))
+                db.commit()
+                db.close()
+                db_path = os.path.join(repodata_dir, kind + '.sqlite')
+                entries.append(_compress_file(db_path, db_path + '.bz2', kind + '_db',
+                                              [('database_version', DB_VERSION)]))
+                os.remove(db_path)
+        return entries
+
+    def _write_groupfile(self, repodata_dir, groupfile):
+        """ copies the group file into the repodata, plain and compressed, returns their repomd entries """
+
+        target = os.path.join(repodata_dir, os.path.basename(groupfile))
+        entries = [_compress_file(groupfile, target + '.gz', 'group_gz')]
+        shutil.copyfile(groupfile, target)
+        entries.insert(0, _finish_file(target, 'group', None, None))
+        return entries
@@ -0,0 +1,198 @@
+#!/usr/bin/env python2
+from __future__ import print_function
+
+# compact in-memory / on-disk index of the packages of a repository
+#
+# the packages are kept in columns instead of one object per package: names, arches, epochs,
+# versions, releases and checksum types are interned into a string table and stored as indexes,
+# locations are stored in one blob with an offset array, sizes in an integer array and the
+# checksums as raw bytes, so memory use is a small fraction of one python object per package.
+
+import os
+import json
+import array
+import hashlib
+import binascii
+
+import repodata
+
+MAGIC = 'repoman-pkgindex-1\n'
+
+
+def _str(value):
+    """ returns ascii text as str, like the metadata parser does """
+
+    try:
+        return value.encode('ascii')
+    except UnicodeError:
+        return value
+
+
+# columns of string table indexes, in the order of the Package fields they hold
+_STRING_COLUMNS = ('name', 'checksum_type', 'arch', 'epoch', 'version', 'release')
+
+
+class PackageIndex(object):
+    """ the packages of a repository in compact columns, see the module comment
+
+            packages are added in order and addressed by their position; index[i] returns a
+            repodata.Package
+    """
+
+    def __init__(self):
+        self.strings = []
+        self._string_ids = {}
+        self.columns = dict((c, array.array('I')) for c in _STRING_COLUMNS)
+        self.sizes = array.array('l')
+        self.location_offsets = array.array('L', [0])
+        self.locations = bytearray()
+        self.checksum_offsets = array.array('L', [0])
+        self.checksums = bytearray()
+        self._by_name = None
+
+    def _intern(self, value):
+        value = '' if value is None else value
+        i = self._string_ids.get(value)
+        if i is None:
+            i = self._string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return i
+
+    def add(self, package):
+        for c in _STRING_COLUMNS:
+            self.columns[c].append(self._intern(getattr(package, c)))
+        self.sizes.append(-1 if package.size is None else package.size)
+        self.locations.extend(package.location.encode('utf-8'))
+        self.location_offsets.append(len(self.locations))
+        self.checksums.extend(binascii.unhexlify(package.checksum))
+        self.checksum_offsets.append(len(self.checksums))
+        self._by_name = None
+
+    @classmethod
+    def build(cls, packages):
+        """ returns an index of the Packages from the iterable <packages> """
+
+        index = cls()
+        for p in packages:
+            index.add(p)
+        return index
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        s = dict((c, self.strings[self.columns[c][i]] or None) for c in _STRING_COLUMNS)
+        location = _str(self.locations[self.location_offsets[i]:self.location_offsets[i + 1]].decode('utf-8'))
+        checksum = binascii.hexlify(self.checksums[self.checksum_offsets[i]:self.checksum_offsets[i + 1]])
+        size = self.sizes[i]
+        return repodata.Package(s['name'], location, s['checksum_type'], checksum, None if size < 0 else size,
+                                s['arch'], s['epoch'], s['version'], s['release'])
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def find(self, name):
+        """ returns the Packages with the given name """
+
+        if self._by_name is None:
+            self._by_name = {}
+            for i, n in enumerate(self.columns['name']):
+                self._by_name.setdefault(n, []).append(i)
+        n = self._string_ids.get(name)
+        return [self[i] for i in self._by_name.get(n, [])]
+
+    def memory_size(self):
+        """ returns the approximate number of bytes the columns take """
+
+        return (sum(len(s) for s in self.strings) + sum(a.itemsize * len(a) for a in self.columns.values())
+                + self.sizes.itemsize * len(self.sizes) + self.location_offsets.itemsize * len(self.location_offsets)
+                + len(self.locations) + self.checksum_offsets.itemsize * len(self.checksum_offsets)
+                + len(self.checksums))
+
+    def _arrays(self):
+        return [self.columns[c] for c in _STRING_COLUMNS] + [self.sizes, self.location_offsets, self.checksum_offsets]
+
+    def save(self, path, source=None):
+        """ writes the index to <path> (atomically); <source> identifies what it was built from """
+
+        header = {
+            'source': source,
+            'strings': self.strings,
+            'arrays': [(a.typecode, a.itemsize, len(a)) for a in self._arrays()],
+            'locations': len(self.locations),
+            'checksums': len(self.checksums),
+        }
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as fh:
+            fh.write(MAGIC)
+            fh.write(json.dumps(header) + '\n')
+            for a in self._arrays():
+                a.tofile(fh)
+            fh.write(self.locations)
+            fh.write(self.checksums)
+        os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path, source=None):
+        """ reads an index written by save(); returns None if it is missing, of another format or
+            architecture, or was built from another <source>
+        """
+
+        try:
+            fh = open(path, 'rb')
+        except IOError:
+            return None
+        with fh:
+            if fh.readline() != MAGIC:
+                return None
+            header = json.loads(fh.readline())
+            if source is not None and header['source'] != source:
+                return None
+
+            index = cls()
+            arrays = index._arrays()
+            for a, (typecode, itemsize, length) in zip(arrays, header['arrays']):
+                if a.typecode != typecode or a.itemsize != itemsize:
+                    return None
+            for a, (typecode, itemsize, length) in zip(arrays, header['arrays']):
+                del a[:]
+                a.fromfile(fh, length)
+            index.strings = [_str(s) for s in header['strings']]
+            index._string_ids = dict((s, i) for i, s in enumerate(index.strings))
+            index.locations = bytearray(fh.read(header['locations']))
+            index.checksums = bytearray(fh.read(header['checksums']))
+        return index
+
+
+def repomd_checksum(repo_path):
+    """ returns the sha256 of the repomd.xml of a repository, which identifies its metadata """
+
+    with open(os.path.join(repo_path, repodata.REPOMD), 'rb') as fh:
+        return hashlib.sha256(fh.read()).hexdigest()
+
+
+def index_repository(repo_path, index_path=None):
+    """ returns the PackageIndex of the repository at <repo_path>
+
+            with <index_path>, an index stored there is used if it was built from the current
+            metadata, otherwise the index is built and stored
+    """
+
+    source = repomd_checksum(repo_path)
+    if index_path:
+        index = PackageIndex.load(index_path, source)
+        if index is not None:
+            return index
+
+    index = PackageIndex.build(repodata.iter_packages(repo_path))
+    if index_path:
+        directory = os.path.dirname(index_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        index.save(index_path, source)
+    return index
@@ -0,0 +1,271 @@
+#!/usr/bin/env python2
+from __future__ import print_function
+
+# deferred, parallel removal of deleted snapshots
+#
+# deleting a snapshot only renames it into a per-operation directory below the trash directory of
+# its timeline. the reaper removes whatever it finds there, so an interrupted run is resumed by
+# simply running it again. a delete operation keeps a shared lock on its directory while it moves
+# snapshots into it, the reaper skips directories it cannot lock and leaves them for its next run.
+
+import os
+import sys
+import stat
+import errno
+import fcntl
+import logging
+import argparse
+import tempfile
+import threading
+import time
+import subprocess
+from datetime import datetime
+
+import fsutil
+
+# I/O scheduling classes understood by ionice(1)
+IONICE_CLASSES = {
+    'none': None,
+    'realtime': '1',
+    'best-effort': '2',
+    'idle': '3',
+}
+
+
+def make_operation_dir(trash_dir):
+    """ creates a new, uniquely named directory in the trash for one delete operation """
+
+    if not os.path.isdir(trash_dir):
+        try:
+            os.makedirs(trash_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+    prefix = datetime.now().strftime('%Y%m%d-%H%M%S-')
+    return tempfile.mkdtemp(prefix=prefix, dir=trash_dir)
+
+
+class Operation(object):
+    """ the trash directory of a delete operation in progress, locked until close() so that
+        reapers leave it alone
+    """
+
+    def __init__(self, trash_dir):
+        while True:
+            self.path = make_operation_dir(trash_dir)
+            self._fd = os.open(self.path, os.O_RDONLY)
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            # a reaper may have removed the (empty) directory before it was locked
+            if os.fstat(self._fd).st_nlink:
+                break
+            os.close(self._fd)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class Reaper(object):
+    """ removes everything below a trash directory, using a pool of worker threads
+
+            only one reaper works on a trash directory at a time; others return right away
+    """
+
+    _lock_name = '.reaper.lock'
+    # output of background reapers
+    _log_name = '.reaper.log'
+    # size at which the log is rotated, one old log is kept
+    _log_max_size = 1024 * 1024
+
+    # seconds a background reaper is watched for failing to start
+    _spawn_check = 1.0
+
+    def __init__(self, trash_dir, workers=0, ionice='idle', logger=None):
+        if ionice not in IONICE_CLASSES:
+            raise Exception('ionice class must be one of: {0}'.format(', '.join(sorted(IONICE_CLASSES))))
+        self.trash_dir = os.path.normpath(trash_dir)
+        self.workers = workers or fsutil.default_workers()
+        self.ionice = ionice
+        self.logger = logger or logging.getLogger('timeline.reaper')
+
+    def pending(self):
+        """ returns the operation directories waiting to be removed """
+
+        if not os.path.isdir(self.trash_dir):
+            return []
+        return sorted(os.path.join(self.trash_dir, i) for i in os.listdir(self.trash_dir)
+                      if i not in (self._lock_name, self._log_name, self._log_name + '.1'))
+
+    @property
+    def log_path(self):
+        return os.path.join(self.trash_dir, self._log_name)
+
+    def reap(self):
+        """ removes all pending operation directories, returns the number of removed files """
+
+        if not self.pending():
+            return 0
+
+        lock = open(os.path.join(self.trash_dir, self._lock_name), 'a')
+        try:
+            try:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                self.logger.info('another reaper is already working on [{0}]'.format(self.trash_dir))
+                return 0
+
+            # set before the worker threads are started, which inherit the priority
+            self._set_ionice()
+
+            removed = 0
+            for path in self.pending():
+                removed += self._reap_operation(path)
+            return removed
+        finally:
+            lock.close()
+
+    def _reap_operation(self, path):
+        """ removes one operation directory, unless a delete operation still owns it """
+
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return 0
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                self.logger.info('[{0}] is still in use, left for the next run'.format(path))
+                return 0
+            self.logger.info('reaping [{0}]'.format(path))
+            return self._remove_tree(path)
+        finally:
+            os.close(fd)
+
+    def spawn(self):
+        """ starts a detached process which reaps the trash directory in the background, its output
+            goes to log_path. returns the process, or None if it failed to start
+        """
+
+        # run by path: the modules of repoman are not importable as a package from a checkout
+        script = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+        cmd = [sys.executable, script, '--workers', str(self.workers), '--ionice', self.ionice, self.trash_dir]
+        self.logger.debug('starting background reaper: {0}'.format(' '.join(cmd)))
+        try:
+            self._rotate_log()
+            with open(os.devnull, 'r') as devnull, open(self.log_path, 'a') as log:
+                proc = subprocess.Popen(cmd, stdin=devnull, stdout=log, stderr=subprocess.STDOUT,
+                                        close_fds=True, preexec_fn=os.setsid)
+        except (OSError, IOError) as e:
+            self.logger.error('could not start background reaper for [{0}]: {1}'.format(self.trash_dir, e))
+            return None
+
+        deadline = time.time() + self._spawn_check
+        while proc.poll() is None and time.time() < deadline:
+            time.sleep(0.05)
+        if proc.returncode:
+            self.logger.error('background reaper for [{0}] failed with exit code {1}, see [{2}]; '
+                              'run snapshot-reap to remove the deleted snapshots'.format(
+                                  self.trash_dir, proc.returncode, self.log_path))
+            return None
+        return proc
+
+    def _rotate_log(self):
+        try:
+            if os.path.getsize(self.log_path) >= self._log_max_size:
+                os.rename(self.log_path, self.log_path + '.1')
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def _set_ionice(self):
+        ioclass = IONICE_CLASSES[self.ionice]
+        if ioclass is None:
+            return
+        try:
+            subprocess.check_call(['ionice', '-c', ioclass, '-p', str(os.getpid())])
+        except (OSError, subprocess.CalledProcessError) as e:
+            self.logger.warning('could not set I/O priority [{0}]: {1}'.format(self.ionice, e))
+
+    def _remove_tree(self, path):
+        self._dirs = []
+        self._removed = 0
+        self._lock = threading.Lock()
+        self._pool = fsutil.WorkerPool(self.workers, name='reaper')
+
+        if not os.path.lexists(path):
+            return 0
+        if not os.path.isdir(path) or os.path.islink(path):
+            os.unlink(path)
+            return 1
+
+        self._pool.run(self._remove_dir, path)
+
+        # directories are empty now, remove them deepest first
+        self._dirs.sort(key=lambda d: d.count(os.sep), reverse=True)
+        for d in self._dirs:
+            try:
+                _ignore_missing(os.rmdir, d)
+            except OSError as e:
+                # something was moved in meanwhile, e.g. by an older version which does not lock
+                if e.errno != errno.ENOTEMPTY:
+                    raise
+                self.logger.info('[{0}] is not empty anymore, left for the next run'.format(d))
+        return self._removed
+
+    def _remove_dir(self, path):
+        # entries can't be removed from a read-only directory, even by its owner
+        st = os.lstat(path)
+        if not st.st_mode & stat.S_IWUSR:
+            os.chmod(path, stat.S_IMODE(st.st_mode) | stat.S_IRWXU)
+
+        with self._lock:
+            self._dirs.append(path)
+
+        chunk = []
+        for entry in fsutil.iter_dir(path):
+            if entry.is_dir(follow_symlinks=False):
+                self._pool.put(self._remove_dir, entry.path)
+            else:
+                chunk.append(entry.path)
+                if len(chunk) >= 512:
+                    self._pool.put(self._unlink, chunk)
+                    chunk = []
+        if chunk:
+            self._unlink(chunk)
+
+    def _unlink(self, paths):
+        for p in paths:
+            _ignore_missing(os.unlink, p)
+        with self._lock:
+            self._removed += len(paths)
+
+
+def _ignore_missing(func, path):
+    try:
+        func(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Remove deleted snapshots from a timeline trash directory')
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--ionice', default='idle', choices=sorted(IONICE_CLASSES))
+    parser.add_argument('trash_dir')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    Reaper(args.trash_dir, workers=args.workers, ionice=args.ionice).reap()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python2
+from __future__ import print_function
+
+# reading yum repository metadata (repodata/repomd.xml and the primary package list)
+
+import os
+import bz2
+import gzip
+import subprocess
+from collections import namedtuple
+from xml.etree import cElementTree as ElementTree
+
+REPO_NS = '{http://linux.duke.edu/metadata/repo}'
+COMMON_NS = '{http://linux.duke.edu/metadata/common}'
+
+REPOMD = os.path.join('repodata', 'repomd.xml')
+
+# checksum type names used in yum metadata -> hashlib names
+CHECKSUM_TYPES = {
+    'md5': 'md5',
+    'sha': 'sha1',
+    'sha1': 'sha1',
+    'sha224': 'sha224',
+    'sha256': 'sha256',
+    'sha384': 'sha384',
+    'sha512': 'sha512',
+}
+
+Package = namedtuple('Package', ['name', 'location', 'checksum_type', 'checksum', 'size',
+                                 'arch', 'epoch', 'version', 'release'])
+
+
+def open_metadata(path):
+    """ opens a (possibly compressed) metadata file for reading
+
+            the file is decompressed incrementally while it is read
+    """
+
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.BZ2File(path, 'rb')
+    if path.endswith('.xz'):
+        try:
+            import lzma
+            return lzma.open(path, 'rb')
+        except ImportError:
+            return _DecompressorPipe(['xz', '-dc', path])
+    if path.endswith('.zst'):
+        try:
+            import zstandard
+            return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'))
+        except ImportError:
+            return _DecompressorPipe(['zstd', '-dcq', path])
+    return open(path, 'rb')
+
+
+class _DecompressorPipe(object):
+    """ reads the output of a decompressing command, an error of the command is raised once its
+        output is read to the end
+    """
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self._proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, close_fds=True)
+
+    def read(self, size=-1):
+        data = self._proc.stdout.read(size)
+        # reading without a size returns everything up to the end of the output
+        if size < 0 or not data and size != 0:
+            self._check()
+        return data
+
+    def _check(self):
+        if self._proc.wait():
+            raise Exception('[{0}] failed with exit code {1}'.format(' '.join(self.cmd), self._proc.returncode))
+
+    def close(self):
+        """ closes the pipe and waits for the command, which is stopped if it is not done yet """
+
+        if self._proc.stdout.closed:
+            return
+        self._proc.stdout.close()
+        if self._proc.poll() is None:
+            self._proc.terminate()
+        self._proc.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_repomd(repo_path):
+    """ returns a dict of metadata type -> path of the file, from the repomd.xml of a repository """
+
+    files = {}
+    tree = ElementTree.parse(os.path.join(repo_path, REPOMD))
+    for data in tree.getroot().findall(REPO_NS + 'data'):
+        location = data.find(REPO_NS + 'location')
+        if location is not None:
+            files[data.get('type')] = os.path.join(repo_path, location.get('href'))
+    return files
+
+
+def iter_repomd(repo_path):
+    """ yields (type, location, checksum type, checksum) for each file listed in the repomd.xml of
+        a repository, the location relative to the repository
+    """
+
+    tree = ElementTree.parse(os.path.join(repo_path, REPOMD))
+    for data in tree.getroot().findall(REPO_NS + 'data'):
+        location = data.find(REPO_NS + 'location')
+        checksum = data.find(REPO_NS + 'checksum')
+        if location is None:
+            continue
+        yield (data.get('type'), location.get('href'),
+               checksum.get('type') if checksum is not None else None,
+               checksum.text.strip().lower() if checksum is not None else None)
+
+
+def iter_packages(repo_path):
+    """ yields a Package for each package listed in the primary metadata of a repository
+
+            the metadata is parsed incrementally, so memory use does not depend on its size
+    """
+
+    primary = read_repomd(repo_path).get('primary')
+    if primary is None:
+        raise Exception('no primary metadata found in [{0}]'.format(os.path.join(repo_path, REPOMD)))
+    return iter_primary(primary)
+
+
+def iter_primary(path):
+    """ yields a Package for each package of a (possibly compressed) primary metadata file """
+
+    fh = open_metadata(path)
+    try:
+        root = None
+        for event, elem in ElementTree.iterparse(fh, events=('start', 'end')):
+            if root is None:
+                root = elem
+            if event != 'end' or elem.tag != COMMON_NS + 'package':
+                continue
+            checksum = elem.find(COMMON_NS + 'checksum')
+            location = elem.find(COMMON_NS + 'location')
+            size = elem.find(COMMON_NS + 'size')
+            version = elem.find(COMMON_NS + 'version')
+            if version is None:
+                evr = (None, None, None)
+            else:
+                evr = (version.get('epoch') or '0', version.get('ver'), version.get('rel'))
+            yield Package(elem.findtext(COMMON_NS + 'name'), location.get('href'),
+                          checksum.get('type'), checksum.text.strip().lower(),
+                          int(size.get('package')) if size is not None else None,
+                          elem.findtext(COMMON_NS + 'arch'), *evr)
+            # the root keeps a reference to every parsed package otherwise
+            elem.clear()
+            root.clear()
+    finally:
+        fh.close()
+
+
+def find_repositories(path, paths=None):
+    """ returns the directories below <path> which contain a yum repository (repodata/repomd.xml)
+
+            <paths> may be an iterable of all relative paths in the tree (e.g. from a manifest), which
+            avoids walking it
+    """
+
+    found = []
+    if paths is not None:
+        for p in paths:
+            if p == REPOMD or p.endswith(os.sep + REPOMD):
+                found.append(os.path.join(path, p[:-len(REPOMD)]).rstrip(os.sep))
+        return sorted(found)
+
+    for root, dirs, files in os.walk(path):
+        if 'repodata' in dirs and os.path.isfile(os.path.join(root, REPOMD)):
+            found.append(root)
+        dirs[:] = [d for d in dirs if d != 'repodata']
+    return sorted(found)
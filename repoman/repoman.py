@@ -5,6 +5,12 @@ import logging
 logging.basicConfig(level=logging.INFO)
 
 import timeline
+import reaper
+import hashcache
+import batch
+import locking
+import fnmatch
+import time
 import argparse
 import upstream_sync
 import ConfigParser
@@ -37,6 +43,11 @@ def make_parser():
         'snapshot-rename', help='old_name new_name')
     snap_list = subparsers.add_parser('snapshot-list', help='-')
     snap_expire = subparsers.add_parser('snapshot-expire', help='-')
+    snap_prune = subparsers.add_parser('snapshot-prune', help='-')
+    snap_reap = subparsers.add_parser('snapshot-reap', help='-')
+    snap_du = subparsers.add_parser('snapshot-du', help='-')
+    snap_files = subparsers.add_parser('snapshot-files', help='snapshot [prefix]')
+    snap_verify = subparsers.add_parser('snapshot-verify', help='[snapshot] [snapshot] ...')
     link_set = subparsers.add_parser('link-create',  help='link_name snapshot')
     link_delete = subparsers.add_parser('link-delete', help='link')
     link_list = subparsers.add_parser('link-list', help='-')
@@ -52,8 +63,11 @@ def make_parser():
 
     repo_list = subparsers.add_parser('repo-list', help='-')
     repo_sync = subparsers.add_parser('repo-sync', help='[glob1] [glob2] ...')
+    repo_dedup = subparsers.add_parser('repo-dedup', help='-')
+    repo_index = subparsers.add_parser('repo-index', help='[glob1] [glob2] ...')
+    repo_cache_prune = subparsers.add_parser('repo-cache-prune', help='-')
 
-    for p in [snap_create, snap_delete, snap_rename, snap_list, snap_expire, link_set, link_delete, link_list, link_update]:
+    for p in [snap_create, snap_delete, snap_rename, snap_list, snap_expire, snap_prune, snap_reap, snap_du, snap_files, snap_verify, link_set, link_delete, link_list, link_update]:
         p.add_argument('-t', '--timeline', metavar='TIMELINE',
                        default='default', help='Timeline to operate on')
 
@@ -61,6 +75,15 @@ def make_parser():
                              help="Snapshot name (or create an auto-rotating one if not specified)")
     snap_create.add_argument('-s', '--source-snapshot', nargs='?',
                              default=None, help="Source snapshot (defaults to latest)")
+    snap_create.add_argument('-i', '--incremental', action='store_true', default=None,
+                             help="Compare against the latest snapshot: reuse its unchanged copies and report only new content (default: timeline setting)")
+    snap_create.add_argument('-a', '--all', action='store_true', default=False,
+                             help="Snapshot all timelines (auto-rotating snapshots only)")
+    snap_create.add_argument('-m', '--match', action='append', default=None, metavar='GLOB',
+                             help="Snapshot all timelines matching GLOB (can be given multiple times)")
+    snap_create.add_argument('-j', '--jobs-per-device', default=None, type=int,
+                             help="Concurrent snapshots on the same file system with --all/--match "
+                                  "(default: snapshot_jobs_per_device setting)")
 
     snap_delete.add_argument('name')
 
@@ -71,6 +94,31 @@ def make_parser():
     snap_expire.add_argument(
         '--dry-run', '-n', action='store_true', default=False)
 
+    snap_prune.add_argument('-p', '--policy', default=None, metavar='POLICY',
+                            help="Retention policy, e.g. 'last=7,daily=14,weekly=8,monthly=12' "
+                                 "(default: the timeline's retention setting). Linked and named snapshots are always kept")
+    snap_prune.add_argument(
+        '--dry-run', '-n', action='store_true', default=False)
+
+    snap_reap.add_argument('--workers', default=None, type=int,
+                           help="Number of threads removing files (default: timeline setting)")
+    snap_reap.add_argument('--ionice', default=None, choices=sorted(reaper.IONICE_CLASSES),
+                           help="I/O scheduling class while removing files (default: timeline setting)")
+
+    snap_du.add_argument('-b', '--bytes', action='store_true', default=False,
+                         help="Print sizes in bytes instead of human readable units")
+
+    snap_files.add_argument('name')
+    snap_files.add_argument('prefix', nargs='?', default='',
+                            help="Only list paths starting with this prefix (e.g. 'el8/x86_64/')")
+
+    snap_verify.add_argument('names', nargs='*', default=None,
+                             help="Snapshots to verify (default: all snapshots of the timeline)")
+    snap_verify.add_argument('-j', '--processes', default=0, type=int,
+                             help="Number of processes hashing files (default: number of CPUs)")
+    snap_verify.add_argument('--rehash', action='store_true', default=False,
+                             help="Read every file again instead of trusting cached checksums")
+
     link_set.add_argument('link_name')
     link_set.add_argument('snapshot', nargs='?', default=None)
     link_set.add_argument('--max-offset', default=None, type=int)
@@ -91,13 +139,36 @@ def make_parser():
                            help="list of globs to match")
     repo_sync.add_argument(
         '--dry-run', '-n', action='store_true', default=False)
+    repo_sync.add_argument('-j', '--jobs', default=None, type=int,
+                           help="Number of repos downloaded in parallel (default: sync_jobs setting)")
+    repo_sync.add_argument('--jobs-per-host', default=None, type=int,
+                           help="Maximum parallel syncs against the same upstream host "
+                                "(default: sync_jobs_per_host setting)")
+    repo_sync.add_argument('-f', '--force', action='store_true', default=False,
+                           help="Sync even if the upstream repomd.xml didn't change since the last sync")
+    repo_sync.add_argument('--createrepo-jobs', default=None, type=int,
+                           help="Number of createrepo runs in parallel with the downloads "
+                                "(default: createrepo_jobs setting)")
+
+    repo_dedup.add_argument(
+        '--dry-run', '-n', action='store_true', default=False)
+    repo_dedup.add_argument('--workers', default=0, type=int,
+                            help="Number of threads hashing files (default: a few per CPU)")
+    repo_dedup.add_argument('--min-size', default=1, type=int, metavar='BYTES',
+                            help="Ignore files smaller than BYTES (default: 1)")
 
-    for p in [repo_sync, repo_list]:
+    repo_index.add_argument('filters', nargs='*', default=None,
+                            help="list of globs to match")
+
+    repo_cache_prune.add_argument('--timelines', action='store_true', default=False,
+                                  help="Keep the checksums of files which only exist in snapshots")
+
+    for p in [repo_sync, repo_list, repo_index]:
         p.add_argument('-o', '--older-than', default=0, type=int, metavar='DAYS',
                        help="Act on repos not synced in DAYS days")
         p.add_argument('-u', '--unsynced-only', action='store_true', default=False, help="Act on unsynced repos")
 
-    for p in [snap_create, snap_delete, snap_rename, snap_list, snap_expire, link_set, link_delete, link_list, link_update, tline_create, tline_delete, tline_rename, tline_list, tline_show, repo_list, repo_sync]:
+    for p in [snap_create, snap_delete, snap_rename, snap_list, snap_expire, snap_prune, snap_reap, snap_du, snap_files, snap_verify, link_set, link_delete, link_list, link_update, tline_create, tline_delete, tline_rename, tline_list, tline_show, repo_list, repo_sync, repo_dedup, repo_index, repo_cache_prune]:
         p.add_argument('--verbose', '-v', action='store_true', default=False)
 
     return parser
@@ -134,8 +205,8 @@ def timeline_path(t):
     return os.path.normpath(os.path.join(TIMELINE_ROOT, t))
 
 
-def get_timeline(args):
-    return timeline.Timeline.load(timeline_path(args.timeline))
+def get_timeline(args, readonly=False):
+    return timeline.Timeline.load(timeline_path(args.timeline), readonly=readonly)
 
 
 def snapshot_exists(t, s):
@@ -144,8 +215,7 @@ def snapshot_exists(t, s):
 
 
 def timeline_exists(t):
-    global TIMELINE_ROOT
-    return os.path.exists(os.path.join(TIMELINE_ROOT, t, '.timeline'))
+    return timeline.Timeline.exists(timeline_path(t))
 
 # ACTUAL COMMANDS START HERE
 
@@ -160,6 +230,25 @@ def repo_sync(args, config):
     pass
 
 
+def repo_dedup(args, config):
+    switch_user(config)
+    stats = upstream_sync.dedup_repos(config, args)
+    print("Deduplicated repositories below {0}: {1}".format(MIRROR_ROOT, stats))
+
+
+def repo_cache_prune(args, config):
+    switch_user(config)
+    removed = upstream_sync.prune_hash_cache(config, args)
+    print("Removed the checksums of {0} files from {1}".format(removed, config.get('repoman', 'hash_cache')))
+    removed = upstream_sync.prune_createrepo_caches(config)
+    print("Removed {0} unused entries from the createrepo caches".format(removed))
+
+
+def repo_index(args, config):
+    switch_user(config)
+    upstream_sync.index_repos(config, args)
+
+
 def repo_list(args, config):
     print("Repositories defined in {0}:".format(
         config.get('repoman', 'repoconf_dir')))
@@ -168,11 +257,45 @@ def repo_list(args, config):
 
 def snapshot_create(args, config):
     switch_user(config)
+    if args.all or args.match:
+        return snapshot_create_many(args, config)
     t = get_timeline(args)
-    if not args.name:
-        t.create_snapshot()
-    else:
-        t.create_named_snapshot(snapshot=args.name, source_snapshot=args.source_snapshot)
+    # wait for syncs writing into the source, they hold the repo locks exclusively
+    with locking.hold(upstream_sync.repo_lock_paths(config, t.get_source()), shared=True):
+        if not args.name:
+            t.create_snapshot(incremental=args.incremental)
+        else:
+            t.create_named_snapshot(snapshot=args.name, source_snapshot=args.source_snapshot,
+                                    incremental=args.incremental)
+
+
+def snapshot_create_many(args, config):
+    if args.name or args.source_snapshot:
+        raise ValueError("--all and --match only create auto-rotating snapshots")
+
+    names = []
+    if os.path.isdir(timeline_path('')):
+        for name in sorted(os.listdir(timeline_path(''))):
+            if not timeline_exists(name):
+                continue
+            if args.all or any(fnmatch.fnmatch(name, m) for m in args.match):
+                names.append(name)
+    if not names:
+        raise Exception("No matching timelines found")
+
+    paths = [timeline_path(n) for n in names]
+    lock_paths = dict((p, upstream_sync.repo_lock_paths(config, timeline.Timeline.load(p, readonly=True).get_source()))
+                      for p in paths)
+
+    jobs = args.jobs_per_device or config.getint('repoman', 'snapshot_jobs_per_device')
+    started = time.time()
+    results = batch.snapshot_timelines(paths, jobs_per_device=jobs, incremental=args.incremental,
+                                       lock_paths=lock_paths)
+    batch.print_results(results, time.time() - started)
+
+    failed = [r.name for r in results if r.error]
+    if failed:
+        raise Exception("Snapshot failed for timeline(s): {0}".format(", ".join(failed)))
 
 
 def snapshot_delete(args, config):
@@ -188,16 +311,52 @@ def snapshot_expire(args, config):
     t.expire_snapshots(args.older_than_days, args.dry_run)
 
 
+def snapshot_prune(args, config):
+    switch_user(config)
+    t = get_timeline(args)
+    policy = None
+    if args.policy:
+        policy = timeline.retention.RetentionPolicy.parse(args.policy)
+    t.apply_retention(policy, args.dry_run)
+
+
+def snapshot_reap(args, config):
+    switch_user(config)
+    t = get_timeline(args)
+    t.reap_trash(workers=args.workers, ionice=args.ionice)
+
+
+def snapshot_du(args, config):
+    switch_user(config)
+    t = get_timeline(args, readonly=True)
+    t.print_disk_usage(human=not args.bytes)
+
+
+def snapshot_files(args, config):
+    t = get_timeline(args, readonly=True)
+    t.print_snapshot_files(args.name, args.prefix)
+
+
+def snapshot_verify(args, config):
+    switch_user(config)
+    # verification only reads the timeline, snapshots can be created and deleted meanwhile
+    t = get_timeline(args, readonly=True)
+    with hashcache.HashCache(config.get('repoman', 'hash_cache')) as cache:
+        failed = t.verify_snapshots(cache, args.names, processes=args.processes, rehash=args.rehash)
+    if failed:
+        raise Exception('verification failed for snapshot(s): {0}'.format(', '.join(failed)))
+
+
 # snapshot_rename
 
 
 def snapshot_list(args, config):
-    t = get_timeline(args)
+    t = get_timeline(args, readonly=True)
     t.print_snapshots()
 
 
 def timeline_delete(args, config):
-    t = get_timeline(args)
+    get_timeline(args, readonly=True)
     print("To delete the timeline, simply run rm -rf '{0}'".format(timeline_path(args.timeline)))
 
 
@@ -218,12 +377,21 @@ def timeline_list(args, config):
     if not os.path.exists(timeline_path('')):
         return
     print("Timelines at {}:".format(p))
-    for f in os.listdir(timeline_path('')):
-        print(f)
+    print("{0:<20} {1:>9} {2:<26} {3}".format('TIMELINE', 'SNAPSHOTS', 'LATEST', 'LINKS'))
+    for f in sorted(os.listdir(timeline_path(''))):
+        if not timeline_exists(f):
+            continue
+        summary = timeline.Timeline.read_summary(timeline_path(f))
+        if summary is None:
+            # timelines which have not been saved since summaries were introduced
+            summary = timeline.Timeline.load(timeline_path(f), readonly=True).summary()
+        links = ",".join("{0}->{1}".format(k, v) for k, v in sorted(summary['links'].items()))
+        print("{0:<20} {1:>9} {2:<26} {3}".format(
+            f + (' (frozen)' if summary['frozen'] else ''), summary['snapshots'], summary['latest'] or '-', links))
 
 
 def timeline_show(args, config):
-    t = get_timeline(args)
+    t = get_timeline(args, readonly=True)
     print(t)
 
 
@@ -247,28 +415,63 @@ def link_delete(args, config):
 
 
 def link_list(args, config):
-    t = get_timeline(args)
+    t = get_timeline(args, readonly=True)
     t.print_links()
 
 # END OF COMMANDS
 
 
-def main():
-    config_defaults = {
-        'repoconf_dir': '/etc/repoman/repos.d',
-        'tmp_dir': '/var/tmp/repoman',
-        'createrepo_after_sync': 'true',
-        # Defaults to ${repo_mirror_dir}/.cache
-        'createrepo_cache_root': '',
-        'createrepo_bin': 'createrepo_c',
-        'sync_keep_deleted': 'false',
-        'newest_only': 'true',
-    }
+CONFIG_DEFAULTS = {
+    'repoconf_dir': '/etc/repoman/repos.d',
+    'tmp_dir': '/var/tmp/repoman',
+    'createrepo_after_sync': 'true',
+    # Defaults to ${repo_mirror_dir}/.cache
+    'createrepo_cache_root': '',
+    # one createrepo checksum cache for all repos instead of one per repo
+    'createrepo_cache_shared': 'false',
+    # repo-cache-prune removes createrepo cache entries not used for this many days
+    'createrepo_cache_max_age': '30',
+    'createrepo_bin': 'createrepo_c',
+    # metadata is generated by createrepo_bin, or by the built-in generator (builtin)
+    'metadata_backend': 'createrepo',
+    'metadata_workers': '0',
+    'sync_keep_deleted': 'false',
+    'newest_only': 'true',
+    # checksums of mirrored files, used by repo-dedup and snapshot-verify
+    'hash_cache': '%(mirror_root)s/.repoman-hashes.db',
+    'dedup_after_sync': 'false',
+    # concurrent snapshots per file system with snapshot-create --all/--match
+    'snapshot_jobs_per_device': '1',
+    # compact package indexes of the repos, see repo-index
+    'index_dir': '%(mirror_root)s/.repoman-index',
+    # parallel repo-sync, limited per upstream host (sync_host_jobs = host=N ...)
+    'sync_jobs': '1',
+    'sync_jobs_per_host': '2',
+    'sync_host_jobs': '',
+    'sync_log_dir': '%(tmp_dir)s/logs',
+    # http(s) repos are synced by reposync, or by the built-in downloader (native)
+    'sync_backend': 'reposync',
+    'native_workers': '4',
+    # interrupted downloads are resumed from here, files above native_chunk_mb (0: off)
+    # are downloaded in ranges by native_chunk_workers threads
+    'native_partial_dir': '%(tmp_dir)s/partial',
+    'native_chunk_mb': '0',
+    'native_chunk_workers': '4',
+    # skip syncs of http(s)/ftp repos whose upstream repomd.xml didn't change
+    'sync_fast_path': 'true',
+    'sync_state_dir': '%(mirror_root)s/.repoman-sync',
+    # createrepo runs alongside the downloads, in a pool of its own
+    'createrepo_jobs': '1',
+    # lock files of the repos, held by syncs and snapshots
+    'lock_dir': '%(tmp_dir)s/locks',
+}
+
 
+def main():
     global TIMELINE_ROOT, MIRROR_ROOT
     parser = make_parser()
     args = parser.parse_args()
-    config = ConfigParser.ConfigParser(config_defaults)
+    config = ConfigParser.ConfigParser(CONFIG_DEFAULTS)
     config.read(args.config)
 
     MIRROR_ROOT = config.get('repoman', 'mirror_root')
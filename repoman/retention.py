@@ -0,0 +1,83 @@
+#!/usr/bin/env python2
+from __future__ import print_function
+
+# generational retention of snapshots (last N, daily, weekly, monthly)
+
+# bucket types in the order they are applied, with the function mapping a creation time to its bucket
+BUCKETS = (
+    ('daily', lambda created: created.date()),
+    ('weekly', lambda created: created.isocalendar()[:2]),
+    ('monthly', lambda created: (created.year, created.month)),
+)
+
+KEEP = 'keep'
+DELETE = 'delete'
+
+
+class RetentionPolicy(object):
+    """ how many snapshots to keep: the <last> newest ones, plus the newest snapshot of each of the
+        last <daily> days, <weekly> ISO weeks and <monthly> months which have a snapshot
+    """
+
+    def __init__(self, last=0, daily=0, weekly=0, monthly=0):
+        self.last = last
+        self.daily = daily
+        self.weekly = weekly
+        self.monthly = monthly
+        if min(last, daily, weekly, monthly) < 0:
+            raise Exception('retention counts must not be negative')
+        if not (last or daily or weekly or monthly):
+            raise Exception('retention policy keeps no snapshots')
+
+    @classmethod
+    def parse(cls, string):
+        """ parses a policy like 'last=7,daily=14,weekly=8,monthly=12' (missing counts are 0) """
+
+        counts = {}
+        for item in string.split(','):
+            if not item.strip():
+                continue
+            key, sep, value = item.partition('=')
+            key = key.strip()
+            if not sep or key not in ('last', 'daily', 'weekly', 'monthly'):
+                raise Exception('invalid retention policy item [{0}], expected last=, daily=, weekly= or monthly='.format(
+                    item.strip()))
+            try:
+                counts[key] = int(value)
+            except ValueError:
+                raise Exception('invalid retention count [{0}]'.format(item.strip()))
+        return cls(**counts)
+
+    def __str__(self):
+        return 'last={0},daily={1},weekly={2},monthly={3}'.format(self.last, self.daily, self.weekly, self.monthly)
+
+    def plan(self, snapshots):
+        """ computes which snapshots to keep and which to delete, in a single pass
+
+                <snapshots> is an iterable of (name, created, pinned) tuples, where pinned is a reason
+                (e.g. 'linked') for a snapshot that must be kept regardless of the policy, or None
+
+                returns a list of (name, created, action, reasons) tuples, newest first, where action
+                is KEEP or DELETE and reasons lists why a snapshot is kept
+        """
+
+        limits = dict((b, getattr(self, b)) for b, _ in BUCKETS)
+        seen = dict((b, set()) for b, _ in BUCKETS)
+        last = 0
+
+        plan = []
+        for name, created, pinned in sorted(snapshots, key=lambda s: s[1], reverse=True):
+            reasons = []
+            if pinned:
+                reasons.append(pinned)
+            if last < self.last:
+                last += 1
+                reasons.append('last')
+            # the newest snapshot of a bucket represents it
+            for bucket, key in BUCKETS:
+                k = key(created)
+                if k not in seen[bucket] and len(seen[bucket]) < limits[bucket]:
+                    seen[bucket].add(k)
+                    reasons.append(bucket)
+            plan.append((name, created, KEEP if reasons else DELETE, reasons))
+        return plan
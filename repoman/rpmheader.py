@@ -0,0 +1,203 @@
+#!/usr/bin/env python2
+from __future__ import print_function
+
+# reading the header of rpm packages without rpmlib
+#
+# an rpm file is a 96 byte lead, the signature header (padded to 8 bytes) and the main header,
+# followed by the compressed payload. a header is a 16 byte intro (magic, number of index entries,
+# size of the data store), the index entries (tag, type, offset, count) and the data store. only
+# the headers are read, the payload is never touched.
+
+import struct
+
+LEAD_SIZE = 96
+LEAD_MAGIC = '\xed\xab\xee\xdb'
+HEADER_MAGIC = '\x8e\xad\xe8'
+
+# lead package types
+LEAD_SOURCE = 1
+
+# header data types
+NULL = 0
+CHAR = 1
+INT8 = 2
+INT16 = 3
+INT32 = 4
+INT64 = 5
+STRING = 6
+BIN = 7
+STRING_ARRAY = 8
+I18NSTRING = 9
+
+_INT_FORMATS = {INT16: 'H', INT32: 'I', INT64: 'Q'}
+
+# tags of the main header
+NAME = 1000
+VERSION = 1001
+RELEASE = 1002
+EPOCH = 1003
+SUMMARY = 1004
+DESCRIPTION = 1005
+BUILDTIME = 1006
+BUILDHOST = 1007
+SIZE = 1009
+VENDOR = 1011
+LICENSE = 1014
+PACKAGER = 1015
+GROUP = 1016
+URL = 1020
+ARCH = 1022
+OLDFILENAMES = 1027
+FILESIZES = 1028
+FILEMODES = 1030
+FILEFLAGS = 1037
+SOURCERPM = 1044
+ARCHIVESIZE = 1046
+PROVIDENAME = 1047
+REQUIREFLAGS = 1048
+REQUIRENAME = 1049
+REQUIREVERSION = 1050
+CONFLICTFLAGS = 1053
+CONFLICTNAME = 1054
+CONFLICTVERSION = 1055
+CHANGELOGTIME = 1080
+CHANGELOGNAME = 1081
+CHANGELOGTEXT = 1082
+OBSOLETENAME = 1090
+SOURCEPACKAGE = 1106
+PROVIDEFLAGS = 1112
+PROVIDEVERSION = 1113
+OBSOLETEFLAGS = 1114
+OBSOLETEVERSION = 1115
+DIRINDEXES = 1116
+BASENAMES = 1117
+DIRNAMES = 1118
+LONGSIZE = 5009
+RECOMMENDNAME = 5046
+RECOMMENDVERSION = 5047
+RECOMMENDFLAGS = 5048
+SUGGESTNAME = 5049
+SUGGESTVERSION = 5050
+SUGGESTFLAGS = 5051
+SUPPLEMENTNAME = 5052
+SUPPLEMENTVERSION = 5053
+SUPPLEMENTFLAGS = 5054
+ENHANCENAME = 5055
+ENHANCEVERSION = 5056
+ENHANCEFLAGS = 5057
+
+# tags of the signature header
+SIG_PAYLOADSIZE = 1007
+SIG_LONGARCHIVESIZE = 271
+
+# dependency kind -> (name, flags, version) tags
+DEPENDENCIES = {
+    'provides': (PROVIDENAME, PROVIDEFLAGS, PROVIDEVERSION),
+    'requires': (REQUIRENAME, REQUIREFLAGS, REQUIREVERSION),
+    'conflicts': (CONFLICTNAME, CONFLICTFLAGS, CONFLICTVERSION),
+    'obsoletes': (OBSOLETENAME, OBSOLETEFLAGS, OBSOLETEVERSION),
+    'recommends': (RECOMMENDNAME, RECOMMENDFLAGS, RECOMMENDVERSION),
+    'suggests': (SUGGESTNAME, SUGGESTFLAGS, SUGGESTVERSION),
+    'supplements': (SUPPLEMENTNAME, SUPPLEMENTFLAGS, SUPPLEMENTVERSION),
+    'enhances': (ENHANCENAME, ENHANCEFLAGS, ENHANCEVERSION),
+}
+
+# dependency flags
+SENSE_LESS = 2
+SENSE_GREATER = 4
+SENSE_EQUAL = 8
+SENSE_PREREQ = 64
+SENSE_SCRIPT_PRE = 512
+SENSE_SCRIPT_POST = 1024
+
+# file flags
+FILE_GHOST = 64
+
+
+class InvalidPackage(Exception):
+    """ the file is not an rpm package or its header is damaged """
+    pass
+
+
+class Header(object):
+    """ the tags of the main header of an rpm package and of its signature header; <start> and <end>
+        are the byte range of the main header in the file (the rpm:header-range of the metadata)
+    """
+
+    def __init__(self, tags, signature, start, end, source=False):
+        self.tags = tags
+        self.signature = signature
+        self.start = start
+        self.end = end
+        self.source = source
+
+    def get(self, tag, default=None):
+        return self.tags.get(tag, default)
+
+    def __contains__(self, tag):
+        return tag in self.tags
+
+
+def _read(fh, size):
+    data = fh.read(size)
+    if len(data) != size:
+        raise InvalidPackage('unexpected end of file')
+    return data
+
+
+def _read_header(fh):
+    """ reads a header structure at the current position, returns (tags, size in bytes) """
+
+    intro = _read(fh, 16)
+    if intro[:3] != HEADER_MAGIC:
+        raise InvalidPackage('bad header magic')
+    count, store_size = struct.unpack('>II', intro[8:16])
+    if count > 0x10000 or store_size > 0x10000000:
+        raise InvalidPackage('header too large')
+    index = _read(fh, count * 16)
+    store = _read(fh, store_size)
+
+    tags = {}
+    for i in range(count):
+        tag, kind, offset, n = struct.unpack('>IIII', index[i * 16:i * 16 + 16])
+        if offset > store_size:
+            raise InvalidPackage('bad offset of tag {0}'.format(tag))
+        if kind in _INT_FORMATS:
+            fmt = '>{0}{1}'.format(n, _INT_FORMATS[kind])
+            size = struct.calcsize(fmt)
+            if offset + size > store_size:
+                raise InvalidPackage('bad size of tag {0}'.format(tag))
+            tags[tag] = list(struct.unpack(fmt, store[offset:offset + size]))
+        elif kind in (CHAR, INT8):
+            tags[tag] = [ord(c) for c in store[offset:offset + n]]
+        elif kind == BIN:
+            tags[tag] = store[offset:offset + n]
+        elif kind in (STRING, STRING_ARRAY, I18NSTRING):
+            values = []
+            for _ in range(1 if kind == STRING else n):
+                end = store.find('\0', offset)
+                if end < 0:
+                    raise InvalidPackage('unterminated string in tag {0}'.format(tag))
+                values.append(store[offset:end])
+                offset = end + 1
+            # strings are single values, translated strings come first in the default language
+            tags[tag] = values if kind == STRING_ARRAY else values[0]
+    return tags, 16 + count * 16 + store_size
+
+
+def read_header(path):
+    """ returns the Header of the rpm package at <path> """
+
+    with open(path, 'rb') as fh:
+        lead = _read(fh, LEAD_SIZE)
+        if lead[:4] != LEAD_MAGIC:
+            raise InvalidPackage('not an rpm package')
+        source = struct.unpack('>H', lead[6:8])[0] == LEAD_SOURCE
+
+        # the signature header is padded to a multiple of 8 bytes
+        signature, size = _read_header(fh)
+        _read(fh, (8 - size % 8) % 8)
+
+        start = fh.tell()
+        tags, size = _read_header(fh)
+    return Header(tags, signature, start, start + size, source or SOURCEPACKAGE in tags)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python2
+from __future__ import print_function
+
+# running jobs in parallel threads with a limit on concurrent jobs per group, optionally as a
+# pipeline of stages with a pool of their own
+#
+# used for syncing repos: downloads are limited per upstream host, so many hosts can be served at
+# the same time but each of them only gets a few connections, and repos whose download finished
+# move on to the metadata stage while the next downloads run.
+
+import Queue
+import logging
+import threading
+import traceback
+
+
+class JobFailed(object):
+    """ result of a job which raised an exception """
+
+    def __init__(self, error):
+        self.error = error
+
+    def __str__(self):
+        return self.error
+
+
+class Stage(object):
+    """ a step of a pipeline: func(job) runs in up to <workers> threads at the same time
+
+            <group> maps a job to its group and <group_limit> a group to the number of jobs of the
+            group which may run in this stage at the same time (both optional)
+    """
+
+    def __init__(self, func, workers=1, group=None, group_limit=None):
+        self.func = func
+        self.workers = max(1, workers)
+        self.group = group or (lambda job: None)
+        self.group_limit = group_limit or (lambda g: self.workers)
+
+
+def run_pipeline(jobs, stages, proceed=None, logger=None):
+    """ runs each of <jobs> through the <stages> in order, every stage with its own threads
+
+            a job moves on to the next stage as soon as its current stage is done and proceed(job,
+            result) is true (by default, if the stage didn't raise). jobs are started in the given
+            order as far as the limits allow, later stages take them in the order they arrive.
+
+            returns the result of the last stage each job ran, in the order of <jobs>, with a
+            JobFailed for a stage which raised
+    """
+
+    logger = logger or logging.getLogger('repoman.scheduler')
+    proceed = proceed or (lambda job, result: not isinstance(result, JobFailed))
+
+    jobs = list(jobs)
+    pending = [list(range(len(jobs)))] + [[] for _ in stages[1:]]
+    running = [{} for _ in stages]
+    active = [0 for _ in stages]
+    results = {}
+    finished = Queue.Queue()
+
+    def worker(s, i):
+        try:
+            result = stages[s].func(jobs[i])
+        except Exception as e:
+            logger.debug(traceback.format_exc())
+            result = JobFailed(str(e) or e.__class__.__name__)
+        finished.put((s, i, result))
+
+    def start_next(s):
+        """ starts the first pending job of a stage whose group is below its limit, returns False if there is none """
+        stage = stages[s]
+        for n, i in enumerate(pending[s]):
+            g = stage.group(jobs[i])
+            if running[s].get(g, 0) < max(1, stage.group_limit(g)):
+                del pending[s][n]
+                running[s][g] = running[s].get(g, 0) + 1
+                t = threading.Thread(target=worker, args=(s, i), name='stage-{0}-job-{1}'.format(s, i))
+                t.daemon = True
+                t.start()
+                return True
+        return False
+
+    while any(pending) or any(active):
+        for s, stage in enumerate(stages):
+            while active[s] < stage.workers and start_next(s):
+                active[s] += 1
+        # the timeout keeps the wait interruptible (KeyboardInterrupt)
+        try:
+            s, i, result = finished.get(timeout=1)
+        except Queue.Empty:
+            continue
+        active[s] -= 1
+        running[s][stages[s].group(jobs[i])] -= 1
+        results[i] = result
+        if s + 1 < len(stages) and proceed(jobs[i], result):
+            pending[s + 1].append(i)
+
+    return [results[i] for i in range(len(jobs))]
+
+
+def run_jobs(jobs, func, workers=1, group=None, group_limit=None, logger=None):
+    """ calls func(job) for each of <jobs>, with at most <workers> calls running at the same time
+
+            <group> maps a job to its group and <group_limit> a group to the number of jobs of the
+            group which may run at the same time (both optional).
+
+            returns the results in the order of <jobs>, with a JobFailed for each job which raised
+    """
+
+    return run_pipeline(jobs, [Stage(func, workers, group, group_limit)], logger=logger)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python2
+from __future__ import print_function
+
+# inode-aware comparison of two snapshot trees
+
+import os
+import json
+import stat
+import fnmatch
+
+import fsutil
+
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+
+_TYPE_NAMES = {
+    'dir': 'directory',
+    'file': 'regular file',
+    'symlink': 'symbolic link',
+    'other': 'special file',
+}
+
+
+def read_exclude_file(path):
+    """ reads a 'diff -X' style exclude file: one name pattern per line, '#' starts a comment """
+
+    patterns = []
+    if not os.path.exists(path):
+        return patterns
+    with open(path, 'r') as fh:
+        for line in fh:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                patterns.append(line)
+    return patterns
+
+
+def _entry_type(entry):
+    if entry.is_symlink():
+        return 'symlink'
+    if entry.is_dir(follow_symlinks=False):
+        return 'dir'
+    if entry.is_file(follow_symlinks=False):
+        return 'file'
+    return 'other'
+
+
+def _same_content(path_a, path_b, size, bufsize=1024 * 1024):
+    with open(path_a, 'rb') as fa:
+        with open(path_b, 'rb') as fb:
+            while size > 0:
+                a = fa.read(bufsize)
+                b = fb.read(bufsize)
+                if a != b:
+                    return False
+                if not a:
+                    break
+                size -= len(a)
+    return True
+
+
+class SnapshotDiff(object):
+    """ compares two snapshot trees, like 'diff -r -q' but without reading hard-linked files
+
+            entries which are the same inode on the same device are equal by definition, so only files
+            which differ in inode (new content, or metadata which was copied instead of linked) are
+            compared, first by size and then by content. names matching one of the exclude patterns
+            are skipped, like with 'diff -X'.
+
+            each difference is a tuple (status, relative path, type in new tree, type in old tree)
+            where status is one of ADDED, REMOVED or CHANGED and the types are None where the entry
+            does not exist
+    """
+
+    def __init__(self, new_path, old_path, excludes=()):
+        self.new_path = os.path.normpath(new_path)
+        self.old_path = os.path.normpath(old_path)
+        self.excludes = list(excludes)
+        self.same_device = os.lstat(self.new_path).st_dev == os.lstat(self.old_path).st_dev
+        self.compared = 0
+        self.differences = []
+
+    def _excluded(self, name):
+        for pattern in self.excludes:
+            if fnmatch.fnmatchcase(name, pattern):
+                return True
+        return False
+
+    def _listing(self, path):
+        return dict((e.name, e) for e in fsutil.iter_dir(path) if not self._excluded(e.name))
+
+    def run(self):
+        """ walks both trees and returns the list of differences """
+
+        self.differences = []
+        self._diff_dir('')
+        return self.differences
+
+    def _diff_dir(self, rel_path):
+        new_entries = self._listing(os.path.join(self.new_path, rel_path))
+        old_entries = self._listing(os.path.join(self.old_path, rel_path))
+
+        for name in sorted(set(new_entries) | set(old_entries)):
+            entry_rel = os.path.join(rel_path, name)
+            new = new_entries.get(name)
+            old = old_entries.get(name)
+
+            if old is None:
+                self.differences.append((ADDED, entry_rel, _entry_type(new), None))
+                continue
+            if new is None:
+                self.differences.append((REMOVED, entry_rel, None, _entry_type(old)))
+                continue
+
+            # the common case: both snapshots link the very same file
+            if self.same_device and new.inode() == old.inode():
+                continue
+
+            new_type = _entry_type(new)
+            old_type = _entry_type(old)
+            if new_type != old_type:
+                self.differences.append((CHANGED, entry_rel, new_type, old_type))
+            elif new_type == 'dir':
+                self._diff_dir(entry_rel)
+            elif not self._equal(new_type, new, old):
+                self.differences.append((CHANGED, entry_rel, new_type, old_type))
+
+    def _equal(self, entry_type, new, old):
+        self.compared += 1
+
+        if entry_type == 'symlink':
+            return os.readlink(new.path) == os.readlink(old.path)
+
+        new_st = new.stat(follow_symlinks=False)
+        old_st = old.stat(follow_symlinks=False)
+        if entry_type != 'file':
+            return stat.S_IFMT(new_st.st_mode) == stat.S_IFMT(old_st.st_mode) and new_st.st_rdev == old_st.st_rdev
+        if new_st.st_size != old_st.st_size:
+            return False
+        return _same_content(new.path, old.path, new_st.st_size)
+
+    def write_log(self, fh):
+        """ writes the differences in the format of 'diff -r -q <new> <old>' """
+
+        for status, rel_path, new_type, old_type in self.differences:
+            directory, name = os.path.split(rel_path)
+            if status == ADDED:
+                fh.write('Only in {0}: {1}\n'.format(os.path.join(self.new_path, directory).rstrip('/'), name))
+            elif status == REMOVED:
+                fh.write('Only in {0}: {1}\n'.format(os.path.join(self.old_path, directory).rstrip('/'), name))
+            elif new_type != old_type:
+                fh.write('File {0} is a {1} while file {2} is a {3}\n'.format(
+                    os.path.join(self.new_path, rel_path), _TYPE_NAMES[new_type],
+                    os.path.join(self.old_path, rel_path), _TYPE_NAMES[old_type]))
+            else:
+                fh.write('Files {0} and {1} differ\n'.format(
+                    os.path.join(self.new_path, rel_path), os.path.join(self.old_path, rel_path)))
+
+    def write_report(self, fh, fmt='json'):
+        """ writes the differences as a structured report, either 'json' or 'tsv'
+
+                directories are written with a trailing slash
+        """
+
+        def _name(rel_path, entry_type):
+            return rel_path + '/' if entry_type == 'dir' else rel_path
+
+        if fmt == 'tsv':
+            for status, rel_path, new_type, old_type in self.differences:
+                fh.write('{0}\t{1}\n'.format(status, _name(rel_path, new_type or old_type)))
+        elif fmt == 'json':
+            report = {'new': self.new_path, 'old': self.old_path, ADDED: [], REMOVED: [], CHANGED: []}
+            for status, rel_path, new_type, old_type in self.differences:
+                report[status].append(_name(rel_path, new_type or old_type))
+            json.dump(report, fh, indent=1, sort_keys=True)
+            fh.write('\n')
+        else:
+            raise ValueError('unknown diff report format [{0}]'.format(fmt))
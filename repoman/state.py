@@ -0,0 +1,111 @@
+#!/usr/bin/env python2
+from __future__ import print_function
+
+# sqlite backed storage for the timeline state
+#
+# the state is kept as individual records: one per timeline attribute ('meta'), one per snapshot
+# and one per link. a commit writes only the records which changed since the last commit, in a
+# single transaction, so an interrupted write never leaves a half-written state behind.
+
+import os
+import pickle
+import sqlite3
+
+TABLES = ('meta', 'snapshots', 'links')
+
+
+def _dumps(value):
+    return pickle.dumps(value, 2)
+
+
+class StateStore(object):
+    """ record store for the state of one timeline """
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        # records as last read from or written to the database, in their serialized form
+        self._committed = dict((t, {}) for t in TABLES)
+
+        if readonly and not os.path.exists(path):
+            raise Exception('state file [{0}] not found'.format(path))
+
+        self._db = sqlite3.connect(path)
+        if not readonly:
+            self._db.execute('PRAGMA synchronous = FULL')
+            for table in TABLES:
+                self._db.execute(
+                    'CREATE TABLE IF NOT EXISTS {0} (name TEXT PRIMARY KEY, value BLOB NOT NULL)'.format(table))
+            self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def get(self, table, name, default=None):
+        """ reads a single record """
+
+        row = self._db.execute('SELECT value FROM {0} WHERE name = ?'.format(table), (name,)).fetchone()
+        if row is None:
+            return default
+        data = bytes(row[0])
+        self._committed[table][name] = data
+        return pickle.loads(data)
+
+    def load(self, table):
+        """ reads all records of a table into a dict """
+
+        records = {}
+        for name, value in self._db.execute('SELECT name, value FROM {0}'.format(table)):
+            data = bytes(value)
+            self._committed[table][name] = data
+            records[name] = pickle.loads(data)
+        return records
+
+    def names(self, table):
+        """ returns the record names of a table, without reading the records """
+
+        return [row[0] for row in self._db.execute('SELECT name FROM {0} ORDER BY name'.format(table))]
+
+    def commit(self, records):
+        """ writes the given state, a dict of table -> dict of records, in a single transaction
+
+                only records that differ from the last committed state are written, records that no
+                longer exist are deleted. tables missing from <records> are left untouched.
+
+                returns the number of written and deleted records
+        """
+
+        if self.readonly:
+            raise Exception('state file [{0}] is opened read-only'.format(self.path))
+
+        changes = []
+        for table, table_records in records.items():
+            committed = self._committed[table]
+            current = dict((name, _dumps(value)) for name, value in table_records.items())
+            for name, data in current.items():
+                if committed.get(name) != data:
+                    changes.append((table, name, data))
+            for name in committed:
+                if name not in current:
+                    changes.append((table, name, None))
+
+        if not changes:
+            return 0
+
+        with self._db:
+            for table, name, data in changes:
+                if data is None:
+                    self._db.execute('DELETE FROM {0} WHERE name = ?'.format(table), (name,))
+                else:
+                    self._db.execute('INSERT OR REPLACE INTO {0} (name, value) VALUES (?, ?)'.format(table),
+                                     (name, sqlite3.Binary(data)))
+
+        # only remember the new state once the transaction went through
+        for table, name, data in changes:
+            if data is None:
+                self._committed[table].pop(name, None)
+            else:
+                self._committed[table][name] = data
+
+        return len(changes)
+
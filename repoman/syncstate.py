@@ -0,0 +1,102 @@
+#!/usr/bin/env python2
+from __future__ import print_function
+
+# upstream fingerprints for skipping syncs of unchanged repos
+#
+# before a repo is synced, only its upstream repodata/repomd.xml is fetched, with the ETag and
+# Last-Modified of the last successful sync as conditional request headers. if upstream answers
+# 304, or the checksum of repomd.xml matches the recorded one, nothing changed upstream and the
+# sync can be skipped.
+
+import os
+import ssl
+import json
+import errno
+import hashlib
+import urllib2
+from collections import namedtuple
+
+REPOMD = 'repodata/repomd.xml'
+
+Fingerprint = namedtuple('Fingerprint', ['checksum', 'etag', 'last_modified'])
+
+
+class SyncState(object):
+    """ what was recorded at the last successful sync of a repo, kept as a json file """
+
+    def __init__(self, path):
+        self.path = path
+        self.values = {}
+        try:
+            with open(path, 'r') as fh:
+                self.values = json.load(fh)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        except ValueError:
+            # a damaged state only costs a full sync
+            self.values = {}
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def fingerprint(self):
+        """ returns the recorded Fingerprint, or None """
+
+        if not self.values.get('checksum'):
+            return None
+        return Fingerprint(self.values['checksum'], self.values.get('etag'), self.values.get('last_modified'))
+
+    def save(self, **values):
+        """ updates the state with <values> and writes it (atomically) """
+
+        self.values.update(values)
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(self.values, fh, sort_keys=True)
+        os.rename(tmp, self.path)
+
+
+def repomd_url(url):
+    """ returns the url of the repomd.xml of a repo url """
+
+    return url.rstrip('/') + '/' + REPOMD
+
+
+def fetch_fingerprint(url, known=None, sslcacert=None, sslcert=None, sslkey=None, timeout=30):
+    """ fetches the repomd.xml at <url> and returns its Fingerprint
+
+            if the <known> Fingerprint is given, the request is conditional on it and a 304 answer
+            returns it unchanged. errors (network, http) are raised.
+    """
+
+    request = urllib2.Request(url)
+    if known is not None:
+        if known.etag:
+            request.add_header('If-None-Match', known.etag)
+        if known.last_modified:
+            request.add_header('If-Modified-Since', known.last_modified)
+
+    kwargs = {'timeout': timeout}
+    if url.startswith('https:'):
+        context = ssl.create_default_context(cafile=sslcacert)
+        if sslcert:
+            context.load_cert_chain(sslcert, sslkey)
+        kwargs['context'] = context
+
+    try:
+        response = urllib2.urlopen(request, **kwargs)
+    except urllib2.HTTPError as e:
+        if e.code == 304 and known is not None:
+            return known
+        raise
+
+    try:
+        checksum = hashlib.sha256(response.read()).hexdigest()
+        headers = response.info()
+        return Fingerprint(checksum, headers.getheader('ETag'), headers.getheader('Last-Modified'))
+    finally:
+        response.close()
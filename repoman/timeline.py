@@ -5,17 +5,33 @@ from __future__ import print_function
 
 import os
 import sys
+import json
+import errno
 import time
 import random
 import logging
 import logging.config
 import subprocess
 import pickle
+import copy
 import pprint
+import contextlib
 import ConfigParser
+import StringIO
 from datetime import datetime, timedelta
 from operator import attrgetter, itemgetter
 
+import clone
+import state
+import manifest
+import reaper
+import snapdiff
+import retention
+import usage
+import verify
+import repodata
+import locking
+
 def isalnum(string, allowed_extra_chars=''):
     """ check if the given string only contains alpha-numeric characters + optionally allowed extra chars """
 
@@ -27,12 +43,28 @@ def isalnum(string, allowed_extra_chars=''):
 class Timeline:
 
     logger = logging.getLogger('timeline')
+    _statefile_ext = '.timeline.db'
+    # pickled state of older versions, migrated into the state file on first use
     _datafile_ext = '.timeline.state'
     _cfgfile_ext = '.timeline.cfg'
+    # small summary (snapshot count, latest snapshot, links) for listing timelines without loading them
+    _summaryfile_ext = '.timeline.summary'
+    # per-inode reference counts for snapshot-du, see the usage module
+    _usagefile_ext = '.timeline.du.db'
+    # held exclusively by instances which may change the timeline, see the locking module
+    _lockfile_ext = '.timeline.lock'
     _cfgfile_diff_ext = '.timeline.diff.exclude'
     _difflog_ext = '.diff.log'
-
-    def __init__(self, name, source, destination):
+    _diff_report_formats = ('json', 'tsv')
+    _trash_dir_name = '_repoman_trash'
+    _legacy_trash_dir_name = '_repoman_to_be_deleted'
+    _reap_modes = ('foreground', 'background', 'deferred')
+    _manifest_dir_name = '.manifests'
+    _manifest_ext = '.manifest'
+    # attributes of a loaded timeline which are not part of its saved state
+    _runtime_attrs = ('logger', '_trash_op', '_state_store', '_transaction', '_readonly', '_lock')
+
+    def __init__(self, name, source, destination, readonly=False):
         self.logger = logging.getLogger('timeline.{0}'.format(name))
         """ create a new timeline instance for a given source directory
 
@@ -41,20 +73,22 @@ class Timeline:
                     name:           the name of the timeline instance
                     source:         the timeline source directory (from where snapshots are taken)
                     destination:    the timeline destination directory (where snapshots are written into)
+                    readonly:       only read the state of an existing timeline, see load()
         """
 
-        self.logger.info('configuring timeline [{0}] from source [{1}] into destination [{2}]'.format(
-            name, source, destination))
-
         if not isalnum(name, '-_.'):
             raise Exception(
                 'name string must only consist of alphanumeric characters, dots, underscores and dashes')
 
-        if not os.path.isdir(source):
-            raise Exception('source is not a valid directory. If it exists, check that permissions allow access')
+        if not readonly:
+            self.logger.info('configuring timeline [{0}] from source [{1}] into destination [{2}]'.format(
+                name, source, destination))
 
-        if not os.path.exists(destination):
-            os.makedirs(destination)
+            if not os.path.isdir(source):
+                raise Exception('source is not a valid directory. If it exists, check that permissions allow access')
+
+            if not os.path.exists(destination):
+                os.makedirs(destination)
 
         # define "private" variables
         self._name = name
@@ -83,6 +117,7 @@ class Timeline:
         self._links = {}
 
         # percistency file for storing the class state
+        self._statefile = os.path.join(self._destination, self._statefile_ext)
         self._datafile = os.path.join(self._destination, self._datafile_ext)
 
         # configuration file
@@ -95,14 +130,67 @@ class Timeline:
         # path for storing diff log files (disabled by default)
         self._diff_log_path = ''
 
+        # format of the structured diff report written next to the diff log file
+        self._diff_report_format = 'json'
+
+        # number of threads used for hard-linking snapshots (0 = automatic)
+        self._clone_workers = 0
+
+        # compare new snapshots against the latest one, to reuse its copies and report only new content
+        self._incremental = False
+
+        # generational retention policy applied on rotation instead of max_snapshots (disabled if empty)
+        self._retention = ''
+
+        # write a manifest (index of all files) for each snapshot while creating it
+        self._manifest = True
+
+        # directory holding the manifests of the snapshots
+        self._manifest_dir = os.path.join(self._destination, self._manifest_dir_name)
+
+        # deleted snapshots are moved here and removed by the reaper
+        self._trash_dir = os.path.join(self._destination, self._trash_dir_name)
+
+        # when deleted snapshots are removed: right away, by a background process or by 'snapshot-reap'
+        self._reap_mode = 'background'
+
+        # I/O scheduling class and number of threads of the reaper (0 = automatic)
+        self._reap_ionice = 'idle'
+        self._reap_workers = 0
+
+        # trash directory of the delete operation in progress (not saved)
+        self._trash_op = None
+
+        # handle on the state file (not saved)
+        self._state_store = None
+
+        # file system actions of the transaction in progress (not saved), see transaction()
+        self._transaction = None
+
+        # instance only reflects the saved state and can't be saved (not saved)
+        self._readonly = readonly
+
+        # exclusive lock on the timeline, taken before loading the state so concurrent changes
+        # can't overwrite each other (not saved). read-only instances don't lock.
+        self._lock = None
+        if not readonly:
+            self._lock = locking.FileLock(os.path.join(self._destination, self._lockfile_ext), logger=self.logger)
+            self._lock.acquire()
+
         # load class state from metadata file in case one exists
-        if os.path.exists(self._datafile):
+        if os.path.exists(self._statefile) or os.path.exists(self._datafile):
             self._load_state()
             if (name != self._name
                 or os.path.normpath(source) != self._source
                     or os.path.normpath(destination) != self._destination):
                 raise Exception(
                     'inconsistencies found loading class state from metadata file')
+        elif readonly:
+            raise Exception('no timeline found in [{0}]'.format(self._destination))
+
+        # the saved state already contains the settings, the source and the config file aren't needed
+        if readonly:
+            return
 
         # initialize options required for repositories
         self._initialize_repository_options()
@@ -115,19 +203,80 @@ class Timeline:
             self._load_cfgfile()
 
     @classmethod
-    def load(cls, path):
-        """ create a new timeline instance with parameters read from a metadata file in the given path """
+    def exists(cls, path):
+        """ checks whether the given path contains a timeline """
 
-        metadata_file = os.path.join(path, Timeline._datafile_ext)
+        return (os.path.exists(os.path.join(path, cls._statefile_ext))
+                or os.path.exists(os.path.join(path, cls._datafile_ext)))
 
-        Timeline.logger.info(
-            'loading timeline instance from [{0}]'.format(metadata_file))
-        fh = open(metadata_file, 'r')
-        pickle_data = pickle.load(fh)
+    @classmethod
+    def load(cls, path, readonly=False):
+        """ create a new timeline instance with parameters read from a metadata file in the given path
+
+                a <readonly> instance is built from the state file alone: neither the source nor the
+                config file is looked at (settings are those of the last save), nothing is created
+                or migrated and the instance can't be saved. meant for listing and showing.
+        """
+
+        metadata_file = os.path.join(path, Timeline._statefile_ext)
+
+        if os.path.exists(metadata_file):
+            Timeline.logger.info(
+                'loading timeline instance from [{0}]'.format(metadata_file))
+            store = state.StateStore(metadata_file, readonly=True)
+            try:
+                args = [store.get('meta', k) for k in ('_name', '_source', '_destination')]
+            finally:
+                store.close()
+        else:
+            metadata_file = os.path.join(path, Timeline._datafile_ext)
+            Timeline.logger.info(
+                'loading timeline instance from [{0}]'.format(metadata_file))
+            fh = open(metadata_file, 'r')
+            pickle_data = pickle.load(fh)
+            args = [pickle_data['_name'], pickle_data['_source'], pickle_data['_destination']]
 
         # this calls __init__ with the given arguments loaded from the metadata
         # file
-        return cls(pickle_data['_name'], pickle_data['_source'], pickle_data['_destination'])
+        return cls(*args, readonly=readonly)
+
+    @classmethod
+    def read_summary(cls, path):
+        """ returns the summary of the timeline in the given path without loading it, see summary()
+
+                returns None if the timeline has no (readable) summary file yet
+        """
+
+        try:
+            with open(os.path.join(path, cls._summaryfile_ext), 'r') as fh:
+                return json.load(fh)
+        except (IOError, ValueError):
+            return None
+
+    def summary(self):
+        """ returns a short summary of the timeline: snapshot count, latest snapshot and links """
+
+        latest = None
+        if self._snapshots:
+            latest = max(self._snapshots, key=lambda s: self._snapshots[s]['created'])
+        return {
+            'name': self._name,
+            'source': self._source,
+            'frozen': self._frozen,
+            'snapshots': len(self._snapshots),
+            'latest': latest,
+            'latest_created': latest and self._snapshots[latest]['created'].strftime("%Y.%m.%d-%H%M%S"),
+            'links': dict((k, v['snapshot']) for k, v in self._links.items()),
+        }
+
+    def _save_summary(self):
+        """ helper method to write the summary file, replacing it atomically """
+
+        summary_file = os.path.join(self._destination, self._summaryfile_ext)
+        tmp_file = '{0}.{1}.tmp'.format(summary_file, os.getpid())
+        with open(tmp_file, 'w') as fh:
+            json.dump(self.summary(), fh, sort_keys=True)
+        os.rename(tmp_file, summary_file)
 
     def __str__(self):
         """ human readable string representation of this class """
@@ -169,6 +318,11 @@ Excludes: {excludes}""".format(**tldata)
 
             print("{0:<20} {1:<20} {2:<20}".format(k, v['snapshot'], date))
 
+    def get_source(self):
+        """ helper method to return the source directory """
+
+        return self._source
+
     def get_max_snapshots(self):
         """ helper method to return the max snapshots value """
 
@@ -237,47 +391,243 @@ Excludes: {excludes}""".format(**tldata)
             self.logger.warning('timeline is not frozen')
 
     def save(self):
-        """ saves the current timeline state """
+        """ saves the current timeline state
+
+                within a transaction, saving is deferred until the transaction is committed
+        """
+
+        if self._readonly:
+            raise Exception('timeline [{0}] was loaded read-only and can not be saved'.format(self._name))
+
+        if self._transaction is not None:
+            return
 
         self._save_state()
         self._save_cfgfile()
 
+    def close(self):
+        """ releases the lock and the state file of the timeline, the instance can't be used afterwards """
+
+        if self._state_store is not None:
+            self._state_store.close()
+            self._state_store = None
+        if self._lock is not None:
+            self._lock.release()
+            self._lock = None
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """ groups several timeline mutations into one commit
+
+                metadata changes made within the block are saved once when the block ends, and the
+                file system actions (link swaps, snapshot deletions) collected meanwhile run as a
+                batch afterwards. if the block raises, the in-memory state is rolled back to where
+                the transaction started, nothing is saved and no action runs.
+
+                nested transactions are merged into the outermost one
+
+                    with t.transaction():
+                        t.update_link('stable')
+                        t.delete_snapshot('old')
+        """
+
+        if self._transaction is not None:
+            yield
+            return
+
+        # everything that is saved, to roll back to if the block fails
+        rollback = copy.deepcopy(dict((k, v) for k, v in self.__dict__.items() if k not in self._runtime_attrs))
+        self._transaction = []
+        try:
+            yield
+        except Exception:
+            self._transaction = None
+            self.__dict__.update(rollback)
+            raise
+
+        actions = self._transaction
+        self._transaction = None
+        self.save()
+
+        # several actions on the same object (e.g. a link moved twice) collapse into the last one
+        last = dict((key, i) for i, (key, func, args) in enumerate(actions) if key is not None)
+        for i, (key, func, args) in enumerate(actions):
+            if key is None or last[key] == i:
+                func(*args)
+
+        self._finish_trash_operation()
+
+    def _fs_action(self, key, func, *args):
+        """ runs a file system action now, or queues it if a transaction is in progress
+
+                <key> identifies the object the action applies to, for actions that may be collapsed
+        """
+
+        if self._transaction is None:
+            func(*args)
+        else:
+            self._transaction.append((key, func, args))
+
+    def _set_symlink(self, target, link_path):
+        """ atomically creates or replaces a symbolic link """
+
+        tmp_path = '{0}.{1}.tmp'.format(link_path, os.getpid())
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        os.symlink(target, tmp_path)
+        os.rename(tmp_path, link_path)
+
+    def _remove_file(self, path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
     def _rm_snapshot(self, snapshot, deleted_snapshot):
-        if deleted_snapshot.has_key('diff_log_file'):
-            self.logger.debug('deleting diff log file [{0}]'.format(
-                deleted_snapshot['diff_log_file']))
-            subprocess.check_call(
-                ['rm', '-f', deleted_snapshot['diff_log_file']])
+        # the usage counts need the manifest of the snapshot to forget it
+        usage_file = os.path.join(self._destination, self._usagefile_ext)
+        if os.path.exists(usage_file) and os.path.exists(deleted_snapshot.get('manifest_file', '')):
+            try:
+                with usage.UsageCache(usage_file) as u:
+                    u.remove_snapshot(snapshot)
+            except Exception as e:
+                # the counts are rebuilt by the next snapshot-du
+                self.logger.warning('could not update disk usage counts: {0}'.format(e))
+
+        for key in ('diff_log_file', 'diff_report_file', 'manifest_file'):
+            if deleted_snapshot.has_key(key):
+                self.logger.debug('deleting file [{0}]'.format(
+                    deleted_snapshot[key]))
+                self._remove_file(deleted_snapshot[key])
 
         if not os.path.isdir(deleted_snapshot['path']):
             # Nothing to do anymore
             return
-        del_path = os.path.join(self._destination, '_repoman_to_be_deleted')
-        tgt_path = os.path.join(del_path, snapshot)
-        os.mkdir(del_path)
-        os.rename(deleted_snapshot['path'], tgt_path)
-        subprocess.check_call(['rm', '-rf', del_path])
+
+        # the actual removal is left to the reaper, see _finish_trash_operation()
+        # while the operation is open its directory is locked, so reapers leave it alone
+        if self._trash_op is None:
+            self._trash_op = reaper.Operation(self._trash_dir)
+        os.rename(deleted_snapshot['path'], os.path.join(self._trash_op.path, snapshot))
+
+    def _finish_trash_operation(self):
+        """ ends the current delete operation and hands its trash directory to the reaper """
+
+        if self._trash_op is None:
+            return
+        self._trash_op.close()
+        self._trash_op = None
+
+        if self._reap_mode == 'foreground':
+            self.reap_trash()
+        elif self._reap_mode == 'background':
+            self._get_reaper().spawn()
+        else:
+            self.logger.info('deleted snapshots are left in [{0}] until snapshot-reap is run'.format(self._trash_dir))
+
+    def _get_reaper(self, workers=None, ionice=None):
+        return reaper.Reaper(self._trash_dir,
+                             workers=workers or self._reap_workers,
+                             ionice=ionice or self._reap_ionice,
+                             logger=self.logger)
+
+    def reap_trash(self, workers=None, ionice=None):
+        """ removes deleted snapshots from disk
+
+                this also resumes removals which were interrupted, and picks up what older versions
+                left behind in '_repoman_to_be_deleted'
+        """
+
+        legacy_path = os.path.join(self._destination, self._legacy_trash_dir_name)
+        if os.path.isdir(legacy_path):
+            op = reaper.Operation(self._trash_dir)
+            try:
+                os.rename(legacy_path, os.path.join(op.path, self._legacy_trash_dir_name))
+            finally:
+                op.close()
+
+        r = self._get_reaper(workers, ionice)
+        pending = len(r.pending())
+        removed = r.reap()
+        self.logger.info('reaped [{0}] deleted snapshot operation(s), [{1}] files removed'.format(pending, removed))
+
+        left = r.pending()
+        if left:
+            self.logger.warning('[{0}] deleted snapshot operation(s) are still left in [{1}], they may still be in '
+                                'use or a background reaper may be working on them (see [{2}])'.format(len(left), self._trash_dir, r.log_path))
+        return removed
+
+    def _state_records(self):
+        """ returns the state to be saved, as records per table of the state file """
+
+        meta = self.__dict__.copy()  # copy the dict since we will change it
+        for k in self._runtime_attrs + ('_snapshots', '_links'):
+            del meta[k]  # logger and the store hold file objects, the rest is only valid at runtime
+        return {'meta': meta, 'snapshots': self._snapshots, 'links': self._links}
+
+    def _get_state_store(self):
+        if self._state_store is None:
+            self._state_store = state.StateStore(self._statefile)
+        return self._state_store
 
     def _save_state(self):
-        """ saves current timeline state into file """
+        """ saves current timeline state into file
+
+                only records (timeline settings, snapshots, links) which changed since the state was
+                loaded or last saved are written, in a single transaction
+        """
 
         self.logger.debug('saving current timeline state...')
-        fh = open(self._datafile, 'w')
-        #pickle.dump( self, fh )
-        d = self.__dict__.copy()  # copy the dict since we will change it
-        del d['logger']  # need to delete self.logger due to file object
-        pickle.dump(d, fh)
+        written = self._get_state_store().commit(self._state_records())
+        if written or not os.path.exists(os.path.join(self._destination, self._summaryfile_ext)):
+            self._save_summary()
         self.logger.debug(
-            'current state saved into [{0}]'.format(self._datafile))
+            'current state saved into [{0}], [{1}] records written'.format(self._statefile, written))
 
     def _load_state(self):
         """ loads timeline state from file """
 
         self.logger.info('loading timeline state...')
+
+        if not os.path.exists(self._statefile):
+            if self._readonly:
+                with open(self._datafile, 'r') as fh:
+                    self.__dict__.update(pickle.load(fh))
+                return
+            self._migrate_state()
+            return
+
+        if self._readonly:
+            store = state.StateStore(self._statefile, readonly=True)
+        else:
+            store = self._get_state_store()
+        try:
+            self.__dict__.update(store.load('meta'))
+            self._snapshots = store.load('snapshots')
+            self._links = store.load('links')
+        finally:
+            if self._readonly:
+                store.close()
+        self.logger.info(
+            'timeline state loaded from [{0}]'.format(self._statefile))
+
+    def _migrate_state(self):
+        """ converts the pickled state of older versions into the state file """
+
+        self.logger.info('migrating timeline state from [{0}] to [{1}]'.format(self._datafile, self._statefile))
         fh = open(self._datafile, 'r')
         self.__dict__.update(pickle.load(fh))
+        fh.close()
+
+        # the pickle contains the paths of the time it was written
+        self._statefile = os.path.join(self._destination, self._statefile_ext)
+        self._trash_dir = os.path.join(self._destination, self._trash_dir_name)
+
+        self._save_state()
+        os.rename(self._datafile, self._datafile + '.migrated')
         self.logger.info(
-            'timeline state loaded from [{0}]'.format(self._datafile))
+            'timeline state migrated, the old state file was kept as [{0}.migrated]'.format(self._datafile))
 
     def _save_cfgfile(self):
         """ saves current settings into configuration file """
@@ -291,6 +641,12 @@ Excludes: {excludes}""".format(**tldata)
         cfg.set( 'MAIN', """\
 # ============================================================================================================================= =
 # warning: this file is constantly auto-generated! do not be surprised if any comments get lost
+# options description:
+#    retention: generational retention policy, e.g. last=7,daily=14,weekly=8,monthly=12. if set, rotation keeps the
+#       newest <last> snapshots plus the newest snapshot of each of the last <daily> days, <weekly> weeks and <monthly>
+#       months instead of the newest <max_snapshots>. linked and named snapshots are always kept
+#    incremental: compare new snapshots against the latest one. unchanged copied files are linked from it and the
+#       reported size only counts new content. every file is still linked, so snapshots are not created any faster
 # =============================================================================================================================""", '' )
         cfg.set( 'ADVANCED', """\
 # ============================================================================================================================= =
@@ -299,23 +655,42 @@ Excludes: {excludes}""".format(**tldata)
 #    excludes: colon-separated list of files/directories to be excluded when creating snapshots
 #       no absolute paths allowed. only top-level paths or relative paths, e.g.
 #       excludes = testing:dev:tmp:i386/builds
-#       in this example the path i386/builds contains a subfolder. due to technical details these "relative paths" are not
-#       skipped during the copy process. instead, they get deleted _after_ the copy process has taken place.
+#       in this example the path i386/builds contains a subfolder. these "relative paths" are skipped while walking the
+#       source directory, just like top-level paths.
 #    copy_files_recursive: colon-separated list of file names to be copied (i.e. not hard-linked) when creating snapshots
 #    copy_dirs_recursive:  colon-separated list of directory names to be copied (i.e. not hard-linked) when creating snapshots
-#       warning: the previous copy options perform a _recursive_ find in the source directory and _copy_ any found objects!
+#       warning: the previous copy options match names anywhere in the source directory and _copy_ any found objects!
+#    clone_workers: number of threads used for hard-linking snapshots (0 = automatic, based on the number of cpus)
+#    reap_mode: when deleted snapshots are removed from disk. foreground: right away, background: by a detached
+#       process, deferred: only by the snapshot-reap command
+#    reap_ionice: I/O scheduling class used while removing deleted snapshots (none, idle, best-effort, realtime)
+#    reap_workers: number of threads used for removing deleted snapshots (0 = automatic)
 # =============================================================================================================================""", '' )
         cfg.set('MAIN', 'max_snapshots', self.get_max_snapshots())
         cfg.set('MAIN', 'diff_log_path', self._diff_log_path)
+        cfg.set('MAIN', 'diff_report_format', self._diff_report_format)
+        cfg.set('MAIN', 'incremental', str(self._incremental).lower())
+        cfg.set('MAIN', 'manifest', str(self._manifest).lower())
+        cfg.set('MAIN', 'retention', self._retention)
         cfg.set('ADVANCED', 'excludes', self.get_excludes())
         cfg.set('ADVANCED', 'copy_files_recursive',
                 ':'.join(self._copy_files_recursive))
         cfg.set('ADVANCED', 'copy_dirs_recursive',
                 ':'.join(self._copy_dirs_recursive))
-
-        # write configuration file
-        with open(self._cfgfile, 'wb') as cfgfile:
-            cfg.write(cfgfile)
+        cfg.set('ADVANCED', 'clone_workers', self._clone_workers)
+        cfg.set('ADVANCED', 'reap_mode', self._reap_mode)
+        cfg.set('ADVANCED', 'reap_ionice', self._reap_ionice)
+        cfg.set('ADVANCED', 'reap_workers', self._reap_workers)
+
+        # write configuration file, but only if something changed
+        buf = StringIO.StringIO()
+        cfg.write(buf)
+        content = buf.getvalue()
+        if not os.path.exists(self._cfgfile) or open(self._cfgfile, 'rb').read() != content:
+            tmp_cfgfile = self._cfgfile + '.tmp'
+            with open(tmp_cfgfile, 'wb') as cfgfile:
+                cfgfile.write(content)
+            os.rename(tmp_cfgfile, self._cfgfile)
 
         # write excludes file for diff cmd
         diffcfgfile = """# the contents in this file were generated from the settings:\n# copy_files_recursive and copy_dirs_recursive\n\n"""
@@ -340,11 +715,35 @@ Excludes: {excludes}""".format(**tldata)
         self.set_excludes(cfg.get('ADVANCED', 'excludes'))
         if cfg.has_option('MAIN', 'diff_log_path'):
             self._diff_log_path = cfg.get('MAIN', 'diff_log_path')
+        if cfg.has_option('MAIN', 'diff_report_format'):
+            self._diff_report_format = cfg.get('MAIN', 'diff_report_format')
+            if self._diff_report_format not in self._diff_report_formats:
+                raise Exception('diff_report_format must be one of: {0}'.format(', '.join(self._diff_report_formats)))
+        if cfg.has_option('MAIN', 'incremental'):
+            self._incremental = cfg.getboolean('MAIN', 'incremental')
+        if cfg.has_option('MAIN', 'manifest'):
+            self._manifest = cfg.getboolean('MAIN', 'manifest')
+        if cfg.has_option('MAIN', 'retention'):
+            self._retention = cfg.get('MAIN', 'retention').strip()
+            # fail early on an invalid policy
+            self.get_retention_policy()
         # FIXME ugly hack...
         self._copy_files_recursive = [i.strip() for i in cfg.get(
             'ADVANCED', 'copy_files_recursive', '').split(':') if i]
         self._copy_dirs_recursive = [i.strip() for i in cfg.get(
             'ADVANCED', 'copy_dirs_recursive', '').split(':') if i]
+        if cfg.has_option('ADVANCED', 'clone_workers'):
+            self._clone_workers = cfg.getint('ADVANCED', 'clone_workers')
+        if cfg.has_option('ADVANCED', 'reap_mode'):
+            self._reap_mode = cfg.get('ADVANCED', 'reap_mode')
+            if self._reap_mode not in self._reap_modes:
+                raise Exception('reap_mode must be one of: {0}'.format(', '.join(self._reap_modes)))
+        if cfg.has_option('ADVANCED', 'reap_ionice'):
+            self._reap_ionice = cfg.get('ADVANCED', 'reap_ionice')
+            if self._reap_ionice not in reaper.IONICE_CLASSES:
+                raise Exception('reap_ionice must be one of: {0}'.format(', '.join(sorted(reaper.IONICE_CLASSES))))
+        if cfg.has_option('ADVANCED', 'reap_workers'):
+            self._reap_workers = cfg.getint('ADVANCED', 'reap_workers')
 
     def _initialize_repository_options(self):
         """ this options are specific to repositories only """
@@ -367,81 +766,94 @@ Excludes: {excludes}""".format(**tldata)
             self._copy_files_recursive = [
                 'Release', 'Release.gpg', 'InRelease', 'Contents-*.gz', 'Index']
 
-    def _snapshot_copy_by_hardlink(self, source_path, snapshot_path):
-        """ helper method which copies (by hard-linking) the given directory """
+    def _snapshot_copy_by_hardlink(self, source_path, snapshot_path, reference_path=None, manifest_path=None):
+        """ helper method which copies (by hard-linking) the given directory
 
-        #subprocess.check_call(['cp', '-al', source_path, snapshot_path ])
+                files and directories matching copy_files_recursive and copy_dirs_recursive are
+                copied (instead of just hard-linked) in the same pass
 
-        os.makedirs(snapshot_path)
+                if <reference_path> is set, the copy is done incrementally against that (previous) snapshot
 
-        for i in os.listdir(source_path):
-            source_obj = os.path.normpath(os.path.join(source_path, i))
-            for e in self._excludes:
-                exclude_obj = os.path.normpath(os.path.join(source_path, e))
-                if source_obj == exclude_obj:
-                    self.logger.debug(
-                        'excluding (skipping) object [{0}]'.format(exclude_obj))
-                    break
-            else:
-                subprocess.check_call(['cp', '-al', source_obj, snapshot_path])
-
-        # cleanup excludes which are defined as 'subdirectories'
-        for e in self._excludes:
-            if '/' in e:
-                exclude_obj = os.path.normpath(os.path.join(snapshot_path, e))
-                if os.path.exists(exclude_obj) or os.path.islink(exclude_obj):
-                    self.logger.debug(
-                        'excluding (deleting) object [{0}]'.format(exclude_obj))
-                    subprocess.check_call(['rm', '-rf', exclude_obj])
-                else:
-                    self.logger.warning(
-                        'trying to exclude (delete) unexisting object [{0}]'.format(exclude_obj))
+                if <manifest_path> is set, the manifest of the new snapshot is written there
+        """
+
+        if reference_path:
+            self.logger.info('using [{0}] as reference for an incremental snapshot'.format(reference_path))
+
+        cloner = clone.TreeCloner(workers=self._clone_workers, logger=self.logger)
+        stats = cloner.clone(source_path, snapshot_path, excludes=self._excludes, reference_path=reference_path,
+                             copy_dirs=self._copy_dirs_recursive, copy_files=self._copy_files_recursive,
+                             collect_manifest=bool(manifest_path))
+
+        self.logger.info('hard-linked [{0}] into [{1}]: {2}'.format(source_path, snapshot_path, stats))
+
+        if manifest_path:
+            if not os.path.isdir(self._manifest_dir):
+                os.makedirs(self._manifest_dir)
+            manifest.write_manifest(manifest_path, cloner.entries)
+            self.logger.debug('wrote manifest [{0}] with [{1}] entries'.format(manifest_path, len(cloner.entries)))
+
+        return stats
+
+    def _new_snapshot(self, snapshot, created):
+        """ helper method to return the metadata record of a new snapshot """
+
+        record = {'created': created, 'path': os.path.join(self._destination, snapshot), 'links': []}
+        if self._manifest:
+            record['manifest_file'] = os.path.join(self._manifest_dir, snapshot + self._manifest_ext)
+        return record
+
+    def _clone_stats_record(self, stats):
+        """ helper method to return the clone statistics kept in the metadata of a snapshot """
+
+        return {'files': stats.files, 'dirs': stats.dirs, 'bytes': stats.bytes, 'elapsed': stats.elapsed}
+
+    def get_snapshot(self, snapshot):
+        """ returns (a copy of) the metadata of the given snapshot """
+
+        self._valid_snapshot(snapshot, fail_on_disk_check=False)
+        return dict(self._snapshots[snapshot])
+
+    def get_manifest(self, snapshot):
+        """ returns the (opened) manifest of the given snapshot, or None if it has none """
+
+        self._valid_snapshot(snapshot)
+        path = self._snapshots[snapshot].get('manifest_file')
+        if not path or not os.path.exists(path):
+            return None
+        return manifest.Manifest(path)
+
+    def print_snapshot_files(self, snapshot, prefix=''):
+        """ lists the contents of a snapshot from its manifest """
 
-    def _snapshot_find_and_copy_objects(self, source_path, snapshot_path):
-        """ helper method which first removes and afterwards copies
-            (instead of just hard-linking) a list of files/directories
+        m = self.get_manifest(snapshot)
+        if m is None:
+            raise Exception('snapshot [{0}] has no manifest'.format(snapshot))
+
+        with m:
+            print("{0:<4} {1:>12} {2:<20} {3}".format('TYPE', 'SIZE', 'MODIFIED', 'PATH'))
+            for e in m.iter_prefix(prefix):
+                print("{0:<4} {1:>12} {2:<20} {3}".format(e.type, e.size,
+                      datetime.fromtimestamp(e.mtime).strftime("%Y.%m.%d-%H%M%S"), e.path))
+
+    def _get_reference_snapshot_path(self, incremental=None):
+        """ helper method to return the path of the snapshot an incremental snapshot is compared to
+
+                returns None if incremental snapshots are disabled or there is no usable snapshot
         """
 
-        if self._copy_dirs_recursive:
-            # generate a find cmd with list of dirs to be copied
-            # e.g. find /tmp/foo -type d -name repodata -o -name repoview -o
-            # -name bar
-            find_cmd = ['find', snapshot_path, '-type',
-                        'd', '-name', self._copy_dirs_recursive[0]]
-            for i in self._copy_dirs_recursive[1:]:
-                find_cmd.extend(['-o', '-name', i])
-
-            # FIXME cannot use this because python version is too old...
-            #cdirs = subprocess.check_output( find_cmd ).split()
-            cdirs = subprocess.Popen(
-                find_cmd, stdout=subprocess.PIPE).communicate()[0].split()
-            for cdir in cdirs:
-                subprocess.check_call(['rm', '-rf', cdir])
-                rel_path = os.path.relpath(cdir, snapshot_path)
-                self.logger.debug('copying directory [{0}] to [{1}]'.format(
-                    os.path.join(source_path, rel_path), cdir))
-                subprocess.check_call(
-                    ['cp', '-a', os.path.join(source_path, rel_path), cdir])
-
-        if self._copy_files_recursive:
-            # generate a find cmd with list of files to be copied
-            # e.g. find /tmp/foo -type f -name Release -o -name Release.gpg ...
-            find_cmd = ['find', snapshot_path, '-type',
-                        'f', '-name', self._copy_files_recursive[0]]
-            for i in self._copy_files_recursive[1:]:
-                find_cmd.extend(['-o', '-name', i])
-
-            # FIXME cannot use this because python version is too old...
-            #cfiles = subprocess.check_output( find_cmd ).split()
-            cfiles = subprocess.Popen(
-                find_cmd, stdout=subprocess.PIPE).communicate()[0].split()
-            for cfile in cfiles:
-                subprocess.check_call(['rm', '-f', cfile])
-                rel_path = os.path.relpath(cfile, snapshot_path)
-                self.logger.debug('copying file [{0}] to [{1}]'.format(
-                    os.path.join(source_path, rel_path), cfile))
-                subprocess.check_call(
-                    ['cp', '-a', os.path.join(source_path, rel_path), cfile])
+        if incremental is None:
+            incremental = self._incremental
+
+        if not incremental:
+            return None
+
+        for snapshot in reversed(self._lsnapshots):
+            if os.path.isdir(self._snapshots[snapshot]['path']):
+                return self._snapshots[snapshot]['path']
+
+        self.logger.info('no previous snapshot found, taking a full snapshot')
+        return None
 
     def _snapshot_generate_diff_report(self):
         """ helper method for generating a diff report from the current snapshot
@@ -460,19 +872,30 @@ Excludes: {excludes}""".format(**tldata)
             if not os.path.exists(self._diff_log_path):
                 os.makedirs(self._diff_log_path)
 
-            cmd = ['diff', '-r', '-q', '-X', self._cfgfile_diff, self._snapshots[current_snapshot]
-                   ['path'], self._snapshots[previous_snapshot]['path']]
-            stdout_file = '{0}__{1}__{2}{3}'.format(os.path.join(
-                self._diff_log_path, self._name), current_snapshot, previous_snapshot, self._difflog_ext)
+            diff = snapdiff.SnapshotDiff(self._snapshots[current_snapshot]['path'],
+                                         self._snapshots[previous_snapshot]['path'],
+                                         excludes=snapdiff.read_exclude_file(self._cfgfile_diff))
+            differences = diff.run()
+
+            # the log keeps the 'diff -r -q' format, the report next to it is meant for tools
+            basename = '{0}__{1}__{2}'.format(os.path.join(
+                self._diff_log_path, self._name), current_snapshot, previous_snapshot)
+            stdout_file = basename + self._difflog_ext
+            report_file = '{0}.diff.{1}'.format(basename, self._diff_report_format)
             with open(stdout_file, "w") as outfile:
-                subprocess.call(cmd, stdout=outfile, stderr=subprocess.STDOUT)
+                diff.write_log(outfile)
+            with open(report_file, "w") as outfile:
+                diff.write_report(outfile, self._diff_report_format)
 
             self._snapshots[current_snapshot]['diff_log_file'] = stdout_file
+            self._snapshots[current_snapshot]['diff_report_file'] = report_file
+            self.save()
 
             self.logger.debug(
-                'generated diff log file [{0}]'.format(stdout_file))
+                'generated diff log file [{0}] and report [{1}]: {2} differences, {3} entries compared'.format(
+                    stdout_file, report_file, len(differences), diff.compared))
 
-    def create_named_snapshot(self, snapshot, source_snapshot=None):
+    def create_named_snapshot(self, snapshot, source_snapshot=None, incremental=None):
         """ creates a named snapshot from the source directory
 
             named snapshots are created but not managed by the timeline class
@@ -481,6 +904,10 @@ Excludes: {excludes}""".format(**tldata)
             by the timeline methods
 
             these snapshots can be created even if the timeline has been frozen.
+
+            if <incremental> is set (defaults to the 'incremental' setting), a snapshot taken from the
+            source directory is compared against the latest snapshot: unchanged copies are linked to
+            the ones of that snapshot and only new content is accounted
         """
 
         self.logger.info('creating new snapshot [{0}]'.format(snapshot))
@@ -490,8 +917,10 @@ Excludes: {excludes}""".format(**tldata)
                 'using source snapshot [{0}]'.format(source_snapshot))
             self._valid_snapshot(source_snapshot)
             source_path = self._snapshots[source_snapshot]['path']
+            reference_path = None
         else:
             source_path = self._source
+            reference_path = self._get_reference_snapshot_path(incremental)
 
         if not isalnum(snapshot, '-_.'):
             raise Exception(
@@ -502,25 +931,35 @@ Excludes: {excludes}""".format(**tldata)
         if os.path.exists(snapshot_path):
             raise Exception("Snapshot [{0}] destination already exists: {}".format(snapshot, snapshot_path))
 
-        self._snapshots[snapshot] = {
-            'created': datetime.now(), 'path': snapshot_path, 'links': []}
+        self._snapshots[snapshot] = self._new_snapshot(snapshot, datetime.now())
         self.save()
 
         # make changes in the file system
-        self._snapshot_copy_by_hardlink(source_path, snapshot_path)
-        self._snapshot_find_and_copy_objects(source_path, snapshot_path)
+        stats = self._snapshot_copy_by_hardlink(source_path, snapshot_path, reference_path,
+                                                self._snapshots[snapshot].get('manifest_file'))
+        self._snapshots[snapshot]['clone_stats'] = self._clone_stats_record(stats)
+        self.save()
 
         self.logger.debug('created new snapshot [{0}]'.format(snapshot))
 
+        return snapshot
+
     def _snapshot_is_named(self, snapshot):
         return (snapshot not in self._lsnapshots)
 
-    def create_snapshot(self, random_sleep_before_snapshot=None, sleep_after_snapshot=None):
+    def create_snapshot(self, random_sleep_before_snapshot=None, sleep_after_snapshot=None, incremental=None):
         """ creates a new snapshot from the source directory
 
                 no action is taken if the timeline has been frozen!
 
                 the oldest snapshot is removed when <max_snapshots> is reached
+
+                if <incremental> is set (defaults to the 'incremental' setting), the source is compared
+                against the latest snapshot: unchanged copies (copy_files, copy_dirs) are linked to the
+                ones of that snapshot instead of copied again, and the clone stats only account what
+                changed. every file is still linked, so this saves no work on the hard links
+
+                returns the name of the new snapshot
         """
 
         if random_sleep_before_snapshot:
@@ -546,14 +985,16 @@ Excludes: {excludes}""".format(**tldata)
 
         # create new snapshot
         snapshot_path = os.path.join(self._destination, snapshot)
-        self._snapshots[snapshot] = {
-            'created': now, 'path': snapshot_path, 'links': []}
+        reference_path = self._get_reference_snapshot_path(incremental)
+        self._snapshots[snapshot] = self._new_snapshot(snapshot, now)
         self._lsnapshots.append(snapshot)
         self.save()
 
         # make changes in the file system
-        self._snapshot_copy_by_hardlink(self._source, snapshot_path)
-        self._snapshot_find_and_copy_objects(self._source, snapshot_path)
+        stats = self._snapshot_copy_by_hardlink(self._source, snapshot_path, reference_path,
+                                                self._snapshots[snapshot].get('manifest_file'))
+        self._snapshots[snapshot]['clone_stats'] = self._clone_stats_record(stats)
+        self.save()
         self._snapshot_generate_diff_report()
 
         # delete old snapshots and handle links...
@@ -566,10 +1007,14 @@ Excludes: {excludes}""".format(**tldata)
                 'sleeping for [{0}] seconds'.format(sleep_after_snapshot))
             time.sleep(sleep_after_snapshot)
 
+        return snapshot
+
     def delete_snapshot(self, snapshot, skip_linked=False):
         """ deletes the given snapshot and handles links appropriately
 
                 no action is taken if the timeline has been frozen!
+
+                the snapshot is moved to the trash directory and left to the reaper
         """
 
         self.logger.info('deleting snapshot [{0}]'.format(snapshot))
@@ -590,7 +1035,9 @@ Excludes: {excludes}""".format(**tldata)
 
         deleted_snapshot = self._snapshots.pop(snapshot)
         self.save()
-        self._rm_snapshot(snapshot, deleted_snapshot)
+        self._fs_action(None, self._rm_snapshot, snapshot, deleted_snapshot)
+        if self._transaction is None:
+            self._finish_trash_operation()
         self.logger.debug('deleted snapshot [{0}] [{1}]'.format(
             snapshot, deleted_snapshot))
 
@@ -608,9 +1055,95 @@ Excludes: {excludes}""".format(**tldata)
                     self.logger.info("Would delete snapshot %s", v['path'])
                 else:
                     to_be_deleted.append(k)
-        for snap in to_be_deleted:
-            self.delete_snapshot(snap, True) # skip_linked
+        with self.transaction():
+            for snap in to_be_deleted:
+                self.delete_snapshot(snap, True) # skip_linked
+
+    def print_disk_usage(self, human=True):
+        """ prints the total, unique and shared bytes of every snapshot, and what deleting it would free
+
+                unique bytes are those of files no other snapshot of the timeline links. deleting a
+                snapshot frees only those of its unique files which are not linked from outside the
+                timeline either (e.g. from the source directory). the counts are built from the
+                snapshot manifests and kept up to date incrementally, snapshots without a manifest
+                are not accounted.
+        """
+
+        fmt = usage.format_bytes if human else str
+        manifests = {}
+        for snapshot, v in self._snapshots.items():
+            if os.path.exists(v.get('manifest_file', '')):
+                manifests[snapshot] = v['manifest_file']
+            else:
+                self.logger.warning('snapshot [{0}] has no manifest and is not accounted'.format(snapshot))
+
+        with usage.UsageCache(os.path.join(self._destination, self._usagefile_ext)) as u:
+            changed = u.update(manifests)
+            self.logger.debug('[{0}] snapshots added to or removed from the usage counts'.format(changed))
+            accounted = u.snapshots()
+
+            print("{0:<26} {1:<20} {2:>10} {3:>10} {4:>10} {5:>10}".format(
+                'SNAPSHOT', 'CREATED', 'TOTAL', 'UNIQUE', 'SHARED', 'FREEABLE'))
+            for snapshot in sorted(accounted, key=lambda s: self._snapshots[s]['created']):
+                manifest_file, total, unique = accounted[snapshot]
+                freeable = u.freeable(snapshot, self._snapshots[snapshot]['path'])
+                print("{0:<26} {1:<20} {2:>10} {3:>10} {4:>10} {5:>10}".format(
+                    snapshot, self._snapshots[snapshot]['created'].strftime("%Y.%m.%d-%H%M%S"),
+                    fmt(total), fmt(unique), fmt(total - unique), fmt(freeable)))
+            print("timeline [{0}]: {1} in distinct files over {2} snapshots".format(
+                self._name, fmt(u.timeline_bytes()), len(accounted)))
+
+    def get_retention_policy(self):
+        """ returns the configured retention policy, or None if rotation uses max_snapshots """
+
+        if not self._retention:
+            return None
+        return retention.RetentionPolicy.parse(self._retention)
+
+    def plan_retention(self, policy=None):
+        """ computes which snapshots the given (default: the configured) retention policy keeps and deletes
+
+                linked and named snapshots are always kept. returns a list of
+                (snapshot, created, action, reasons) tuples, see retention.RetentionPolicy.plan()
+        """
+
+        if policy is None:
+            policy = self.get_retention_policy()
+            if policy is None:
+                raise Exception('no retention policy configured for timeline [{0}]'.format(self._name))
+
+        snapshots = []
+        for snapshot, v in self._snapshots.items():
+            pinned = None
+            if v['links']:
+                pinned = 'linked'
+            elif self._snapshot_is_named(snapshot):
+                pinned = 'named'
+            snapshots.append((snapshot, v['created'], pinned))
+        return policy.plan(snapshots)
+
+    def apply_retention(self, policy=None, dryrun=False):
+        """ prints the retention plan and deletes the snapshots it does not keep, in one transaction
+
+                no action is taken if the timeline has been frozen!
+        """
+
+        plan = self.plan_retention(policy)
+        print("{0:<26} {1:<20} {2:<8} {3}".format('SNAPSHOT', 'CREATED', 'ACTION', 'KEPT_AS'))
+        for snapshot, created, action, reasons in plan:
+            print("{0:<26} {1:<20} {2:<8} {3}".format(snapshot, created.strftime("%Y.%m.%d-%H%M%S"),
+                                                       action, ",".join(reasons)))
+
+        to_be_deleted = [p[0] for p in plan if p[2] == retention.DELETE]
+        self.logger.info('retention keeps [{0}] and deletes [{1}] snapshots'.format(
+            len(plan) - len(to_be_deleted), len(to_be_deleted)))
+        if dryrun or not to_be_deleted:
+            return
 
+        self._check_frozen()
+        with self.transaction():
+            for snapshot in to_be_deleted:
+                self.delete_snapshot(snapshot, skip_linked=True)
 
     def create_link(self, link, snapshot=None, max_offset=0, warn_before_max_offset=0):
         """ creates a new symbolic link to the given snapshot into the destination directory
@@ -655,7 +1188,7 @@ Excludes: {excludes}""".format(**tldata)
         self.save()
 
         # make changes in the file system
-        subprocess.check_call(['ln', '-s', snapshot, link_path])
+        self._fs_action(link_path, self._set_symlink, snapshot, link_path)
 
         self.logger.debug(
             'created new link [{0}] to snapshot [{1}]'.format(link, snapshot))
@@ -682,7 +1215,7 @@ Excludes: {excludes}""".format(**tldata)
         self.save()
 
         # make changes in the file system
-        subprocess.check_call(['rm', '-f', deleted_link['path']])
+        self._fs_action(deleted_link['path'], self._remove_file, deleted_link['path'])
 
         self.logger.debug(
             'deleted link [{0}] [{1}]'.format(link, deleted_link))
@@ -729,8 +1262,7 @@ Excludes: {excludes}""".format(**tldata)
         self.save()
 
         # make changes in the file system
-        subprocess.check_call(
-            ['ln', '-snf', snapshot, self._links[link]['path']])
+        self._fs_action(self._links[link]['path'], self._set_symlink, snapshot, self._links[link]['path'])
 
         self.logger.info(
             'updated link [{0}] to snapshot [{1}]'.format(link, snapshot))
@@ -741,15 +1273,30 @@ Excludes: {excludes}""".format(**tldata)
                 links are handled appropriately
         """
 
-        # update all links to be kept pinned within their <max_offset>
-        for lk, link in self._links.items():
-            if link['max_offset']:
-                if self._get_snapshot_offset(link['snapshot']) > link['max_offset']:
-                    self.update_link(lk, self._lsnapshots[-link['max_offset']])
-
-        # remove oldest snapshot(s)
-        while len(self._lsnapshots) > self._max_snapshots:
-            self.delete_snapshot(self._lsnapshots[0], skip_linked=True)
+        with self.transaction():
+            # update all links to be kept pinned within their <max_offset>
+            for lk, link in self._links.items():
+                if link['max_offset']:
+                    if self._get_snapshot_offset(link['snapshot']) > link['max_offset']:
+                        self.update_link(lk, self._lsnapshots[-link['max_offset']])
+
+            policy = self.get_retention_policy()
+            if policy is not None:
+                for snapshot, created, action, reasons in self.plan_retention(policy):
+                    if action == retention.DELETE:
+                        self.delete_snapshot(snapshot, skip_linked=True)
+                return
+
+            # remove oldest snapshot(s), linked snapshots are kept even if that exceeds <max_snapshots>
+            excess = len(self._lsnapshots) - self._max_snapshots
+            for snapshot in self._lsnapshots[:]:
+                if excess <= 0:
+                    break
+                if self._snapshots[snapshot]['links']:
+                    self.logger.info('keeping linked snapshot [{0}] during rotation'.format(snapshot))
+                    continue
+                self.delete_snapshot(snapshot, skip_linked=True)
+                excess -= 1
 
     def consistency_check(self):
         """ looks for missing snapshots and missing links and fixes metadata appropriately """
@@ -762,12 +1309,47 @@ Excludes: {excludes}""".format(**tldata)
                 self.delete_link(link)
 
         self.logger.info('checking snapshots...')
-        for snapshot in self._snapshots.values():
+        for snapshot in self._snapshots.keys():
             if not self._valid_snapshot(snapshot, fail_on_disk_check=False):
                 self.logger.warning('deleting invalid snapshot [{0}]'.format(
                     self._snapshots[snapshot]['path']))
                 self.delete_snapshot(snapshot)
 
+    def verify_snapshots(self, cache, snapshots=None, processes=0, rehash=False):
+        """ checks the packages of the given snapshots (default: all) against their repository metadata
+
+                checksums are looked up in and added to <cache> (a hashcache.HashCache), files are
+                hashed by <processes> worker processes. prints the problems found and returns the
+                names of the snapshots that failed.
+        """
+
+        if not snapshots:
+            snapshots = sorted(self._snapshots.keys(), key=lambda s: self._snapshots[s]['created'])
+        for snapshot in snapshots:
+            self._valid_snapshot(snapshot)
+
+        verifier = verify.SnapshotVerifier(cache, processes=processes, rehash=rehash, logger=self.logger)
+        failed = []
+        for snapshot in snapshots:
+            self.logger.info('verifying snapshot [{0}]'.format(snapshot))
+            paths = None
+            m = self.get_manifest(snapshot)
+            if m is not None:
+                with m:
+                    paths = [e.path for e in m if e.path.endswith(repodata.REPOMD)]
+
+            result = verifier.verify(snapshot, self._snapshots[snapshot]['path'], paths)
+            self.logger.info('snapshot [{0}]: {1}'.format(snapshot, result))
+            if result.repositories == 0:
+                self.logger.warning('no repositories found in snapshot [{0}]'.format(snapshot))
+
+            for status, path, detail in result.problems:
+                print("{0:<20} {1:<10} {2}{3}".format(snapshot, status, path, ' ({0})'.format(detail) if detail else ''))
+            if not result.ok:
+                failed.append(snapshot)
+
+        return failed
+
     def _get_latest_snapshot(self):
         """ helper method to return the latest snapshot """
 
@@ -0,0 +1,110 @@
+#!/usr/bin/env python2
+from __future__ import print_function
+
+# publishing the repodata of the upstream repository instead of generating it with createrepo
+#
+# the upstream repodata/ is downloaded into a staging directory next to the repo, every package
+# listed in it is checked against the local copy (size and checksum, with the hash cache), and only
+# then the staged repodata replaces the published one. updateinfo, modules.yaml and everything else
+# upstream publishes is kept as it is.
+
+import os
+import shutil
+import urlparse
+
+import repodata
+import downloader
+
+STAGING_DIR_NAME = '.repodata.upstream'
+
+
+class MetadataMismatch(Exception):
+    """ the local packages don't match the upstream metadata """
+    pass
+
+
+def fetch_repodata(dl, url, staging):
+    """ downloads the repomd.xml at <url> and all files it lists into <staging>/repodata,
+        verifying their checksums
+    """
+
+    if os.path.isdir(staging):
+        shutil.rmtree(staging)
+    url = url.rstrip('/') + '/'
+    dl.fetch(urlparse.urljoin(url, repodata.REPOMD), os.path.join(staging, repodata.REPOMD))
+    for kind, location, checksum_type, checksum in repodata.iter_repomd(staging):
+        location = os.path.normpath(location)
+        if not location.startswith('repodata' + os.sep):
+            raise MetadataMismatch('metadata file outside of repodata/ [{0}]'.format(location))
+        dl.fetch(urlparse.urljoin(url, location), os.path.join(staging, location), checksum_type, checksum)
+
+
+def check_packages(staging, path, cache):
+    """ checks that every package of the staged metadata exists below <path> with the listed size
+        and checksum; returns the number of packages, raises MetadataMismatch otherwise
+    """
+
+    count = 0
+    for p in repodata.iter_packages(staging):
+        local = os.path.join(path, p.location)
+        try:
+            st = os.stat(local)
+        except OSError:
+            raise MetadataMismatch('package missing [{0}]'.format(p.location))
+        if p.size is not None and st.st_size != p.size:
+            raise MetadataMismatch('package size differs [{0}]'.format(p.location))
+        algorithm = repodata.CHECKSUM_TYPES.get(p.checksum_type, p.checksum_type)
+        if cache.digest(local, st, algorithm) != p.checksum:
+            raise MetadataMismatch('package checksum differs [{0}]'.format(p.location))
+        count += 1
+    cache.commit()
+    return count
+
+
+def publish(staging, path):
+    """ replaces the repodata/ of <path> with the staged one """
+
+    current = os.path.join(path, 'repodata')
+    old = os.path.join(path, STAGING_DIR_NAME + '.old')
+    if os.path.isdir(old):
+        shutil.rmtree(old)
+    if os.path.isdir(current):
+        os.rename(current, old)
+    os.rename(os.path.join(staging, 'repodata'), current)
+    shutil.rmtree(staging)
+    if os.path.isdir(old):
+        shutil.rmtree(old)
+
+
+def sync_repodata(url, path, cache, sslcacert=None, sslcert=None, sslkey=None, log=None):
+    """ publishes the upstream repodata of the repo at <url> in the local copy at <path>
+
+            returns the number of packages, or None if the published repodata is already the
+            upstream one. raises MetadataMismatch if the local packages don't match it, in which
+            case the published repodata is left alone
+    """
+
+    staging = os.path.join(path, STAGING_DIR_NAME)
+    try:
+        dl = downloader.Downloader(sslcacert, sslcert, sslkey)
+        try:
+            fetch_repodata(dl, url, staging)
+        finally:
+            dl.close()
+
+        current = os.path.join(path, repodata.REPOMD)
+        if os.path.exists(current):
+            with open(current, 'rb') as a, open(os.path.join(staging, repodata.REPOMD), 'rb') as b:
+                if a.read() == b.read():
+                    shutil.rmtree(staging)
+                    return None
+
+        count = check_packages(staging, path, cache)
+        if log is not None:
+            log.write('{0} packages match the upstream metadata\n'.format(count))
+        publish(staging, path)
+        return count
+    except Exception:
+        if os.path.isdir(staging):
+            shutil.rmtree(staging)
+        raise
@@ -8,12 +8,27 @@ import os
 import re
 import ConfigParser
 import getpass
-import OpenSSL
 import datetime
 import glob
 import fnmatch
 import logging
 import tempfile
+import time
+import json
+import hashlib
+import urlparse
+from collections import namedtuple
+
+import dedup
+import locking
+import scheduler
+import syncstate
+import downloader
+import repodata
+import pkgindex
+import hashcache
+import upstream_repodata
+import mkrepodata
 
 logging.basicConfig()
 logger = logging.getLogger('repoman.upstream_sync')
@@ -67,6 +82,8 @@ def build_yum_config(f, name, url, sslcacert, sslcert, sslkey, exclude, includep
 
 def check_sslcert_expiration(sslcert):
     """checks to see if the ssl cert is going to expire soon"""
+    # imported here, pyOpenSSL takes longer to import than most commands take to run
+    import OpenSSL
     try:
         cert = OpenSSL.crypto.load_certificate(
             OpenSSL.crypto.FILETYPE_PEM, file(sslcert).read())
@@ -130,11 +147,9 @@ def filter_repos(repos, config):
     return res
 
 
-def config_repos(config, args):
+def read_repos(config):
     """
-    parse configuration files and return repos.
-
-    if rfilter is set, only repos that match rfilter will be returned
+    parse configuration files and return all repos.
     """
 
     defaults = {
@@ -154,6 +169,8 @@ def config_repos(config, args):
         repo = dict(repoconfig.items(title))
         if 'createrepo' in repo:
             repo['createrepo'] = repoconfig.getboolean(title, 'createrepo')
+        if 'newest_only' in repo:
+            repo['newest_only'] = repoconfig.getboolean(title, 'newest_only')
         repo['name'] = title
         repo['path'] = os.path.join(config.get('repoman', 'mirror_root'), repo[
                                     'path'])  # absolute path of repository
@@ -161,9 +178,25 @@ def config_repos(config, args):
             repo['auth'] = auths[repo['auth']]
         repos.append(repo)
 
-    repos = sorted(repos, key=lambda k: k['name'])
+    return sorted(repos, key=lambda k: k['name'])
+
+
+def repo_lock_paths(config, path):
+    """
+    return the lock files of all repos which are inside path or contain it
+    """
+    lock_dir = config.get('repoman', 'lock_dir')
+    return [locking.repo_lock_path(lock_dir, repo['name']) for repo in read_repos(config)
+            if locking.overlaps(repo['path'], path)]
 
-    return filter_repos(repos, args)
+
+def config_repos(config, args):
+    """
+    parse configuration files and return repos.
+
+    if rfilter is set, only repos that match rfilter will be returned
+    """
+    return filter_repos(read_repos(config), args)
 
 
 def sync_cmd_reposync(repo, keep_deleted, newest_only, verbose):
@@ -284,6 +317,102 @@ def sync_cmd_dnf(repo, keep_deleted, newest_only, verbose):
     return sync_cmd
 
 
+class NativeSync(object):
+    """
+    sync of a repo by the built-in downloader (see the downloader module), run in
+    place of a sync command
+    """
+
+    def __init__(self, repo, work_dir, workers, keep_deleted, newest_only, partial_dir=None,
+                 chunk_size=0, chunk_workers=4):
+        self.repo = repo
+        self.url = re.sub('^native::', '', repo['url'])
+        self.path = os.path.abspath(repo['path'])
+        self.work_dir = work_dir
+        self.workers = workers
+        self.partial_dir = partial_dir
+        self.chunk_size = chunk_size
+        self.chunk_workers = chunk_workers
+        self.keep_deleted = keep_deleted
+        self.newest_only = newest_only
+
+    def __call__(self, log):
+        """
+        run the sync with its progress going to the file object log, return an
+        exit code like the sync commands
+        """
+        repo = self.repo
+        auth = repo.get('auth') or {}
+        globs = lambda key: [g.strip() for g in repo.get(key, '').split(',') if g.strip()]
+        if auth.get('sslcert'):
+            check_sslcert_expiration(auth['sslcert'])
+        try:
+            stats = downloader.sync_repo(
+                self.url, self.path, self.work_dir, auth.get('sslcacert'), auth.get('sslcert'),
+                auth.get('sslkey'), workers=self.workers, delete=not self.keep_deleted,
+                newest_only=self.newest_only, exclude=globs('exclude'),
+                includepkgs=globs('includepkgs'), partial_dir=self.partial_dir,
+                chunk_size=self.chunk_size, chunk_workers=self.chunk_workers, log=log)
+        except Exception as e:
+            log.write('sync failed: {0}\n'.format(e))
+            return 1
+        log.write('{0}\n'.format(stats))
+        return 1 if stats.failed else 0
+
+    def __str__(self):
+        return 'native sync {0} -> {1}'.format(self.url, self.path)
+
+
+def sync_cmd_native(config, repo, keep_deleted, newest_only):
+    work_dir = os.path.join(config.get('repoman', 'tmp_dir'), 'native', repo['name'])
+    # partial downloads are kept per repo, outside of the work dir which every sync empties
+    partial_dir = os.path.join(config.get('repoman', 'native_partial_dir'), repo['name'])
+    return NativeSync(repo, work_dir, config.getint('repoman', 'native_workers'), keep_deleted, newest_only,
+                      partial_dir, config.getint('repoman', 'native_chunk_mb') * 1024 * 1024,
+                      config.getint('repoman', 'native_chunk_workers'))
+
+
+class BuiltinMetadata(object):
+    """
+    metadata generation by the built-in generator (see the mkrepodata module),
+    run in place of createrepo. packages may be set to the list of packages of
+    the repo, so it doesn't walk the repo again, and hash_cache to the hash
+    cache shared by the sync
+    """
+    def __init__(self, generator, path):
+        self.generator = generator
+        self.path = path
+        self.packages = None
+        self.hash_cache = None
+
+    def __call__(self, log):
+        """
+        generate the metadata with its progress going to the file object log,
+        return an exit code like createrepo
+        """
+        # like createrepo -g, the group file of the sync goes into the metadata
+        comps_file = os.path.join(self.path, 'comps.xml')
+        try:
+            self.generator.generate(self.path, self.packages,
+                                    comps_file if os.path.isfile(comps_file) else None, log=log,
+                                    hash_cache=self.hash_cache)
+        except Exception as e:
+            log.write('metadata generation failed: {0}\n'.format(e))
+            return 1
+        return 0
+
+    def __str__(self):
+        return 'built-in createrepo {0}'.format(self.path)
+
+
+def createrepo_builtin(config, path, createrepo_cache):
+    generator = mkrepodata.MetadataGenerator(os.path.join(createrepo_cache, mkrepodata.CACHE_NAME),
+                                             config.get('repoman', 'hash_cache'),
+                                             workers=config.getint('repoman', 'metadata_workers'),
+                                             logger=logger)
+    return BuiltinMetadata(generator, path)
+
+
 def sync_cmd_rhnget(repo):
     systemid = os.path.join(os.path.split(repo['path'])[0], 'systemid')
     if not os.path.isfile(systemid):
@@ -376,114 +505,560 @@ def list_repos(config, args):
         print("{0:<25} {1:<25} {2:35}".format(repo["name"], synced, repo["url"]))
 
 
-def sync_repos(config, args):
-    if args.verbose:
-        logger.setLevel(level=logging.DEBUG)
+SyncResult = namedtuple('SyncResult', ['name', 'host', 'status', 'download_time', 'metadata_time', 'log'])
+
+
+def upstream_host(url):
+    """
+    return the upstream host of a repo url, syncs against the same host are
+    limited by sync_jobs_per_host
+    """
+    url = re.sub('^(dnf|native)::', '', url)
+    return urlparse.urlparse(url).hostname or url.split(':', 1)[0]
+
+
+def host_limits(config, jobs_per_host):
+    """
+    return a function mapping an upstream host to the number of concurrent syncs
+    against it: jobs_per_host, unless sync_host_jobs sets a limit for the host
+    (e.g. 'cdn.redhat.com=2 mirror.example.com=8')
+    """
+    limits = {}
+    for item in config.get('repoman', 'sync_host_jobs').replace(',', ' ').split():
+        host, sep, value = item.partition('=')
+        try:
+            limits[host.strip()] = int(value)
+        except ValueError:
+            raise Exception('invalid sync_host_jobs item [{0}], expected host=jobs'.format(item))
+    return lambda host: limits.get(host, jobs_per_host)
+
+
+def createrepo_cache_dir(config, repo):
+    """
+    return the createrepo cache directory of a repo
+    """
+    createrepo_cache_root = config.get('repoman', 'createrepo_cache_root')
+    if config.getboolean('repoman', 'createrepo_cache_shared'):
+        # one cache for all repos, a package in several repos is hashed once
+        createrepo_cache = os.path.join(
+            createrepo_cache_root.strip() or config.get('repoman', 'mirror_root'), '.repoman-createrepo.cache')
+    elif len(createrepo_cache_root.strip()) > 0:
+        createrepo_cache = os.path.join(
+            createrepo_cache_root, repo['name'] + '.cache')
     else:
-        logger.setLevel(level=logging.WARNING)
+        createrepo_cache = os.path.join(repo['path'], ".cache")
 
+    return os.path.abspath(createrepo_cache)
+
+
+def prepare_sync(config, repo, args):
+    """
+    build the sync and createrepo commands of a repo, return a sync job or
+    None if the repo can't be synced (or with --dry-run)
+    """
     createrepo_default = config.getboolean('repoman', 'createrepo_after_sync')
-    createrepo_cache_root = config.get('repoman', 'createrepo_cache_root')
     createrepo_exec = [config.get('repoman', 'createrepo_bin')]
     keep_deleted = config.getboolean('repoman', 'sync_keep_deleted')
-    newest_only = config.getboolean('repoman', 'newest_only')
-    tmp_dir = config.get('repoman', 'tmp_dir')
-
-    repos = config_repos(config, args)
-    for repo in repos:
-        # set variables based on values in config
-        url = repo['url']
-        name = repo['name']
-        createrepo = repo.get('createrepo', createrepo_default)
-        path = os.path.abspath(repo['path'])  # absolute path of repository
+    newest_only = repo.get('newest_only')
+    if newest_only is None:
+        # a repo publishing the upstream metadata mirrors every package, unless
+        # it sets newest_only itself
+        newest_only = (config.getboolean('repoman', 'newest_only')
+                       and repo.get('metadata', 'createrepo') != 'upstream')
+
+    # set variables based on values in config
+    url = repo['url']
+    name = repo['name']
+    createrepo = repo.get('createrepo', createrepo_default)
+    path = os.path.abspath(repo['path'])  # absolute path of repository
+
+    # create repo directory
+    make_dir(path, 0775)
+
+    createrepo_cache = createrepo_cache_dir(config, repo)
+
+    # Generate the sync and createrepo commands to be used based on
+    # repository type
+    createrepo_opts = ['--pretty', '--database',
+                       '--update', '--cachedir', createrepo_cache, path]
+    if not args.verbose:
+        createrepo_opts.append('-q')
+
+    # if comps.xml exists, use it to generate group data
+    comps_file = os.path.join(path, 'comps.xml')
+    if os.path.isfile(comps_file):
+        createrepo_opts = ['-g', comps_file] + createrepo_opts
+
+    metadata_backend = config.get('repoman', 'metadata_backend')
+    if metadata_backend == 'builtin':
+        createrepo_cmd = createrepo_builtin(config, path, createrepo_cache)
+    elif metadata_backend == 'createrepo':
+        createrepo_cmd = createrepo_exec + createrepo_opts
+    else:
+        raise Exception('invalid metadata_backend [{0}], expected createrepo or builtin'.format(metadata_backend))
+    tmpfile = None
+
+    native = config.get('repoman', 'sync_backend') == 'native'
+    if re.match('^native::(http|https)://', url) or (native and re.match('^(http|https)://', url)):
+        sync_cmd = sync_cmd_native(config, repo, keep_deleted, newest_only)
+    elif re.match('^(http|https|ftp)://', url):
+        tmpfile, sync_cmd = sync_cmd_reposync(repo, keep_deleted, newest_only, args.verbose)
+    elif re.match('^dnf::(http|https|ftp)://', url):
+        sync_cmd = sync_cmd_dnf(repo, keep_deleted, newest_only, args.verbose)
+    elif re.match('^rhns:///', url):
+        sync_cmd = sync_cmd_rhnget(repo)
+    elif re.match('^you://', url):
+        sync_cmd = sync_cmd_you(repo)
+    elif re.match('^rsync://', url):
+        sync_cmd = sync_cmd_rsync(repo, keep_deleted, args.verbose)
+    else:
+        logger.warn('url type unknown - %s' % url)
+        return None
 
-        # create repo directory
-        make_dir(path, 0775)
+    if not sync_cmd:
+        return None
 
-        if len(createrepo_cache_root.strip()) > 0:
-            createrepo_cache = os.path.join(
-                createrepo_cache_root, repo['name'] + '.cache')
+    if args.dry_run:
+        print("Would execute: ", sync_cmd if callable(sync_cmd) else " ".join(sync_cmd))
+        if createrepo:
+            print("Would execute: ", createrepo_cmd if callable(createrepo_cmd) else " ".join(createrepo_cmd))
+        if tmpfile:
+            tmpfile.close()
+        return None
+
+    # repos served over http(s)/ftp are only synced if their upstream repomd.xml
+    # changed since the last successful sync with the same settings
+    repomd_url = None
+    if (config.getboolean('repoman', 'sync_fast_path') and not getattr(args, 'force', False)
+            and re.match('^(dnf::|native::)?(http|https|ftp)://', url)):
+        repomd_url = syncstate.repomd_url(re.sub('^(dnf|native)::', '', url))
+    settings = json.dumps([repo, keep_deleted, newest_only, createrepo], sort_keys=True)
+
+    # plain mirrors of http(s) repos can publish the upstream repodata as it is,
+    # filtered ones need createrepo since their packages differ from upstream
+    upstream_metadata = None
+    metadata = repo.get('metadata', 'createrepo')
+    if metadata not in ('createrepo', 'upstream'):
+        raise Exception('invalid metadata mode [{0}] of repo {1}, expected createrepo or upstream'.format(
+            metadata, name))
+    if metadata == 'upstream':
+        if not re.match('^(dnf::|native::)?(http|https)://', url):
+            logger.warn('metadata = upstream needs an http(s) url, using createrepo: {0}'.format(name))
+        elif (repo.get('exclude') or repo.get('includepkgs') or keep_deleted
+              or (newest_only and not url.startswith('dnf::'))):  # dnf reposync ignores newest_only
+            logger.info('packages of {0} are filtered, using createrepo'.format(name))
         else:
-            createrepo_cache = os.path.join(repo['path'], ".cache")
+            upstream_metadata = re.sub('^(dnf|native)::', '', url)
+
+    return {
+        'name': name,
+        'path': path,
+        'host': upstream_host(url),
+        'sync_cmd': sync_cmd,
+        'createrepo_cmd': createrepo_cmd if createrepo else None,
+        'tmpfile': tmpfile,
+        # the sync commands pass credentials in the environment (RSYNC_PASSWORD),
+        # which has to be captured before the next repo is prepared
+        'env': dict(os.environ),
+        'repomd_url': repomd_url,
+        'auth': repo.get('auth') or {},
+        'settings': hashlib.sha1(settings).hexdigest(),
+        'state': syncstate.SyncState(os.path.join(config.get('repoman', 'sync_state_dir'), name + '.json')),
+        'upstream_metadata': upstream_metadata,
+    }
 
-        createrepo_cache = os.path.abspath(createrepo_cache)
 
-        # Generate the sync and createrepo commands to be used based on
-        # repository type
-        createrepo_opts = ['--pretty', '--database',
-                           '--update', '--cachedir', createrepo_cache, path]
-        if not args.verbose:
-            createrepo_opts.append('-q')
+def _run_logged(job, cmd, mode):
+    """
+    run a command of a sync job with its output going to the log file of the
+    repo, return the exit code. the command may also be a function taking the
+    log file (the built-in downloader)
+    """
+    with open(job['log'], mode) as fh:
+        if callable(cmd):
+            return cmd(fh)
+        p = subprocess.Popen(cmd, stdout=fh, stderr=subprocess.STDOUT,
+                             stdin=subprocess.PIPE, env=job['env'])
+        p.communicate()
+    return p.returncode
 
-        # if comps.xml exists, use it to generate group data
-        comps_file = os.path.join(path, 'comps.xml')
-        if os.path.isfile(comps_file):
-            createrepo_opts = ['-g', comps_file] + createrepo_opts
 
-        createrepo_cmd = createrepo_exec + createrepo_opts
-        tmpfile = None
-
-        if re.match('^(http|https|ftp)://', url):
-            tmpfile, sync_cmd = sync_cmd_reposync(repo, keep_deleted, newest_only, args.verbose)
-        elif re.match('^dnf::(http|https|ftp)://', url):
-            sync_cmd = sync_cmd_dnf(repo, keep_deleted, newest_only, args.verbose)
-        elif re.match('^rhns:///', url):
-            sync_cmd = sync_cmd_rhnget(repo)
-        elif re.match('^you://', url):
-            sync_cmd = sync_cmd_you(repo)
-        elif re.match('^rsync://', url):
-            sync_cmd = sync_cmd_rsync(repo, keep_deleted, args.verbose)
-        else:
-            logger.warn('url type unknown - %s' % url)
-            continue
+def _upstream_unchanged(job):
+    """
+    check the upstream repomd.xml of a repo against the one recorded at its last
+    successful sync; the fingerprint is kept in the job to be recorded once this
+    sync succeeds
+    """
+    if not job['repomd_url']:
+        return False
 
-        if not sync_cmd:
-            continue
+    state = job['state']
+    known = state.fingerprint()
+    if state.get('settings') != job['settings'] or not os.path.exists(os.path.join(job['path'], 'SYNC_TIMESTAMP')):
+        known = None  # the local copy doesn't match what was recorded, sync regardless
 
-        if args.dry_run:
-            print("Would execute: ", " ".join(sync_cmd))
-            if createrepo:
-                print("Would execute: ", " ".join(createrepo_cmd))
-            continue
+    auth = job['auth']
+    try:
+        job['fingerprint'] = syncstate.fetch_fingerprint(
+            job['repomd_url'], known, auth.get('sslcacert'), auth.get('sslcert'), auth.get('sslkey'))
+    except Exception as e:
+        logger.info('checking upstream of {0} failed, syncing: {1}'.format(job['name'], e))
+        return False
+    return known is not None and job['fingerprint'].checksum == known.checksum
 
-        # preform sync - rhnget/rsync
-        logger.info('syncing %s' % name)
-        if args.verbose:
-            stdout_pipe = sys.stdout
-            stderr_pipe = sys.stderr
-        else:
-            stdout_pipe = subprocess.PIPE
-            stderr_pipe = subprocess.STDOUT
 
-        p1 = subprocess.Popen(sync_cmd, stdout=stdout_pipe,
-                              stderr=stderr_pipe, stdin=subprocess.PIPE)
-        p1_rc = p1.wait()
-        if tmpfile:
-            tmpfile.close()
-        stdout, _ = p1.communicate()
+def _sync_result(job, status):
+    if status not in ('ok', 'downloaded', 'unchanged'):
+        logger.warn('{0}: {1}, see [{2}]'.format(status, job['name'], job['log']))
+    return SyncResult(job['name'], job['host'], status, job.get('download_time'),
+                      job.get('metadata_time'), job['log'])
 
-        # display output if the sync fails
-        if p1_rc > 0:
-            if not args.verbose:
-                logger.warn(stdout)
-            logger.warn('sync failed: %s' % name)
-            continue  # no need to run createrepo if sync failed
 
-        # run createrepo to generate package metadata
-        update_stamp = True
-        if createrepo:
-            logger.info('generating package metadata: {0}'.format(name))
+def _finish_sync(job, status):
+    """
+    end the sync of a repo: stamp it and record the upstream fingerprint if all
+    stages succeeded, release its lock
+    """
+    try:
+        if status in ('ok', 'unchanged') and os.path.isdir(job['path']):
+            subprocess.call(["touch", os.path.join(job['path'], "SYNC_TIMESTAMP")])
+        if status == 'unchanged':
+            job['state'].save(checked=time.time())
+        elif status == 'ok' and job.get('fingerprint'):
+            fingerprint = job['fingerprint']
+            job['state'].save(checksum=fingerprint.checksum, etag=fingerprint.etag,
+                              last_modified=fingerprint.last_modified, settings=job['settings'],
+                              synced=time.time(), checked=time.time())
+        elif status != 'ok' and job['state'].fingerprint():
+            # a failed sync may have changed the local copy half-way
+            job['state'].save(checksum=None)
+    finally:
+        job['lock'].release()
+    return _sync_result(job, status)
+
+
+def scan_packages(path):
+    """
+    return a dict of relative path -> (size, mtime) of the packages of a repo,
+    plus the checksum of its comps.xml (which sync tools rewrite every time)
+    """
+    files = {}
+    for root, dirs, names in os.walk(path):
+        dirs[:] = [d for d in dirs if d not in ('repodata', '.cache')]
+        for f in names:
+            if f.endswith('.rpm'):
+                try:
+                    st = os.lstat(os.path.join(root, f))
+                except OSError:
+                    continue
+                files[os.path.relpath(os.path.join(root, f), path)] = (st.st_size, st.st_mtime)
+    comps = os.path.join(path, 'comps.xml')
+    if os.path.isfile(comps):
+        with open(comps, 'rb') as fh:
+            files['comps.xml'] = hashlib.sha1(fh.read()).hexdigest()
+    return files
+
+
+def download_stage(job):
+    """
+    first stage of a sync: lock the repo and download it
+
+    the repo stays locked until the metadata stage is done as well, so other
+    syncs of the repo and snapshots reading it wait for both
+    """
+    name = job['name']
+    job['lock'] = locking.FileLock(locking.repo_lock_path(job['lock_dir'], name), logger=logger)
+    job['lock'].acquire()
+    try:
+        started = time.time()
+        try:
+            if _upstream_unchanged(job):
+                logger.info('upstream unchanged, skipping sync: {0}'.format(name))
+                rc = None
+            else:
+                # the packages before and after the sync tell createrepo what changed
+                if job['createrepo_cmd'] and not job['upstream_metadata']:
+                    job['before'] = scan_packages(job['path'])
+                # preform sync - rhnget/rsync
+                logger.info('syncing %s' % name)
+                rc = _run_logged(job, job['sync_cmd'], 'w')
+                if rc == 0 and 'before' in job:
+                    job['after'] = scan_packages(job['path'])
+        finally:
+            if job['tmpfile']:
+                job['tmpfile'].close()
+            job['download_time'] = time.time() - started
+    except Exception:
+        job['lock'].release()
+        raise
+
+    if rc is None:
+        return _finish_sync(job, 'unchanged')
+    if rc > 0:
+        return _finish_sync(job, 'sync failed')  # no need to run createrepo if sync failed
+    if not job['createrepo_cmd'] and not job['upstream_metadata']:
+        return _finish_sync(job, 'ok')
+    return _sync_result(job, 'downloaded')
+
+
+def _createrepo_cmd(job):
+    """
+    return the createrepo command for the changes of the sync, or None if the
+    metadata is still up to date
+
+    createrepo gets the list of packages, so it doesn't walk the repo, and only
+    reads the new packages (--skip-stat) unless a package changed in place
+    """
+    before, after = job.get('before'), job.get('after')
+    if callable(job['createrepo_cmd']):
+        job['createrepo_cmd'].hash_cache = job.get('hash_cache')
+    if before is None or after is None:
+        return job['createrepo_cmd']
+
+    added = [p for p in after if p not in before]
+    removed = [p for p in before if p not in after]
+    changed = [p for p in after if p in before and after[p] != before[p]]
+    with open(job['log'], 'a') as fh:
+        fh.write('{0} packages added, {1} removed, {2} changed\n'.format(len(added), len(removed), len(changed)))
+
+    up_to_date = (os.path.exists(os.path.join(job['path'], repodata.REPOMD))
+                  and not job['state'].get('metadata_stale'))
+    if up_to_date and not (added or removed or changed):
+        return None
+
+    if callable(job['createrepo_cmd']):
+        # the built-in generator only reads packages it has no record of anyway
+        job['createrepo_cmd'].packages = sorted(p for p in after if p.endswith('.rpm'))
+        return job['createrepo_cmd']
+
+    pkglist = os.path.splitext(job['log'])[0] + '.pkglist'
+    with open(pkglist, 'w') as fh:
+        for p in sorted(after):
+            if p.endswith('.rpm'):
+                fh.write(p + '\n')
+    opts = ['--pkglist', pkglist]
+    if up_to_date and not changed and 'comps.xml' not in added:
+        opts.append('--skip-stat')
+    return job['createrepo_cmd'][:1] + opts + job['createrepo_cmd'][1:]
+
+
+def _publish_upstream_metadata(job):
+    """
+    publish the upstream repodata of a repo, return False if it doesn't match
+    the local packages and createrepo has to generate the metadata instead
+    """
+    auth = job['auth']
+    with open(job['log'], 'a') as fh:
+        try:
+            count = upstream_repodata.sync_repodata(
+                job['upstream_metadata'], job['path'], job['hash_cache'], auth.get('sslcacert'),
+                auth.get('sslcert'), auth.get('sslkey'), log=fh)
+        except Exception as e:
+            fh.write('upstream metadata not used: {0}\n'.format(e))
+            logger.warn('upstream metadata of {0} not used: {1}'.format(job['name'], e))
+            return False
+        if count is None:
+            fh.write('upstream metadata unchanged\n')
+    return True
+
+
+def metadata_stage(job):
+    """
+    second stage of a sync: publish the upstream metadata or run createrepo to
+    generate it, if the sync changed the packages
+    """
+    try:
+        if job['upstream_metadata']:
+            logger.info('publishing upstream metadata: {0}'.format(job['name']))
+            started = time.time()
+            published = _publish_upstream_metadata(job)
+            job['metadata_time'] = time.time() - started
+            if published:
+                job['state'].save(metadata_stale=False)
+                return _finish_sync(job, 'ok')
+            if not job['createrepo_cmd']:
+                job['state'].save(metadata_stale=True)
+                return _finish_sync(job, 'metadata failed')
+
+        cmd = _createrepo_cmd(job)
+        if cmd is None:
+            logger.info('packages unchanged, skipping createrepo: {0}'.format(job['name']))
+            return _finish_sync(job, 'ok')
+        logger.info('generating package metadata: {0}'.format(job['name']))
+        started = time.time()
+        try:
+            rc = _run_logged(job, cmd, 'a')
+        finally:
+            pkglist = os.path.splitext(job['log'])[0] + '.pkglist'
+            if os.path.exists(pkglist):
+                os.remove(pkglist)
+        job['metadata_time'] = time.time() - started
+        # until createrepo succeeds, the metadata doesn't match the packages
+        job['state'].save(metadata_stale=rc > 0)
+    except Exception:
+        job['lock'].release()
+        raise
+    return _finish_sync(job, 'createrepo failed' if rc > 0 else 'ok')
+
+
+def print_sync_results(results, elapsed):
+    def seconds(t):
+        return '-' if t is None else '{0:.1f}s'.format(t)
+
+    print("{0:<30} {1:<25} {2:>9} {3:>9}  {4}".format('REPO', 'HOST', 'DOWNLOAD', 'METADATA', 'STATUS'))
+    for r in results:
+        print("{0:<30} {1:<25} {2:>9} {3:>9}  {4}".format(
+            r.name, r.host, seconds(r.download_time), seconds(r.metadata_time), r.status))
+    failed = [r for r in results if r.status not in ('ok', 'unchanged')]
+    print("{0} repos in {1:.1f}s (download {2:.1f}s, metadata {3:.1f}s in total), {4} failed".format(
+        len(results), elapsed, sum(r.download_time or 0 for r in results),
+        sum(r.metadata_time or 0 for r in results), len(failed)))
+
+
+def sync_repos(config, args):
+    if args.verbose:
+        logger.setLevel(level=logging.DEBUG)
+    else:
+        logger.setLevel(level=logging.WARNING)
 
-            p2 = subprocess.Popen(
-                createrepo_cmd, stdout=stdout_pipe, stderr=stderr_pipe, stdin=subprocess.PIPE)
-            p2_rc = p2.wait()
-            stdout, _ = p2.communicate()
+    lock_dir = config.get('repoman', 'lock_dir')
+    log_dir = config.get('repoman', 'sync_log_dir')
+    jobs = getattr(args, 'jobs', None) or config.getint('repoman', 'sync_jobs')
+    jobs_per_host = getattr(args, 'jobs_per_host', None) or config.getint('repoman', 'sync_jobs_per_host')
+    createrepo_jobs = getattr(args, 'createrepo_jobs', None) or config.getint('repoman', 'createrepo_jobs')
+
+    sync_jobs = []
+    for repo in config_repos(config, args):
+        job = prepare_sync(config, repo, args)
+        if job:
+            # commands run concurrently, so their output goes to a log file per repo
+            job['lock_dir'] = lock_dir
+            job['log'] = os.path.join(log_dir, job['name'] + '.log')
+            sync_jobs.append(job)
+    if sync_jobs:
+        make_dir(log_dir)
+
+    # checksums of the packages checked against upstream metadata or read by the built-in generator
+    cache = None
+    if any(job['upstream_metadata'] or callable(job['createrepo_cmd']) for job in sync_jobs):
+        cache = hashcache.HashCache(config.get('repoman', 'hash_cache'))
+        for job in sync_jobs:
+            job['hash_cache'] = cache
+
+    # downloads (network-bound) and createrepo runs (cpu- and disk-bound) have pools of their
+    # own, a repo moves on to createrepo as soon as its download is done
+    started = time.time()
+    outcomes = scheduler.run_pipeline(
+        sync_jobs,
+        [scheduler.Stage(download_stage, workers=jobs,
+                         group=lambda job: job['host'], group_limit=host_limits(config, jobs_per_host)),
+         scheduler.Stage(metadata_stage, workers=createrepo_jobs)],
+        proceed=lambda job, result: getattr(result, 'status', None) == 'downloaded',
+        logger=logger)
+
+    results = []
+    for job, outcome in zip(sync_jobs, outcomes):
+        if isinstance(outcome, scheduler.JobFailed):
+            logger.error('sync failed: {0}: {1}'.format(job['name'], outcome))
+            outcome = SyncResult(job['name'], job['host'], 'error: {0}'.format(outcome),
+                                 job.get('download_time'), job.get('metadata_time'), job['log'])
+        results.append(outcome)
+
+    if cache is not None:
+        cache.close()
+
+    if results and (jobs > 1 or createrepo_jobs > 1 or args.verbose):
+        print_sync_results(results, time.time() - started)
+
+    # newly downloaded packages may exist in other repos already, the hash
+    # cache keeps this cheap for everything that was deduplicated before
+    if config.getboolean('repoman', 'dedup_after_sync') and not args.dry_run:
+        logger.info('deduplicating repositories')
+        stats = dedup_repos(config, args)
+        logger.info('deduplication done: {0}'.format(stats))
+
+
+def index_repos(config, args):
+    """
+    build (or refresh) the package index of each yum repository found in the
+    selected repos, in index_dir
+    """
+    index_dir = config.get('repoman', 'index_dir')
+    print("{0:<25} {1:<35} {2:>10} {3:>12}".format("REPO", "PATH", "PACKAGES", "INDEX_BYTES"))
+    for repo in config_repos(config, args):
+        if not os.path.isdir(repo['path']):
+            continue
+        for path in repodata.find_repositories(repo['path']):
+            rel = os.path.relpath(path, repo['path'])
+            index_path = os.path.normpath(os.path.join(index_dir, repo['name'], rel, 'packages.idx'))
+            try:
+                index = pkgindex.index_repository(path, index_path)
+            except Exception as e:
+                logger.error('indexing {0} failed: {1}'.format(path, e))
+                continue
+            print("{0:<25} {1:<35} {2:>10} {3:>12}".format(repo['name'], rel, len(index), index.memory_size()))
+
+
+def prune_hash_cache(config, args):
+    """
+    remove the checksums of files which no longer exist below mirror_root (and
+    timeline_root with --timelines) from the hash cache
+    """
+    roots = [config.get('repoman', 'mirror_root')]
+    if getattr(args, 'timelines', False):
+        roots.append(config.get('repoman', 'timeline_root'))
+    with hashcache.HashCache(config.get('repoman', 'hash_cache')) as cache:
+        removed = cache.prune(roots)
+    prune_record_caches(config, roots)
+    return removed
 
-            if p2_rc > 0:
-                if not args.verbose:
-                    logger.warn(stdout)
-                logger.warn('createrepo failed: %s' % name)
-                update_stamp = False
 
-        if update_stamp and os.path.isdir(path):
-            subprocess.call(["touch", os.path.join(path, "SYNC_TIMESTAMP")])
+def prune_record_caches(config, roots):
+    """
+    remove the records of packages which no longer exist below roots from the
+    record caches of the built-in metadata generator
+    """
+    cache_paths = set(os.path.join(createrepo_cache_dir(config, repo), mkrepodata.CACHE_NAME)
+                      for repo in read_repos(config))
+    for path in sorted(cache_paths):
+        if not os.path.isfile(path):
+            continue
+        with mkrepodata.RecordCache(path) as cache:
+            removed = cache.prune(roots)
+        logger.info('removed {0} package records from {1}'.format(removed, path))
+
+
+def prune_createrepo_caches(config):
+    """
+    remove the entries of the createrepo caches which were not used (read or
+    written) for createrepo_cache_max_age days, return the number removed;
+    the record caches of the built-in generator are pruned by prune_hash_cache
+    """
+    limit = time.time() - config.getint('repoman', 'createrepo_cache_max_age') * 24 * 3600
+    removed = 0
+    for cache_dir in sorted(set(createrepo_cache_dir(config, repo) for repo in read_repos(config))):
+        if not os.path.isdir(cache_dir):
+            continue
+        for dirpath, dirs, files in os.walk(cache_dir):
+            for f in files:
+                if f.startswith(mkrepodata.CACHE_NAME):
+                    continue
+                path = os.path.join(dirpath, f)
+                try:
+                    st = os.lstat(path)
+                    if max(st.st_atime, st.st_mtime) < limit:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    continue
+        logger.info('pruned createrepo cache {0}'.format(cache_dir))
+    return removed
+
+
+def dedup_repos(config, args):
+    """
+    deduplicate the files of all repos (not only the selected ones, since
+    duplicates are found across repos)
+    """
+    return dedup.dedup_repos(config, read_repos(config), workers=getattr(args, 'workers', 0),
+                             min_size=getattr(args, 'min_size', 1), dry_run=args.dry_run, logger=logger)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python2
+from __future__ import print_function
+
+# disk usage accounting of the snapshots of a timeline
+#
+# all snapshots of a timeline hard-link the same files, so 'du' tells little about what a single
+# snapshot costs. this keeps a reference count per inode over the snapshots of a timeline, built
+# from the snapshot manifests: an inode referenced by a single snapshot is unique to it, all other
+# inodes are shared. the counts are updated incrementally as snapshots are added and removed.
+
+import os
+import sqlite3
+
+import manifest
+
+
+class UsageCache(object):
+    """ per-inode reference counts over the snapshots of a timeline, kept in a sqlite file
+
+            the inodes table holds every file inode of the accounted snapshots with its size and the
+            number of snapshots referencing it. for inodes referenced by one snapshot only, the
+            owning snapshot and a path to the inode in it are kept as well.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS snapshots (name TEXT PRIMARY KEY, manifest TEXT NOT NULL, '
+                         'total INTEGER NOT NULL, unique_bytes INTEGER NOT NULL)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS inodes (ino INTEGER PRIMARY KEY, size INTEGER NOT NULL, '
+                         'refs INTEGER NOT NULL, owner TEXT, path TEXT, links INTEGER)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS inodes_owner ON inodes (owner)')
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def snapshots(self):
+        """ returns a dict of accounted snapshot -> (manifest path, total bytes, unique bytes) """
+
+        return dict((r[0], tuple(r[1:])) for r in
+                    self._db.execute('SELECT name, manifest, total, unique_bytes FROM snapshots'))
+
+    def update(self, snapshots):
+        """ brings the counts in line with the given dict of snapshot -> manifest path
+
+                new snapshots are added and snapshots no longer present are removed. if the manifest
+                of a removed snapshot is gone, the counts are rebuilt from the remaining manifests.
+
+                returns the number of snapshots added or removed
+        """
+
+        accounted = self.snapshots()
+        removed = [s for s in accounted if s not in snapshots]
+        added = [s for s in sorted(snapshots) if s not in accounted]
+
+        if any(not os.path.exists(accounted[s][0]) for s in removed):
+            self.clear()
+            removed = []
+            added = sorted(snapshots)
+
+        for s in removed:
+            self.remove_snapshot(s)
+        for s in added:
+            self.add_snapshot(s, snapshots[s])
+        return len(removed) + len(added)
+
+    def clear(self):
+        with self._db:
+            self._db.execute('DELETE FROM snapshots')
+            self._db.execute('DELETE FROM inodes')
+
+    def _file_inodes(self, manifest_path):
+        """ returns a dict of inode -> [size, first path, number of paths] of the files of a manifest """
+
+        inodes = {}
+        with manifest.Manifest(manifest_path) as m:
+            for e in m:
+                if e.type != manifest.FILE:
+                    continue
+                i = inodes.get(e.inode)
+                if i is None:
+                    inodes[e.inode] = [e.size, e.path, 1]
+                else:
+                    i[2] += 1
+        return inodes
+
+    def _load_temp(self, inodes):
+        # the inodes of one snapshot, so they can be joined against the counts
+        self._db.execute('CREATE TEMP TABLE IF NOT EXISTS snapshot_inodes (ino INTEGER PRIMARY KEY, '
+                         'size INTEGER, path TEXT, links INTEGER)')
+        self._db.execute('DELETE FROM snapshot_inodes')
+        self._db.executemany('INSERT INTO snapshot_inodes (ino, size, path, links) VALUES (?, ?, ?, ?)',
+                             ((ino, v[0], v[1], v[2]) for ino, v in inodes.iteritems()))
+
+    def add_snapshot(self, snapshot, manifest_path):
+        """ accounts a new snapshot """
+
+        inodes = self._file_inodes(manifest_path)
+        total = sum(v[0] for v in inodes.itervalues())
+
+        with self._db:
+            db = self._db
+            self._load_temp(inodes)
+
+            # unique files of other snapshots which the new one links as well become shared
+            for owner, nbytes in db.execute(
+                    'SELECT i.owner, SUM(i.size) FROM inodes i JOIN snapshot_inodes n ON i.ino = n.ino '
+                    'WHERE i.refs = 1 GROUP BY i.owner').fetchall():
+                db.execute('UPDATE snapshots SET unique_bytes = unique_bytes - ? WHERE name = ?', (nbytes, owner))
+            db.execute('UPDATE inodes SET refs = refs + 1, owner = NULL, path = NULL, links = NULL '
+                       'WHERE ino IN (SELECT ino FROM snapshot_inodes)')
+
+            # the rest is unique to the new snapshot
+            unique = db.execute('SELECT COALESCE(SUM(size), 0) FROM snapshot_inodes '
+                                'WHERE ino NOT IN (SELECT ino FROM inodes)').fetchone()[0]
+            db.execute('INSERT INTO inodes (ino, size, refs, owner, path, links) '
+                       'SELECT ino, size, 1, ?, path, links FROM snapshot_inodes '
+                       'WHERE ino NOT IN (SELECT ino FROM inodes)', (snapshot,))
+
+            db.execute('INSERT OR REPLACE INTO snapshots (name, manifest, total, unique_bytes) VALUES (?, ?, ?, ?)',
+                       (snapshot, manifest_path, total, unique))
+            db.execute('DELETE FROM snapshot_inodes')
+
+    def remove_snapshot(self, snapshot):
+        """ removes a snapshot from the counts, its manifest must still exist """
+
+        accounted = self.snapshots()
+        if snapshot not in accounted:
+            return
+        inodes = self._file_inodes(accounted[snapshot][0])
+        others = [(s, v[0]) for s, v in accounted.items() if s != snapshot]
+
+        with self._db:
+            db = self._db
+            self._load_temp(inodes)
+
+            db.execute('DELETE FROM inodes WHERE refs <= 1 AND ino IN (SELECT ino FROM snapshot_inodes)')
+            orphans = dict((r[0], (r[1], r[2])) for r in db.execute(
+                'SELECT i.ino, i.size, n.path FROM inodes i JOIN snapshot_inodes n ON i.ino = n.ino '
+                'WHERE i.refs = 2').fetchall())
+            db.execute('UPDATE inodes SET refs = refs - 1 WHERE ino IN (SELECT ino FROM snapshot_inodes)')
+            db.execute('DELETE FROM snapshots WHERE name = ?', (snapshot,))
+            db.execute('DELETE FROM snapshot_inodes')
+
+            # inodes now referenced by one snapshot only become unique to it
+            for owner, ino, path, links in self._find_owners(orphans, others):
+                db.execute('UPDATE inodes SET owner = ?, path = ?, links = ? WHERE ino = ?', (owner, path, links, ino))
+                db.execute('UPDATE snapshots SET unique_bytes = unique_bytes + ? WHERE name = ?',
+                           (orphans[ino][0], owner))
+
+    def _find_owners(self, orphans, others):
+        """ yields (snapshot, inode, path, number of paths) for each of the orphaned inodes, searching the
+            given manifests
+
+                snapshots keep the paths of the files they link, so the inode is first looked up under
+                its old path; only inodes which are not found that way need a full manifest scan. the
+                manifest of each owner is then read once more to count its paths to the inodes it owns.
+        """
+
+        missing = dict(orphans)
+        owned = {}
+        manifests = []
+        try:
+            for s, p in others:
+                manifests.append((s, manifest.Manifest(p)))
+
+            for ino, (size, path) in orphans.items():
+                for s, m in manifests:
+                    e = m.get(path)
+                    if e is not None and e.inode == ino:
+                        del missing[ino]
+                        owned.setdefault(s, {})[ino] = path
+                        break
+
+            for s, m in manifests:
+                if not missing:
+                    break
+                for e in m:
+                    if e.type == manifest.FILE and e.inode in missing:
+                        del missing[e.inode]
+                        owned.setdefault(s, {})[e.inode] = e.path
+
+            for s, m in manifests:
+                if s not in owned:
+                    continue
+                links = dict.fromkeys(owned[s], 0)
+                for e in m:
+                    if e.type == manifest.FILE and e.inode in links:
+                        links[e.inode] += 1
+                for ino, path in owned[s].iteritems():
+                    yield s, ino, path, links[ino]
+        finally:
+            for s, m in manifests:
+                m.close()
+
+    def freeable(self, snapshot, snapshot_path):
+        """ returns the bytes deleting the snapshot would actually free: its unique files which are not
+            linked from anywhere else either (the source directory, other timelines, ...)
+        """
+
+        freed = 0
+        for ino, size, path, links in self._db.execute(
+                'SELECT ino, size, path, links FROM inodes WHERE owner = ?', (snapshot,)):
+            try:
+                st = os.lstat(os.path.join(snapshot_path, path))
+            except OSError:
+                continue
+            if st.st_ino == ino and st.st_nlink <= links:
+                freed += size
+        return freed
+
+    def timeline_bytes(self):
+        """ returns the bytes of all distinct files referenced by the accounted snapshots """
+
+        return self._db.execute('SELECT COALESCE(SUM(size), 0) FROM inodes').fetchone()[0]
+
+
+def format_bytes(n):
+    """ formats a byte count for humans, e.g. 1.5G """
+
+    for unit in ('', 'K', 'M', 'G', 'T'):
+        if abs(n) < 1024 or unit == 'T':
+            break
+        n /= 1024.0
+    if unit == '':
+        return '{0}'.format(n)
+    return '{0:.1f}{1}'.format(n, unit)
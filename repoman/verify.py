@@ -0,0 +1,161 @@
+#!/usr/bin/env python2
+from __future__ import print_function
+
+# integrity verification of snapshots against their repository metadata
+
+import os
+import errno
+import logging
+import multiprocessing
+
+import hashcache
+import repodata
+
+MISSING = 'missing'
+CORRUPT = 'corrupt'
+UNREADABLE = 'unreadable'
+UNKNOWN = 'unknown checksum type'
+INVALID = 'invalid metadata'
+
+
+def _hash_worker(task):
+    """ runs in a worker process: hashes one file, returns (index, digest, error) """
+
+    index, path, algorithm = task
+    try:
+        return index, hashcache.hash_file(path, algorithm, bufsize=8 * 1024 * 1024), None
+    except (IOError, OSError) as e:
+        return index, None, str(e)
+
+
+class VerifyResult(object):
+    """ outcome of verifying one snapshot """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.repositories = 0
+        self.packages = 0
+        self.hashed = 0
+        self.cached = 0
+        # list of (status, path, detail)
+        self.problems = []
+
+    @property
+    def ok(self):
+        return not self.problems
+
+    def __str__(self):
+        return '{0} repositories, {1} packages ({2} hashed, {3} cached), {4} problems'.format(
+            self.repositories, self.packages, self.hashed, self.cached, len(self.problems))
+
+
+class SnapshotVerifier(object):
+    """ checks every package of the repositories in a snapshot against the checksum in its primary metadata
+
+            files are first checked for existence and size, the remaining ones are hashed by a pool
+            of worker processes. checksums come from (and go to) the given HashCache, which is keyed
+            by inode: a package shared by many snapshots (or already hashed by repo-dedup) is only
+            read once. the cache is only written by this (the parent) process.
+
+            cached checksums can't detect corruption which left mtime and size alone (bad disks),
+            with <rehash> set every file is read again and the cache is refreshed.
+    """
+
+    def __init__(self, cache, processes=0, rehash=False, logger=None):
+        self.cache = cache
+        self.processes = processes or multiprocessing.cpu_count()
+        self.rehash = rehash
+        self.logger = logger or logging.getLogger('timeline.verify')
+
+    def verify(self, snapshot, path, paths=None):
+        """ verifies the snapshot at <path>, returns a VerifyResult
+
+                <paths> optionally lists all relative paths in the snapshot (see repodata.find_repositories)
+        """
+
+        result = VerifyResult(snapshot)
+        # files still to be hashed: (path, stat, algorithm, expected checksum)
+        todo = []
+        # (dev, ino, algorithm) -> index in todo, for files linked more than once in the snapshot
+        seen = {}
+        duplicates = []
+
+        for repo in repodata.find_repositories(path, paths):
+            result.repositories += 1
+            self.logger.debug('reading metadata of [{0}]'.format(repo))
+            try:
+                self._check_packages(repo, result, todo, seen, duplicates)
+            except Exception as e:
+                result.problems.append((INVALID, repo, str(e)))
+
+        digests = self._hash_all(todo, result)
+        for i, pkg_path, checksum in duplicates:
+            if digests[i] is not None:
+                result.cached += 1
+                self._check(result, pkg_path, digests[i], checksum)
+
+        return result
+
+    def _check_packages(self, repo, result, todo, seen, duplicates):
+        # checks what can be checked without reading the packages, queues the rest for hashing
+        for pkg in repodata.iter_packages(repo):
+            result.packages += 1
+            pkg_path = os.path.join(repo, pkg.location)
+            algorithm = repodata.CHECKSUM_TYPES.get(pkg.checksum_type)
+            if algorithm is None:
+                result.problems.append((UNKNOWN, pkg_path, pkg.checksum_type))
+                continue
+            try:
+                st = os.stat(pkg_path)
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    result.problems.append((MISSING, pkg_path, None))
+                else:
+                    result.problems.append((UNREADABLE, pkg_path, str(e)))
+                continue
+            if pkg.size is not None and st.st_size != pkg.size:
+                result.problems.append((CORRUPT, pkg_path, 'size {0} != {1}'.format(st.st_size, pkg.size)))
+                continue
+
+            digest = None if self.rehash else self.cache.lookup(st, algorithm)
+            if digest is not None:
+                result.cached += 1
+                self._check(result, pkg_path, digest, pkg.checksum)
+                continue
+
+            key = (st.st_dev, st.st_ino, algorithm)
+            if key in seen:
+                duplicates.append((seen[key], pkg_path, pkg.checksum))
+                continue
+            seen[key] = len(todo)
+            todo.append((pkg_path, st, algorithm, pkg.checksum))
+
+    def _hash_all(self, todo, result):
+        digests = [None] * len(todo)
+        if not todo:
+            return digests
+
+        self.logger.info('hashing [{0}] files with [{1}] processes'.format(len(todo), self.processes))
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            tasks = [(i, t[0], t[2]) for i, t in enumerate(todo)]
+            for i, digest, error in pool.imap_unordered(_hash_worker, tasks, chunksize=4):
+                pkg_path, st, algorithm, checksum = todo[i]
+                if error is not None:
+                    result.problems.append((UNREADABLE, pkg_path, error))
+                    continue
+                result.hashed += 1
+                digests[i] = digest
+                self.cache.store(st, digest, algorithm)
+                self._check(result, pkg_path, digest, checksum)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+            self.cache.commit()
+
+        return digests
+
+    def _check(self, result, path, digest, checksum):
+        if digest != checksum:
+            result.problems.append((CORRUPT, path, 'checksum {0} != {1}'.format(digest, checksum)))
@@ -0,0 +1,168 @@
+# shared setup of the unit tests: the repoman modules import each other as top level modules
+
+import os
+import re
+import sys
+import socket
+import shutil
+import hashlib
+import tempfile
+import unittest
+import threading
+import ConfigParser
+import SocketServer
+import BaseHTTPServer
+
+REPOMAN_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'repoman')
+if REPOMAN_DIR not in sys.path:
+    sys.path.insert(0, REPOMAN_DIR)
+
+
+class TempDirTestCase(unittest.TestCase):
+    """ a test with a temporary directory (self.tmp), removed afterwards """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='repoman-test.')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def make_config(self, **values):
+        """ returns the configuration of repoman with its defaults, rooted in self.tmp """
+
+        import repoman
+        config = ConfigParser.ConfigParser(repoman.CONFIG_DEFAULTS)
+        config.add_section('repoman')
+        settings = {
+            'mirror_root': os.path.join(self.tmp, 'mirror'),
+            'timeline_root': os.path.join(self.tmp, 'timelines'),
+            'repoconf_dir': os.path.join(self.tmp, 'repos.d'),
+            'tmp_dir': os.path.join(self.tmp, 'tmp'),
+        }
+        settings.update(values)
+        for key, value in settings.items():
+            config.set('repoman', key, value)
+        if not os.path.isdir(settings['repoconf_dir']):
+            os.makedirs(settings['repoconf_dir'])
+        return config
+
+    def write_file(self, path, data):
+        path = os.path.join(self.tmp, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as fh:
+            fh.write(data)
+        return path
+
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ serves the files below the www directory of the test, with an ETag and Last-Modified, and
+        ranges of them (Range, If-Range)
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_empty(self, status, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        test = self.server.test
+        test.requests.append((self.path, dict(self.headers.items())))
+        if test.before_response is not None:
+            test.before_response(self.path, dict(self.headers.items()))
+        path = os.path.join(test.www, self.path.lstrip('/'))
+        if not os.path.isfile(path):
+            return self.send_empty(404)
+
+        with open(path, 'rb') as fh:
+            data = fh.read()
+        headers = [('Last-Modified', self.date_time_string(int(os.path.getmtime(path))))]
+        if test.etags:
+            headers.append(('ETag', '"{0}"'.format(hashlib.sha1(data).hexdigest())))
+            if self.headers.get('if-none-match') == headers[-1][1]:
+                return self.send_empty(304, headers)
+
+        status, start, end = 200, 0, len(data) - 1
+        wanted = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('range') or '')
+        if_range = self.headers.get('if-range')
+        if wanted and test.ranges and (if_range is None or if_range in [v for n, v in headers]):
+            start = int(wanted.group(1))
+            end = min(int(wanted.group(2) or end), end)
+            if start >= len(data):
+                return self.send_empty(416, [('Content-Range', 'bytes */{0}'.format(len(data)))])
+            status = 206
+            headers.append(('Content-Range', 'bytes {0}-{1}/{2}'.format(start, end, len(data))))
+        body = data[start:end + 1]
+
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        with test.lock:
+            drop = test.drop.get(self.path, 0)
+            if drop:
+                test.drop[self.path] = drop - 1
+        if drop:
+            # the connection breaks half-way through the body
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = 1
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        self.wfile.write(body)
+
+
+class _HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients closing their connections are expected
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+
+class HTTPServerTestCase(TempDirTestCase):
+    """ a test with an http server on localhost (self.url) serving the files below self.www
+
+            the requests it received are kept in self.requests as (path, headers) with lowercase
+            header names. with etags set to False, no ETag is sent, with ranges set to False the
+            Range header is ignored. the next drop[path] responses of a path break off half-way, and
+            before_response(path, headers) is called before each request is answered.
+    """
+
+    etags = True
+    ranges = True
+    before_response = None
+
+    def setUp(self):
+        super(HTTPServerTestCase, self).setUp()
+        self.www = os.path.join(self.tmp, 'www')
+        os.makedirs(self.www)
+        self.requests = []
+        self.drop = {}
+        self.lock = threading.Lock()
+        self.server = _HTTPServer(('127.0.0.1', 0), _RequestHandler)
+        self.server.test = self
+        self.url = 'http://127.0.0.1:{0}'.format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super(HTTPServerTestCase, self).tearDown()
+
+    def publish(self, path, data):
+        """ writes a file to be served at <path> """
+
+        return self.write_file(os.path.join('www', path), data)
@@ -0,0 +1,39 @@
+import os
+import unittest
+
+from helpers import TempDirTestCase
+
+import batch
+
+
+def _fake_worker(path, incremental, lock_paths):
+    if os.path.basename(path) == 'dies':
+        os._exit(3)
+    return batch.Result(os.path.basename(path), os.stat(path).st_dev, 'snap', 0.0, 1, 2, None)
+
+
+class SnapshotTimelinesTest(TempDirTestCase):
+
+    def setUp(self):
+        super(SnapshotTimelinesTest, self).setUp()
+        self.worker = batch._snapshot_worker
+        batch._snapshot_worker = _fake_worker  # the worker processes are forked and see this
+
+    def tearDown(self):
+        batch._snapshot_worker = self.worker
+        super(SnapshotTimelinesTest, self).tearDown()
+
+    def test_dead_worker_fails_its_snapshot(self):
+        paths = []
+        for name in ('first', 'dies', 'last'):
+            paths.append(os.path.join(self.tmp, name))
+            os.makedirs(paths[-1])
+
+        results = batch.snapshot_timelines(paths, jobs_per_device=2)
+        self.assertEqual([r.name for r in results], ['first', 'dies', 'last'])
+        self.assertEqual([r.snapshot for r in results], ['snap', None, 'snap'])
+        self.assertIn('exit code 3', results[1].error)
+
+
+if __name__ == '__main__':
+    unittest.main()
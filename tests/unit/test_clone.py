@@ -0,0 +1,43 @@
+import os
+import unittest
+
+from helpers import TempDirTestCase
+
+import clone
+
+
+class IncrementalCloneTest(TempDirTestCase):
+
+    def setUp(self):
+        super(IncrementalCloneTest, self).setUp()
+        self.source = os.path.join(self.tmp, 'source')
+        for name in ('a.rpm', 'b.rpm', 'c.rpm'):
+            self.write_file(os.path.join('source', 'Packages', name), name)
+        self.reference = os.path.join(self.tmp, 'snap1')
+        clone.TreeCloner(workers=2).clone(self.source, self.reference)
+
+    def touch_dir(self):
+        # the listing changed, however quickly after the reference was taken
+        packages = os.path.join(self.source, 'Packages')
+        mtime = os.lstat(packages).st_mtime + 10
+        os.utime(packages, (mtime, mtime))
+
+    def clone(self):
+        return clone.TreeCloner(workers=2).clone(self.source, os.path.join(self.tmp, 'snap2'),
+                                                 reference_path=self.reference)
+
+    def test_unchanged(self):
+        stats = self.clone()
+        self.assertEqual((stats.files, stats.reused, stats.bytes), (3, 3, 0))
+
+    def test_new_entry(self):
+        self.write_file(os.path.join('source', 'Packages', 'd.rpm'), 'new package')
+        os.remove(os.path.join(self.source, 'Packages', 'a.rpm'))
+        self.touch_dir()
+        stats = self.clone()
+        self.assertEqual((stats.files, stats.reused, stats.bytes), (3, 2, len('new package')))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, 'snap2', 'Packages', 'a.rpm')))
+
+
+if __name__ == '__main__':
+    unittest.main()
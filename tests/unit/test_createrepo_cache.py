@@ -0,0 +1,39 @@
+import os
+import time
+import unittest
+
+from helpers import TempDirTestCase
+
+import mkrepodata
+import upstream_sync
+
+
+class CreaterepoCacheTest(TempDirTestCase):
+
+    def setUp(self):
+        super(CreaterepoCacheTest, self).setUp()
+        self.write_file('repos.d/up.repo', '[up]\nurl = https://mirror.example.com/repo/x86_64\npath = up\n')
+
+    def test_cache_per_repo_by_default(self):
+        config = self.make_config()
+        repo = upstream_sync.read_repos(config)[0]
+        self.assertEqual(upstream_sync.createrepo_cache_dir(config, repo), os.path.join(self.tmp, 'mirror', 'up', '.cache'))
+
+    def test_prune_shared_cache(self):
+        config = self.make_config(createrepo_cache_shared='true', createrepo_cache_max_age='30')
+        repo = upstream_sync.read_repos(config)[0]
+        cache_dir = upstream_sync.createrepo_cache_dir(config, repo)
+        self.assertEqual(cache_dir, os.path.join(self.tmp, 'mirror', '.repoman-createrepo.cache'))
+
+        old = time.time() - 31 * 24 * 3600
+        for name in ('unused', mkrepodata.CACHE_NAME):
+            path = self.write_file(os.path.join(cache_dir, name), 'x')
+            os.utime(path, (old, old))
+        self.write_file(os.path.join(cache_dir, 'used'), 'x')
+
+        self.assertEqual(upstream_sync.prune_createrepo_caches(config), 1)
+        self.assertEqual(sorted(os.listdir(cache_dir)), sorted(['used', mkrepodata.CACHE_NAME]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import os
+import unittest
+
+from helpers import TempDirTestCase
+
+import dedup
+import hashcache
+
+
+class DeduplicatorTest(TempDirTestCase):
+
+    def test_only_packages_are_linked(self):
+        for repo in ('a', 'b'):
+            self.write_file(os.path.join(repo, 'Packages', 'foo-1.0-1.noarch.rpm'), 'package')
+            self.write_file(os.path.join(repo, 'comps.xml'), 'comps')
+            self.write_file(os.path.join(repo, 'repodata', 'repomd.xml'), 'repomd')
+        paths = [os.path.join(self.tmp, 'a'), os.path.join(self.tmp, 'b')]
+
+        with hashcache.HashCache(os.path.join(self.tmp, 'hashes.db')) as cache:
+            stats = dedup.Deduplicator(paths, cache, workers=2).run()
+        self.assertEqual((stats.files, stats.linked), (2, 1))
+
+        def inode(repo, *path):
+            return os.stat(os.path.join(self.tmp, repo, *path)).st_ino
+
+        self.assertEqual(inode('a', 'Packages', 'foo-1.0-1.noarch.rpm'), inode('b', 'Packages', 'foo-1.0-1.noarch.rpm'))
+        self.assertNotEqual(inode('a', 'comps.xml'), inode('b', 'comps.xml'))
+        self.assertNotEqual(inode('a', 'repodata', 'repomd.xml'), inode('b', 'repodata', 'repomd.xml'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import random
+import hashlib
+import unittest
+
+from helpers import HTTPServerTestCase
+
+import downloader
+
+
+class DownloaderTest(HTTPServerTestCase):
+    """ resumed and chunked downloads of the built-in sync backend """
+
+    def setUp(self):
+        super(DownloaderTest, self).setUp()
+        self.data = self.random_data(100 * 1024)
+        self.publish('package.rpm', self.data)
+        self.url = self.url + '/package.rpm'
+        self.dest = os.path.join(self.tmp, 'mirror', 'package.rpm')
+        self.partial_dir = os.path.join(self.tmp, 'partial')
+
+    def random_data(self, size):
+        return ''.join(chr(random.randint(0, 255)) for _ in xrange(size))
+
+    def downloader(self, **kwargs):
+        kwargs.setdefault('partial_dir', self.partial_dir)
+        d = downloader.Downloader(**kwargs)
+        self.addCleanup(d.close)
+        return d
+
+    def fetch(self, d, data):
+        return d.fetch(self.url, self.dest, 'sha256', hashlib.sha256(data).hexdigest(), len(data))
+
+    def downloaded(self):
+        with open(self.dest, 'rb') as fh:
+            return fh.read()
+
+    def test_resume_with_if_range(self):
+        self.drop['/package.rpm'] = 1
+        with self.assertRaises(downloader.DownloadError):
+            self.fetch(self.downloader(retries=1), self.data)
+        self.assertFalse(os.path.exists(self.dest))
+
+        # a later run continues where the interrupted download stopped
+        self.fetch(self.downloader(retries=1), self.data)
+        self.assertEqual(self.downloaded(), self.data)
+        path, headers = self.requests[-1]
+        self.assertEqual(headers['range'], 'bytes={0}-'.format(len(self.data) // 2))
+        self.assertTrue(headers['if-range'].startswith('"'))
+        self.assertEqual(os.listdir(self.partial_dir), [])
+
+    def test_resume_after_upstream_change(self):
+        self.drop['/package.rpm'] = 1
+        with self.assertRaises(downloader.DownloadError):
+            self.fetch(self.downloader(retries=1), self.data)
+
+        # If-Range doesn't match any more, the server sends the whole new file
+        data = self.random_data(len(self.data))
+        self.publish('package.rpm', data)
+        self.fetch(self.downloader(retries=1), data)
+        self.assertEqual(self.downloaded(), data)
+        self.assertIn('if-range', self.requests[-1][1])
+
+    def test_chunked(self):
+        self.drop['/package.rpm'] = 2
+        self.fetch(self.downloader(chunk_size=16 * 1024, chunk_workers=3), self.data)
+        self.assertEqual(self.downloaded(), self.data)
+        # the first range is fetched alone and resumed where each attempt broke off
+        self.assertEqual([h['range'] for p, h in self.requests[:3]],
+                         ['bytes=0-16383', 'bytes=8192-16383', 'bytes=12288-16383'])
+        self.assertEqual(os.listdir(self.partial_dir), [])
+
+    def test_upstream_change_during_chunked_download(self):
+        data = self.random_data(len(self.data))
+        www_path = os.path.join(self.www, 'package.rpm')
+        changed = []
+
+        def change_upstream(path, headers):
+            # the file changes once the first range was served
+            with self.lock:
+                if changed or headers.get('range', '').startswith('bytes=0-'):
+                    return
+                with open(www_path + '.tmp', 'wb') as fh:
+                    fh.write(data)
+                os.rename(www_path + '.tmp', www_path)
+                changed.append(path)
+
+        self.before_response = change_upstream
+        self.fetch(self.downloader(chunk_size=16 * 1024, chunk_workers=3), data)
+        self.assertEqual(self.downloaded(), data)
+        # the download was started over
+        self.assertEqual(len([h for p, h in self.requests if h['range'] == 'bytes=0-16383']), 2)
+
+    def test_ranges_ignored(self):
+        self.ranges = False
+        self.fetch(self.downloader(chunk_size=16 * 1024), self.data)
+        self.assertEqual(self.downloaded(), self.data)
+        # the first range came back whole, the file is downloaded in one piece instead
+        self.assertEqual([h.get('range') for p, h in self.requests], ['bytes=0-16383', None])
+
+
+if __name__ == '__main__':
+    unittest.main()
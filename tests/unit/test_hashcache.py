@@ -0,0 +1,82 @@
+import os
+import time
+import unittest
+import multiprocessing
+from collections import namedtuple
+
+from helpers import TempDirTestCase
+
+import hashcache
+
+Stat = namedtuple('Stat', ['st_dev', 'st_ino', 'st_mtime', 'st_size'])
+
+
+def _hashing_run(path, ino, hashing_time):
+    """ a process which stores a checksum, then keeps hashing for <hashing_time> seconds """
+
+    with hashcache.HashCache(path) as cache:
+        cache.store(Stat(1, ino, 1.0, 1), 'digest {0}'.format(ino))
+        time.sleep(hashing_time)
+        cache.store(Stat(1, ino + 1, 1.0, 1), 'digest {0}'.format(ino + 1))
+
+
+class HashCacheTest(TempDirTestCase):
+
+    def setUp(self):
+        super(HashCacheTest, self).setUp()
+        self.path = os.path.join(self.tmp, 'hashes.db')
+
+    def test_lookup_of_pending_checksum(self):
+        with hashcache.HashCache(self.path) as cache:
+            cache.store(Stat(1, 2, 3.0, 4), 'digest')
+            self.assertEqual(cache.lookup(Stat(1, 2, 3.0, 4)), 'digest')
+            self.assertIsNone(cache.lookup(Stat(1, 2, 3.5, 4)))
+
+    def test_writers_do_not_lock_each_other_out(self):
+        first = hashcache.HashCache(self.path)
+        second = hashcache.HashCache(self.path)
+        try:
+            # the first writer is in the middle of a hashing run
+            first.store(Stat(1, 1, 1.0, 1), 'first')
+            started = time.time()
+            second.store(Stat(1, 2, 1.0, 1), 'second')
+            second.commit()
+            self.assertLess(time.time() - started, 1)
+            first.commit()
+        finally:
+            first.close()
+            second.close()
+
+        with hashcache.HashCache(self.path) as cache:
+            self.assertEqual(cache.lookup(Stat(1, 1, 1.0, 1)), 'first')
+            self.assertEqual(cache.lookup(Stat(1, 2, 1.0, 1)), 'second')
+
+    def test_concurrent_processes(self):
+        slow = multiprocessing.Process(target=_hashing_run, args=(self.path, 1, 3))
+        slow.start()
+        time.sleep(0.5)
+        started = time.time()
+        fast = multiprocessing.Process(target=_hashing_run, args=(self.path, 10, 0))
+        fast.start()
+        fast.join()
+        # the second process didn't wait for the hashing run of the first one
+        self.assertLess(time.time() - started, 2)
+        slow.join()
+        self.assertEqual((slow.exitcode, fast.exitcode), (0, 0))
+
+        with hashcache.HashCache(self.path) as cache:
+            for ino in (1, 2, 10, 11):
+                self.assertEqual(cache.lookup(Stat(1, ino, 1.0, 1)), 'digest {0}'.format(ino))
+
+    def test_written_about_once_a_second(self):
+        with hashcache.HashCache(self.path) as cache, hashcache.HashCache(self.path) as reader:
+            cache.store(Stat(1, 1, 1.0, 1), 'first')
+            self.assertIsNone(reader.lookup(Stat(1, 1, 1.0, 1)))
+            time.sleep(hashcache.COMMIT_INTERVAL)
+            cache.store(Stat(1, 2, 1.0, 1), 'second')
+            self.assertEqual(reader.lookup(Stat(1, 1, 1.0, 1)), 'first')
+            self.assertEqual(reader.lookup(Stat(1, 2, 1.0, 1)), 'second')
+
+
+if __name__ == '__main__':
+    unittest.main()
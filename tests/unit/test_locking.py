@@ -0,0 +1,68 @@
+import os
+import time
+import unittest
+import threading
+
+from helpers import TempDirTestCase
+
+import locking
+
+
+class FileLockTest(TempDirTestCase):
+
+    def setUp(self):
+        super(FileLockTest, self).setUp()
+        self.path = os.path.join(self.tmp, 'locks', 'test.lock')
+
+    def test_exclusive(self):
+        with locking.FileLock(self.path) as lock:
+            self.assertTrue(lock.locked)
+            for shared in (False, True):
+                other = locking.FileLock(self.path, shared=shared)
+                self.assertFalse(other.acquire(blocking=False))
+                self.assertFalse(other.locked)
+        self.assertFalse(lock.locked)
+        self.assertTrue(locking.FileLock(self.path).acquire(blocking=False))
+
+    def test_shared(self):
+        with locking.FileLock(self.path, shared=True):
+            other = locking.FileLock(self.path, shared=True)
+            self.assertTrue(other.acquire(blocking=False))
+            self.assertFalse(locking.FileLock(self.path).acquire(blocking=False))
+            other.release()
+
+    def test_blocking(self):
+        lock = locking.FileLock(self.path)
+        lock.acquire()
+        acquired = []
+
+        def wait():
+            other = locking.FileLock(self.path, shared=True)
+            other.acquire()
+            acquired.append(time.time())
+            other.release()
+
+        thread = threading.Thread(target=wait)
+        thread.start()
+        time.sleep(0.5)
+        released = time.time()
+        lock.release()
+        thread.join(10)
+        self.assertEqual(len(acquired), 1)
+        self.assertGreaterEqual(acquired[0], released)
+
+    def test_hold(self):
+        paths = [os.path.join(self.tmp, 'b.lock'), os.path.join(self.tmp, 'a.lock')]
+        with locking.hold(paths + paths[:1], shared=True) as locks:
+            self.assertEqual([l.path for l in locks], sorted(paths))
+            self.assertFalse(locking.FileLock(paths[0]).acquire(blocking=False))
+        self.assertTrue(locking.FileLock(paths[0]).acquire(blocking=False))
+
+    def test_overlaps(self):
+        self.assertTrue(locking.overlaps('/srv/repos', '/srv/repos/centos/'))
+        self.assertTrue(locking.overlaps('/srv/repos', '/srv/repos'))
+        self.assertFalse(locking.overlaps('/srv/repos', '/srv/repos2'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import hashlib
+import unittest
+
+from helpers import TempDirTestCase
+
+import manifest
+
+
+class ManifestTest(TempDirTestCase):
+
+    def setUp(self):
+        super(ManifestTest, self).setUp()
+        self.path = os.path.join(self.tmp, 'test.manifest')
+        self.entries = [
+            manifest.Entry('repo', 1, 0, 1.5, manifest.DIRECTORY, None),
+            manifest.Entry('repo/b.rpm', 3, 200, 2.5, manifest.FILE, hashlib.sha256('b').digest()),
+            manifest.Entry('repo/a.rpm', 2, 100, 2.0, manifest.FILE, None),
+            manifest.Entry('repo2/latest', 4, 4, 3.0, manifest.SYMLINK, None),
+        ]
+        manifest.write_manifest(self.path, self.entries, 'sha256')
+
+    def test_read(self):
+        with manifest.Manifest(self.path) as m:
+            self.assertEqual(len(m), 4)
+            self.assertEqual(m.checksum_type, 'sha256')
+            self.assertEqual(list(m), sorted(self.entries))
+            self.assertEqual(m.get('repo/b.rpm'), self.entries[1])
+            self.assertIsNone(m.get('repo/c.rpm'))
+            self.assertNotIn('repo/', m)
+
+    def test_prefix(self):
+        with manifest.Manifest(self.path) as m:
+            self.assertEqual([e.path for e in m.iter_prefix('repo/')], ['repo/a.rpm', 'repo/b.rpm'])
+            self.assertEqual([e.path for e in m.iter_prefix('repo')], ['repo', 'repo/a.rpm', 'repo/b.rpm',
+                                                                       'repo2/latest'])
+            self.assertEqual(m.total_size('repo/'), 300)
+            self.assertEqual(m.total_size(), 300)
+
+    def test_not_a_manifest(self):
+        path = self.write_file('other', 'x' * 100)
+        self.assertRaises(Exception, manifest.Manifest, path)
+
+
+if __name__ == '__main__':
+    unittest.main()
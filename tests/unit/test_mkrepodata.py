@@ -0,0 +1,118 @@
+import os
+import struct
+import sqlite3
+import unittest
+import multiprocessing
+
+from helpers import TempDirTestCase
+
+import hashcache
+import mkrepodata
+import rpmheader
+
+
+def _header(entries):
+    """ returns a header structure of the (tag, type, value) entries """
+
+    index = store = ''
+    for tag, kind, value in sorted(entries):
+        if kind == rpmheader.STRING:
+            data, count = value + '\0', 1
+        else:
+            data, count = struct.pack('>{0}I'.format(len(value)), *value), len(value)
+            store += '\0' * (-len(store) % 4)
+        index += struct.pack('>IIII', tag, kind, len(store), count)
+        store += data
+    return rpmheader.HEADER_MAGIC + '\x01\0\0\0\0' + struct.pack('>II', len(entries), len(store)) + index + store
+
+
+def write_rpm(path, name, version='1.0', release='1'):
+    lead = rpmheader.LEAD_MAGIC + '\x03\0\0\0' + '\0' * 88
+    signature = _header([(rpmheader.SIG_PAYLOADSIZE, rpmheader.INT32, [100])])
+    signature += '\0' * (-len(signature) % 8)
+    header = _header([(rpmheader.NAME, rpmheader.STRING, name), (rpmheader.VERSION, rpmheader.STRING, version),
+                      (rpmheader.RELEASE, rpmheader.STRING, release), (rpmheader.ARCH, rpmheader.STRING, 'noarch'),
+                      (rpmheader.BUILDTIME, rpmheader.INT32, [1700000000])])
+    with open(path, 'wb') as fh:
+        fh.write(lead + signature + header + 'payload of ' + name)
+
+
+class MetadataGeneratorTest(TempDirTestCase):
+
+    def setUp(self):
+        super(MetadataGeneratorTest, self).setUp()
+        self.repo = os.path.join(self.tmp, 'repo')
+        os.makedirs(self.repo)
+        for name in ('foo', 'bar'):
+            write_rpm(os.path.join(self.repo, name + '.rpm'), name)
+        self.record_cache = os.path.join(self.tmp, 'cache', mkrepodata.CACHE_NAME)
+        self.hash_cache = os.path.join(self.tmp, 'hashes.db')
+
+    def generate(self):
+        generator = mkrepodata.MetadataGenerator(self.record_cache, self.hash_cache, workers=1, database=False)
+        return generator.generate(self.repo)
+
+    def test_checksums_from_hash_cache(self):
+        stats = self.generate()
+        self.assertEqual((stats.packages, stats.read, stats.reused), (2, 2, 0))
+
+        path = os.path.join(self.repo, 'foo.rpm')
+        with hashcache.HashCache(self.hash_cache) as cache:
+            self.assertEqual(cache.lookup(os.stat(path), mkrepodata.CHECKSUM_TYPE),
+                             hashcache.hash_file(path, mkrepodata.CHECKSUM_TYPE))
+
+        db = sqlite3.connect(self.record_cache)
+        columns = [row[1] for row in db.execute('PRAGMA table_info(headers)')]
+        db.close()
+        self.assertNotIn('checksum', columns)
+
+        stats = self.generate()
+        self.assertEqual((stats.packages, stats.read, stats.reused), (2, 0, 2))
+
+    def test_missing_checksum_is_hashed_again(self):
+        self.generate()
+        os.remove(self.hash_cache)
+
+        stats = self.generate()
+        self.assertEqual((stats.read, stats.reused), (2, 0))
+        path = os.path.join(self.repo, 'bar.rpm')
+        with hashcache.HashCache(self.hash_cache) as cache:
+            self.assertIsNotNone(cache.lookup(os.stat(path), mkrepodata.CHECKSUM_TYPE))
+
+    def test_concurrent_generators(self):
+        # two repos whose metadata is generated at the same time, sharing both caches
+        repos = [self.repo, os.path.join(self.tmp, 'other')]
+        os.makedirs(repos[1])
+        for i in range(40):
+            for repo in repos:
+                write_rpm(os.path.join(repo, 'pkg{0}-{1}.rpm'.format(i, os.path.basename(repo))), 'pkg{0}'.format(i))
+
+        def generate(path):
+            mkrepodata.MetadataGenerator(self.record_cache, self.hash_cache, workers=2, database=False).generate(path)
+
+        processes = [multiprocessing.Process(target=generate, args=(repo,)) for repo in repos]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        self.assertEqual([p.exitcode for p in processes], [0, 0])
+        for repo in repos:
+            self.assertTrue(os.path.isfile(os.path.join(repo, 'repodata', 'repomd.xml')))
+
+        with hashcache.HashCache(self.hash_cache) as cache:
+            for repo in repos:
+                st = os.stat(os.path.join(repo, 'pkg39-{0}.rpm'.format(os.path.basename(repo))))
+                self.assertIsNotNone(cache.lookup(st, mkrepodata.CHECKSUM_TYPE))
+
+    def test_prune(self):
+        self.generate()
+        os.remove(os.path.join(self.repo, 'foo.rpm'))
+
+        with mkrepodata.RecordCache(self.record_cache) as cache:
+            self.assertEqual(cache.prune([self.repo]), 1)
+            self.assertIsNotNone(cache.lookup(os.stat(os.path.join(self.repo, 'bar.rpm'))))
+            self.assertEqual(cache.prune([self.repo]), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
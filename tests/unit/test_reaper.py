@@ -0,0 +1,70 @@
+import os
+import unittest
+
+from helpers import TempDirTestCase
+
+import reaper
+
+
+class ReaperTest(TempDirTestCase):
+
+    def setUp(self):
+        super(ReaperTest, self).setUp()
+        self.trash = os.path.join(self.tmp, 'trash')
+        op = reaper.make_operation_dir(self.trash)
+        for i in range(3):
+            self.write_file(os.path.join('trash', os.path.basename(op), 'snap', 'dir{0}'.format(i), 'file'), 'x')
+
+    def test_reap(self):
+        r = reaper.Reaper(self.trash, workers=2, ionice='none')
+        self.assertEqual(r.reap(), 3)
+        self.assertEqual(r.pending(), [])
+
+    def test_spawn(self):
+        r = reaper.Reaper(self.trash, workers=2, ionice='none')
+        proc = r.spawn()
+        self.assertIsNotNone(proc)
+        self.assertEqual(proc.wait(), 0)
+        self.assertEqual(r.pending(), [])
+        self.assertTrue(os.path.isfile(r.log_path))
+
+    def test_open_operation_is_skipped(self):
+        op = reaper.Operation(self.trash)
+        self.write_file(os.path.join('trash', os.path.basename(op.path), 'snap', 'file'), 'x')
+        r = reaper.Reaper(self.trash, workers=2, ionice='none')
+        self.assertEqual(r.reap(), 3)
+        self.assertEqual(r.pending(), [op.path])
+
+        op.close()
+        self.assertEqual(r.reap(), 1)
+        self.assertEqual(r.pending(), [])
+
+    def test_directory_filled_while_reaping(self):
+        r = reaper.Reaper(self.trash, workers=2, ionice='none')
+        op = r.pending()[0]
+        remove_dir = r._remove_dir
+
+        # a snapshot moved into the operation directory after it was listed
+        def remove_and_fill(path):
+            remove_dir(path)
+            if path == op:
+                self.write_file(os.path.join(op, 'late', 'file'), 'x')
+        r._remove_dir = remove_and_fill
+
+        self.assertEqual(r.reap(), 3)
+        self.assertEqual(r.pending(), [op])
+        r._remove_dir = remove_dir
+        self.assertEqual(r.reap(), 1)
+
+    def test_log_is_rotated(self):
+        r = reaper.Reaper(self.trash, workers=2, ionice='none')
+        r._log_max_size = 10
+        self.write_file(os.path.join('trash', r._log_name), 'x' * 10)
+        self.assertEqual(r.spawn().wait(), 0)
+        with open(r.log_path + '.1') as fh:
+            self.assertEqual(fh.read(), 'x' * 10)
+        self.assertEqual(r.pending(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
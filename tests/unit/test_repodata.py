@@ -0,0 +1,66 @@
+import os
+import subprocess
+import unittest
+
+from helpers import TempDirTestCase
+
+import repodata
+
+PRIMARY = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://linux.duke.edu/metadata/common" packages="{0}">
+{1}
+</metadata>
+"""
+
+PACKAGE = """<package type="rpm">
+  <name>pkg{0}</name>
+  <arch>noarch</arch>
+  <version epoch="0" ver="1.0" rel="1"/>
+  <checksum type="sha256" pkgid="YES">{1:064x}</checksum>
+  <size package="100"/>
+  <location href="pkg{0}.rpm"/>
+</package>"""
+
+
+class DecompressorPipeTest(TempDirTestCase):
+
+    def write_primary(self, count, compressor='xz', ext='.xz'):
+        path = self.write_file('primary.xml', PRIMARY.format(
+            count, '\n'.join(PACKAGE.format(i, i) for i in range(count))))
+        subprocess.check_call([compressor, '-q', path])
+        return path + ext
+
+    def test_read(self):
+        path = self.write_primary(3)
+        with repodata._DecompressorPipe(['xz', '-dc', path]) as fh:
+            self.assertTrue(fh.read().startswith('<?xml'))
+        self.assertEqual([p.name for p in repodata.iter_primary(path)], ['pkg0', 'pkg1', 'pkg2'])
+
+    def test_corrupt(self):
+        path = self.write_primary(3)
+        with open(path, 'r+b') as fh:
+            fh.truncate(os.path.getsize(path) - 20)
+        fh = repodata._DecompressorPipe(['xz', '-dc', path])
+        try:
+            self.assertRaises(Exception, fh.read)
+        finally:
+            fh.close()
+
+    def test_zstd(self):
+        path = self.write_primary(3, 'zstd', '.zst')
+        self.assertEqual([p.name for p in repodata.iter_primary(path)], ['pkg0', 'pkg1', 'pkg2'])
+
+        with open(path, 'r+b') as fh:
+            fh.truncate(os.path.getsize(path) - 20)
+        self.assertRaises(Exception, list, repodata.iter_primary(path))
+
+    def test_close_early(self):
+        path = self.write_primary(5000)
+        fh = repodata._DecompressorPipe(['xz', '-dc', path])
+        fh.read(10)
+        fh.close()
+        self.assertIsNotNone(fh._proc.returncode)
+
+
+if __name__ == '__main__':
+    unittest.main()
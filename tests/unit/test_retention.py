@@ -0,0 +1,72 @@
+import unittest
+from datetime import datetime
+
+import helpers  # puts the repoman modules on the path
+
+import retention
+
+
+def actions(plan):
+    return [(name, action, reasons) for name, created, action, reasons in plan]
+
+
+class RetentionPolicyTest(unittest.TestCase):
+
+    def test_parse(self):
+        policy = retention.RetentionPolicy.parse('last=7, daily=14,monthly=12')
+        self.assertEqual(str(policy), 'last=7,daily=14,weekly=0,monthly=12')
+        for string in ('', 'last=0', 'hourly=3', 'daily', 'daily=x', 'daily=-1'):
+            self.assertRaises(Exception, retention.RetentionPolicy.parse, string)
+
+    def test_last_and_daily(self):
+        snapshots = [
+            ('d1-10', datetime(2026, 3, 1, 10), None),
+            ('d1-12', datetime(2026, 3, 1, 12), None),
+            ('d2-12', datetime(2026, 3, 2, 12), None),
+            ('d3-09', datetime(2026, 3, 3, 9), None),
+            ('d3-18', datetime(2026, 3, 3, 18), None),
+            ('d4-12', datetime(2026, 3, 4, 12), None),
+        ]
+        plan = retention.RetentionPolicy(last=3, daily=3).plan(snapshots)
+        self.assertEqual(actions(plan), [
+            ('d4-12', retention.KEEP, ['last', 'daily']),
+            ('d3-18', retention.KEEP, ['last', 'daily']),
+            ('d3-09', retention.KEEP, ['last']),
+            ('d2-12', retention.KEEP, ['daily']),
+            ('d1-12', retention.DELETE, []),
+            ('d1-10', retention.DELETE, []),
+        ])
+
+    def test_weekly_and_monthly(self):
+        snapshots = [
+            ('jan-05', datetime(2026, 1, 5), None),
+            ('jan-20', datetime(2026, 1, 20), None),
+            ('feb-03', datetime(2026, 2, 3), None),
+            ('feb-05', datetime(2026, 2, 5), None),
+            ('mar-02', datetime(2026, 3, 2), None),
+        ]
+        plan = retention.RetentionPolicy(weekly=2, monthly=3).plan(snapshots)
+        self.assertEqual(actions(plan), [
+            ('mar-02', retention.KEEP, ['weekly', 'monthly']),
+            ('feb-05', retention.KEEP, ['weekly', 'monthly']),
+            ('feb-03', retention.DELETE, []),
+            ('jan-20', retention.KEEP, ['monthly']),
+            ('jan-05', retention.DELETE, []),
+        ])
+
+    def test_pinned(self):
+        snapshots = [
+            ('old', datetime(2026, 1, 1), 'linked'),
+            ('named', datetime(2026, 1, 2), 'named'),
+            ('new', datetime(2026, 1, 3), None),
+        ]
+        plan = retention.RetentionPolicy(last=1).plan(snapshots)
+        self.assertEqual(actions(plan), [
+            ('new', retention.KEEP, ['last']),
+            ('named', retention.KEEP, ['named']),
+            ('old', retention.KEEP, ['linked']),
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import json
+import unittest
+import StringIO
+
+from helpers import TempDirTestCase
+
+import snapdiff
+
+
+class SnapshotDiffTest(TempDirTestCase):
+
+    def setUp(self):
+        super(SnapshotDiffTest, self).setUp()
+        self.old = os.path.join(self.tmp, 'old')
+        self.new = os.path.join(self.tmp, 'new')
+        linked = self.write_file('old/repo/linked.rpm', 'linked')
+        os.makedirs(os.path.join(self.new, 'repo'))
+        os.link(linked, os.path.join(self.new, 'repo', 'linked.rpm'))
+        # same content, but copied instead of linked
+        self.write_file('old/repo/repodata/repomd.xml', 'repomd')
+        self.write_file('new/repo/repodata/repomd.xml', 'repomd')
+        self.write_file('old/repo/changed.rpm', 'old')
+        self.write_file('new/repo/changed.rpm', 'new')
+        self.write_file('old/repo/removed.rpm', 'removed')
+        self.write_file('new/repo/added/new.rpm', 'added')
+        self.write_file('old/repo/type', 'file')
+        os.makedirs(os.path.join(self.new, 'repo', 'type'))
+        self.write_file('new/repo/ignored.tmp', 'ignored')
+
+    def diff(self):
+        d = snapdiff.SnapshotDiff(self.new, self.old, excludes=['*.tmp'])
+        d.run()
+        return d
+
+    def test_differences(self):
+        d = self.diff()
+        self.assertEqual(d.differences, [
+            (snapdiff.ADDED, 'repo/added', 'dir', None),
+            (snapdiff.CHANGED, 'repo/changed.rpm', 'file', 'file'),
+            (snapdiff.REMOVED, 'repo/removed.rpm', None, 'file'),
+            (snapdiff.CHANGED, 'repo/type', 'dir', 'file'),
+        ])
+        # the linked file is not compared, the copied one is
+        self.assertEqual(d.compared, 2)
+
+    def test_log(self):
+        fh = StringIO.StringIO()
+        self.diff().write_log(fh)
+        self.assertEqual(fh.getvalue().splitlines(), [
+            'Only in {0}/repo: added'.format(self.new),
+            'Files {0}/repo/changed.rpm and {1}/repo/changed.rpm differ'.format(self.new, self.old),
+            'Only in {0}/repo: removed.rpm'.format(self.old),
+            'File {0}/repo/type is a directory while file {1}/repo/type is a regular file'.format(self.new, self.old),
+        ])
+
+    def test_report(self):
+        d = self.diff()
+        fh = StringIO.StringIO()
+        d.write_report(fh, 'json')
+        report = json.loads(fh.getvalue())
+        self.assertEqual((report['added'], report['removed'], report['changed']),
+                         (['repo/added/'], ['repo/removed.rpm'], ['repo/changed.rpm', 'repo/type/']))
+
+        fh = StringIO.StringIO()
+        d.write_report(fh, 'tsv')
+        self.assertEqual(fh.getvalue().splitlines()[0], 'added\trepo/added/')
+        self.assertRaises(ValueError, d.write_report, fh, 'xml')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import pickle
+import unittest
+
+from helpers import TempDirTestCase
+
+import state
+import timeline
+
+
+class StateStoreTest(TempDirTestCase):
+
+    def setUp(self):
+        super(StateStoreTest, self).setUp()
+        self.path = os.path.join(self.tmp, 'state.db')
+
+    def test_only_changes_are_written(self):
+        store = state.StateStore(self.path)
+        records = {'meta': {'_name': 'test'}, 'snapshots': {'a': {'path': '/a'}, 'b': {'path': '/b'}}}
+        self.assertEqual(store.commit(records), 3)
+        self.assertEqual(store.commit(records), 0)
+
+        records['snapshots'] = {'a': {'path': '/a'}, 'c': {'path': '/c'}}
+        self.assertEqual(store.commit(records), 2)
+        store.close()
+
+        store = state.StateStore(self.path, readonly=True)
+        self.assertEqual(store.load('snapshots'), records['snapshots'])
+        self.assertEqual(store.get('meta', '_name'), 'test')
+        self.assertEqual(store.names('links'), [])
+        self.assertRaises(Exception, store.commit, records)
+        store.close()
+
+    def test_readonly_needs_state_file(self):
+        self.assertRaises(Exception, state.StateStore, self.path, readonly=True)
+
+
+class MigrationTest(TempDirTestCase):
+    """ pickled state of older versions (.timeline.state) """
+
+    def setUp(self):
+        super(MigrationTest, self).setUp()
+        self.write_file('source/package.rpm', 'rpm')
+        self.path = os.path.join(self.tmp, 'timeline')
+        t = timeline.Timeline('test', os.path.join(self.tmp, 'source'), self.path)
+        t.save()
+        t.create_named_snapshot('release')
+        t.create_link('stable', 'release')
+        records = t._state_records()
+        t.close()
+
+        # older versions pickled their whole __dict__, without the settings added since
+        data = dict(records['meta'], _snapshots=records['snapshots'], _links=records['links'])
+        for key in ('_statefile', '_retention', '_manifest'):
+            del data[key]
+        with open(os.path.join(self.path, timeline.Timeline._datafile_ext), 'w') as fh:
+            pickle.dump(data, fh)
+        os.remove(os.path.join(self.path, timeline.Timeline._statefile_ext))
+        self.snapshots = records['snapshots']
+        self.links = records['links']
+
+    def test_readonly_reads_pickle(self):
+        t = timeline.Timeline.load(self.path, readonly=True)
+        self.assertEqual(t._snapshots, self.snapshots)
+        self.assertFalse(os.path.exists(os.path.join(self.path, timeline.Timeline._statefile_ext)))
+        t.close()
+
+    def test_migration(self):
+        t = timeline.Timeline.load(self.path)
+        self.assertEqual(t._snapshots, self.snapshots)
+        self.assertEqual(t._links, self.links)
+        # settings missing from the pickle keep their defaults
+        self.assertEqual((t._retention, t._manifest), ('', True))
+        t.close()
+
+        datafile = os.path.join(self.path, timeline.Timeline._datafile_ext)
+        self.assertFalse(os.path.exists(datafile))
+        self.assertTrue(os.path.exists(datafile + '.migrated'))
+
+        t = timeline.Timeline.load(self.path, readonly=True)
+        self.assertEqual(t._snapshots, self.snapshots)
+        self.assertEqual(t._links, self.links)
+        t.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
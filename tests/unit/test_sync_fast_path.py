@@ -0,0 +1,89 @@
+import os
+import argparse
+import unittest
+
+from helpers import HTTPServerTestCase
+
+import syncstate
+import upstream_sync
+
+
+class FastPathTest(HTTPServerTestCase):
+    """ repos whose upstream repomd.xml didn't change are not synced again """
+
+    def setUp(self):
+        super(FastPathTest, self).setUp()
+        self.publish('repo/x86_64/repodata/repomd.xml', '<repomd>1</repomd>')
+        self.config = self.make_config(createrepo_after_sync='false')
+        self.write_file('repos.d/up.repo', '[up]\nurl = {0}/repo/x86_64\npath = up\n'.format(self.url))
+        self.syncs = 0
+        self.rc = 0
+
+    def sync(self, force=False):
+        """ runs the download stage of the repo, with a sync command which only counts its runs,
+            returns the status
+        """
+
+        def sync_cmd(log):
+            self.syncs += 1
+            return self.rc
+
+        repo = upstream_sync.read_repos(self.config)[0]
+        job = upstream_sync.prepare_sync(self.config, repo,
+                                         argparse.Namespace(verbose=False, dry_run=False, force=force))
+        if job['tmpfile']:
+            job['tmpfile'].close()
+        job['tmpfile'] = None
+        job['sync_cmd'] = sync_cmd
+        job['lock_dir'] = self.config.get('repoman', 'lock_dir')
+        job['log'] = os.path.join(self.tmp, 'up.log')
+        return upstream_sync.download_stage(job).status
+
+    def test_not_modified(self):
+        self.assertEqual(self.sync(), 'ok')
+        self.assertEqual(self.sync(), 'unchanged')
+        self.assertEqual(self.syncs, 1)
+
+        # the check was a conditional request answered with 304
+        path, headers = self.requests[-1]
+        self.assertEqual(path, '/repo/x86_64/repodata/repomd.xml')
+        self.assertIn('if-none-match', headers)
+
+    def test_unchanged_repomd_without_etag(self):
+        self.etags = False
+        self.assertEqual(self.sync(), 'ok')
+        self.assertEqual(self.sync(), 'unchanged')
+        self.assertEqual(self.syncs, 1)
+
+    def test_changed_repomd(self):
+        self.assertEqual(self.sync(), 'ok')
+        self.publish('repo/x86_64/repodata/repomd.xml', '<repomd>2</repomd>')
+        self.assertEqual(self.sync(), 'ok')
+        self.assertEqual(self.sync(), 'unchanged')
+        self.assertEqual(self.syncs, 2)
+
+    def test_force(self):
+        self.assertEqual(self.sync(), 'ok')
+        self.assertEqual(self.sync(force=True), 'ok')
+        self.assertEqual(self.syncs, 2)
+
+    def test_failed_sync_is_not_recorded(self):
+        self.assertEqual(self.sync(), 'ok')
+        self.publish('repo/x86_64/repodata/repomd.xml', '<repomd>2</repomd>')
+        self.rc = 1
+        self.assertEqual(self.sync(), 'sync failed')
+        self.rc = 0
+        self.assertEqual(self.sync(), 'ok')
+        self.assertEqual(self.syncs, 3)
+
+    def test_fetch_fingerprint(self):
+        url = syncstate.repomd_url(self.url + '/repo/x86_64')
+        fingerprint = syncstate.fetch_fingerprint(url)
+        self.assertIsNotNone(fingerprint.etag)
+        self.assertIs(syncstate.fetch_fingerprint(url, fingerprint), fingerprint)
+        self.publish('repo/x86_64/repodata/repomd.xml', '<repomd>2</repomd>')
+        self.assertNotEqual(syncstate.fetch_fingerprint(url, fingerprint).checksum, fingerprint.checksum)
+
+
+if __name__ == '__main__':
+    unittest.main()
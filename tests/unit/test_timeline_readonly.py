@@ -0,0 +1,43 @@
+import os
+import threading
+import unittest
+
+from helpers import TempDirTestCase
+
+import hashcache
+import timeline
+
+
+class ReadonlyTimelineTest(TempDirTestCase):
+    """ readers (list, show, verify) don't take the timeline lock """
+
+    def setUp(self):
+        super(ReadonlyTimelineTest, self).setUp()
+        self.write_file('source/package.rpm', 'rpm')
+        self.path = os.path.join(self.tmp, 'timeline')
+        t = timeline.Timeline('test', os.path.join(self.tmp, 'source'), self.path)
+        t.save()
+        self.snapshot = t.create_snapshot()
+        t.close()
+
+    def test_verify_does_not_block_writers(self):
+        reader = timeline.Timeline.load(self.path, readonly=True)
+
+        loaded = []
+
+        def load():
+            timeline.Timeline.load(self.path).close()
+            loaded.append(True)
+
+        thread = threading.Thread(target=load)
+        thread.daemon = True
+        thread.start()
+        thread.join(10)
+        self.assertEqual(len(loaded), 1, 'loading the timeline for writing blocked on a reader')
+
+        with hashcache.HashCache(os.path.join(self.tmp, 'hashes.db')) as cache:
+            self.assertEqual(reader.verify_snapshots(cache, processes=1), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
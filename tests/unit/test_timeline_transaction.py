@@ -0,0 +1,44 @@
+import os
+import unittest
+
+from helpers import TempDirTestCase
+
+import timeline
+
+
+class TransactionTest(TempDirTestCase):
+
+    def setUp(self):
+        super(TransactionTest, self).setUp()
+        self.write_file('source/package.rpm', 'rpm')
+        self.path = os.path.join(self.tmp, 'timeline')
+        t = timeline.Timeline('test', os.path.join(self.tmp, 'source'), self.path)
+        t.save()
+        self.snapshots = [t.create_snapshot()]
+        t.create_named_snapshot('release')
+        t.close()
+
+    def test_failed_transaction_is_rolled_back(self):
+        t = timeline.Timeline.load(self.path)
+        with self.assertRaises(RuntimeError):
+            with t.transaction():
+                t.delete_snapshot(self.snapshots[0])
+                t.delete_snapshot('release')
+                raise RuntimeError('failed')
+
+        self.assertEqual(t._lsnapshots, self.snapshots)
+        self.assertIn(self.snapshots[0], t._snapshots)
+        self.assertIn('release', t._snapshots)
+        self.assertTrue(os.path.isdir(t.get_snapshot(self.snapshots[0])['path']))
+
+        # a later save writes the state from before the transaction
+        t.save()
+        t.close()
+        t = timeline.Timeline.load(self.path)
+        self.assertEqual(t._lsnapshots, self.snapshots)
+        self.assertIn('release', t._snapshots)
+        t.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import argparse
+
+from helpers import TempDirTestCase
+
+import upstream_sync
+
+
+class MetadataModeTest(TempDirTestCase):
+    """ which repos publish the upstream metadata (metadata = upstream) """
+
+    def prepare(self, repo_settings, **config_values):
+        config = self.make_config(**config_values)
+        self.write_file('repos.d/up.repo', '[up]\nurl = https://mirror.example.com/repo/x86_64\npath = up\n'
+                        'metadata = upstream\n' + repo_settings)
+        repo = upstream_sync.read_repos(config)[0]
+        job = upstream_sync.prepare_sync(config, repo, argparse.Namespace(verbose=False, dry_run=False, force=False))
+        if job['tmpfile']:
+            job['tmpfile'].close()
+        return job
+
+    def test_default_config(self):
+        self.assertEqual(self.prepare('')['upstream_metadata'], 'https://mirror.example.com/repo/x86_64')
+
+    def test_all_versions_synced(self):
+        self.assertNotIn('--newest-only', self.prepare('')['sync_cmd'])
+
+    def test_newest_only_of_repo(self):
+        self.assertIsNone(self.prepare('newest_only = true\n')['upstream_metadata'])
+
+    def test_exclude(self):
+        self.assertIsNone(self.prepare('exclude = foo*\n')['upstream_metadata'])
+
+    def test_keep_deleted(self):
+        self.assertIsNone(self.prepare('', sync_keep_deleted='true')['upstream_metadata'])
+
+    def test_plain_repo_keeps_newest_only(self):
+        self.write_file('repos.d/plain.repo', '[plain]\nurl = https://mirror.example.com/plain/x86_64\npath = plain\n')
+        config = self.make_config()
+        repo = [r for r in upstream_sync.read_repos(config) if r['name'] == 'plain'][0]
+        job = upstream_sync.prepare_sync(config, repo, argparse.Namespace(verbose=False, dry_run=False, force=False))
+        job['tmpfile'].close()
+        self.assertIn('--newest-only', job['sync_cmd'])
+        self.assertIsNone(job['upstream_metadata'])
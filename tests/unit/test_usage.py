@@ -0,0 +1,74 @@
+import os
+import shutil
+import unittest
+
+from helpers import TempDirTestCase
+
+import manifest
+import usage
+
+
+class UsageCacheTest(TempDirTestCase):
+
+    def setUp(self):
+        super(UsageCacheTest, self).setUp()
+        # x is shared, snap2 links it twice; y and z are unique
+        x = self.write_file('snap1/x', 'xxx')
+        self.write_file('snap1/y', 'yyyy')
+        self.write_file('snap2/z', 'zzzzzz')
+        os.link(x, os.path.join(self.tmp, 'snap2', 'x'))
+        os.link(x, os.path.join(self.tmp, 'snap2', 'x2'))
+        self.cache = usage.UsageCache(os.path.join(self.tmp, 'du.db'))
+
+    def tearDown(self):
+        self.cache.close()
+        super(UsageCacheTest, self).tearDown()
+
+    def add(self, snapshot):
+        path = os.path.join(self.tmp, snapshot)
+        entries = []
+        for name in os.listdir(path):
+            st = os.lstat(os.path.join(path, name))
+            entries.append((name, st.st_ino, st.st_size, st.st_mtime, manifest.FILE, ''))
+        manifest_path = os.path.join(self.tmp, snapshot + '.manifest')
+        manifest.write_manifest(manifest_path, entries)
+        self.cache.add_snapshot(snapshot, manifest_path)
+        return manifest_path
+
+    def freeable(self, snapshot):
+        return self.cache.freeable(snapshot, os.path.join(self.tmp, snapshot))
+
+    def test_add(self):
+        m1 = self.add('snap1')
+        m2 = self.add('snap2')
+        self.assertEqual(self.cache.snapshots(), {'snap1': (m1, 7, 4), 'snap2': (m2, 9, 6)})
+        self.assertEqual(self.cache.timeline_bytes(), 13)
+        self.assertEqual((self.freeable('snap1'), self.freeable('snap2')), (4, 6))
+
+    def test_linked_from_elsewhere(self):
+        self.add('snap1')
+        self.add('snap2')
+        os.link(os.path.join(self.tmp, 'snap2', 'z'), os.path.join(self.tmp, 'outside'))
+        self.assertEqual(self.freeable('snap2'), 0)
+
+    def test_remove(self):
+        self.add('snap1')
+        m2 = self.add('snap2')
+        self.cache.remove_snapshot('snap1')
+        shutil.rmtree(os.path.join(self.tmp, 'snap1'))
+
+        self.assertEqual(self.cache.snapshots(), {'snap2': (m2, 9, 9)})
+        self.assertEqual(self.cache.timeline_bytes(), 9)
+        # the new owner links x twice, which does not keep it from being freed
+        self.assertEqual(self.freeable('snap2'), 9)
+
+    def test_update(self):
+        m1 = self.add('snap1')
+        m2 = self.add('snap2')
+        os.remove(m1)
+        self.assertEqual(self.cache.update({'snap2': m2}), 1)
+        self.assertEqual(self.cache.snapshots(), {'snap2': (m2, 9, 9)})
+
+
+if __name__ == '__main__':
+    unittest.main()